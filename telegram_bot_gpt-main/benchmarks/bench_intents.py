@@ -0,0 +1,96 @@
+"""Точність і швидкість визначення наміру: послідовні any() проти IntentMatcher.
+
+intent_corpus.tsv — набір, на якому підбиралися ваги INTENT_KEYWORDS, тож точність
+на ньому завищена; intent_holdout.tsv — відкладений набір для чесної оцінки.
+
+Запуск з кореня проєкту: python benchmarks/bench_intents.py
+"""
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from intents import INTENT_KEYWORDS, IntentMatcher  # noqa: E402
+
+# Попередня реалізація interpret_random_input: перший збіг у фіксованому порядку
+LEGACY_KEYWORDS = [
+    ('random', ['факт', 'цікав', 'random', 'випадков']),
+    ('recommend', ['рекоменд', 'фільм', 'книга', 'музик', 'recommend']),
+    ('gpt', ['gpt', 'чат', 'питання', 'запита', 'дізнатися']),
+    ('talk', ['розмов', 'говори', 'спілкува', 'особист', 'talk']),
+    ('quiz', ['квіз', 'вікторин', 'quiz', 'питання']),
+    ('translate', ['переклад', 'translate', 'мова']),
+]
+
+
+def legacy_classify(text: str, keywords=LEGACY_KEYWORDS) -> str | None:
+    text = text.lower()
+    for intent, words in keywords:
+        if any(word in text for word in words):
+            return intent
+    return None
+
+
+def load_corpus(name: str) -> list[tuple[str, str | None]]:
+    corpus = []
+    with open(os.path.join(os.path.dirname(__file__), name), encoding='utf8') as file:
+        for line in file:
+            if line.strip() and not line.startswith('#'):
+                label, text = line.rstrip('\n').split('\t', 1)
+                corpus.append((text, None if label == 'none' else label))
+    return corpus
+
+
+def accuracy(classify, corpus) -> tuple[float, list[str]]:
+    errors = [f"  {text!r}: очікувалось {label}, отримано {classify(text)}"
+              for text, label in corpus if classify(text) != label]
+    return 1 - len(errors) / len(corpus), errors
+
+
+def per_message_us(classify, texts, number=200) -> float:
+    seconds = timeit.timeit(lambda: [classify(text) for text in texts], number=number)
+    return seconds / (number * len(texts)) * 1e6
+
+
+def synthetic_keywords(count: int) -> dict[str, dict[str, float]]:
+    # Випадкові "слова", що не збігаються з корпусом: перевіряємо, як час залежить від розміру словника
+    rng = random.Random(0)
+    alphabet = 'абвгґдеєжзиіїйклмнопрстуфхцчшщьюя'
+    keywords = {intent: dict(words) for intent, words in INTENT_KEYWORDS.items()}
+    for index in range(count):
+        word = ''.join(rng.choice(alphabet) for _ in range(rng.randint(5, 9)))
+        keywords[list(keywords)[index % len(keywords)]][word] = 1.0
+    return keywords
+
+
+def main():
+    corpus = load_corpus('intent_corpus.tsv')
+    texts = [text for text, _ in corpus]
+    matcher = IntentMatcher(INTENT_KEYWORDS)
+
+    for title, name in (('набір для підбору ваг', 'intent_corpus.tsv'), ('відкладений набір', 'intent_holdout.tsv')):
+        print(f"{title} ({name}):")
+        for classifier, classify in (('послідовні any()', legacy_classify), ('IntentMatcher', matcher.classify)):
+            score, errors = accuracy(classify, load_corpus(name))
+            print(f"  {classifier}: точність {score:.1%}")
+            for error in errors:
+                print(f"  {error}")
+
+    # Перший рядок — справжній словник бота, решта — з доданими синтетичними словами
+    print("\nЧас на повідомлення залежно від кількості ключових слів, мкс:")
+    print(f"{'слів':>6} {'any()':>10} {'automaton':>10}")
+    for extra in (0, 100, 1000, 5000):
+        keywords = synthetic_keywords(extra)
+        legacy_table = [(intent, list(words)) for intent, words in keywords.items()]
+        matcher = IntentMatcher(keywords)
+        total = sum(len(words) for words in keywords.values())
+        legacy = per_message_us(lambda text: legacy_classify(text, legacy_table), texts, number=20)
+        compiled = per_message_us(matcher.classify, texts, number=20)
+        print(f"{total:>6} {legacy:>10.1f} {compiled:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Швидкість екранування MarkdownV2 на довгих відповідях моделі.
+
+Порівнює markdown.escape з двома попередніми реалізаціями:
+util._markdown_v2_escape (18 викликів str.replace, без екранування '\\') та
+bot.escape_markdown_v2 (генератор по символах), а також з одним проходом
+str.translate, який у CPython повільніший на кириличному тексті.
+
+Запуск з кореня проєкту: python benchmarks/bench_markdown.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from markdown import escape, markup, md  # noqa: E402
+
+
+def legacy_util_escape(text: str) -> str:
+    # Попередня util._markdown_v2_escape
+    for char in r'_*[]()~`>#+-=|{}.!':
+        text = text.replace(char, f'\\{char}')
+    return text.replace('\\\\', '\\')
+
+
+def legacy_bot_escape(text: str) -> str:
+    # Попередня bot.escape_markdown_v2
+    escape_chars = r'_*[]()~`>#+-=|{}.!'
+    text = text.replace('\\', '\\\\')
+    return ''.join(f'\\{char}' if char in escape_chars and char != '\\' else char for char in text)
+
+
+_TRANSLATE_TABLE = str.maketrans({char: '\\' + char for char in '\\_*[]()~`>#+-=|{}.!'})
+
+
+def translate_escape(text: str) -> str:
+    return text.translate(_TRANSLATE_TABLE)
+
+
+def gpt_answer(length: int, seed: int = 0) -> str:
+    # Текст, схожий на відповідь моделі: кирилиця, пунктуація, списки, код і трохи розмітки
+    rng = random.Random(seed)
+    words = ['модель', 'відповідь', 'Telegram', 'приклад', 'функція', 'дані', 'користувач', 'запит',
+             '(див. нижче)', 'x = y + 1', '**важливо**', '`код`', '1.', '-', 'C:\\temp', 'v2.0!', '#тег']
+    parts = []
+    while sum(map(len, parts)) < length:
+        parts.append(rng.choice(words))
+        if rng.random() < 0.1:
+            parts.append('\n\n')
+    return ' '.join(parts)[:length]
+
+
+def bench(function, text: str, number: int) -> float:
+    return timeit.timeit(lambda: function(text), number=number) / number * 1e6
+
+
+def main():
+    implementations = (('util._markdown_v2_escape', legacy_util_escape),
+                       ('bot.escape_markdown_v2', legacy_bot_escape),
+                       ('str.translate', translate_escape),
+                       ('markdown.escape', escape))
+
+    sample = 'Шлях C:\\temp\\new — *важливо*.'
+    print("Екранування рядка", repr(sample))
+    for name, function in implementations:
+        print(f"  {name:<26} {function(sample)}")
+
+    print("\nЧас на одну відповідь, мкс:")
+    print(f"{'символів':>9}" + ''.join(f"{name:>27}" for name, _ in implementations))
+    for length in (500, 4000, 16000):
+        text = gpt_answer(length)
+        number = max(20, 200000 // length)
+        print(f"{length:>9}" + ''.join(f"{bench(function, text, number):>27.1f}" for _, function in implementations))
+
+    template = "✅ *Переклад на {target}:*\n\n{translation}"
+    translation = gpt_answer(4000, seed=1)
+    legacy = timeit.timeit(lambda: f"✅ *Переклад на {legacy_bot_escape('Англійська')}:*\n\n"
+                                   f"{legacy_bot_escape(translation)}", number=500) / 500 * 1e6
+    compiled = timeit.timeit(lambda: md(template, target='Англійська', translation=translation),
+                             number=500) / 500 * 1e6
+    print(f"\nШаблон з відповіддю на 4000 символів: f-рядок + escape_markdown_v2 {legacy:.1f} мкс, md() {compiled:.1f} мкс")
+
+    menu = open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'resources', 'messages', 'main.txt'), encoding='utf8').read()
+    uncached = timeit.timeit(lambda: legacy_util_escape(menu), number=5000) / 5000 * 1e6
+    cached = timeit.timeit(lambda: markup(menu), number=5000) / 5000 * 1e6
+    print(f"Статичне меню main.txt: util._markdown_v2_escape {uncached:.2f} мкс, markup() з кешу {cached:.2f} мкс")
+
+
+if __name__ == '__main__':
+    main()
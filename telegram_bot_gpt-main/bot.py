@@ -1,16 +1,38 @@
 import logging
-from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from telegram.ext import (
-    ApplicationBuilder, CallbackQueryHandler, ContextTypes, CommandHandler, MessageHandler, filters
+    ApplicationBuilder, CallbackContext, CallbackQueryHandler, ContextTypes, CommandHandler, ExtBot,
+    MessageHandler, filters
 )
+import asyncio
 import random
-import json
+from cache import ResponseCache
 from gpt import ChatGptService
+from routing import ModelRouter
+from schemas import QUIZ_QUESTION, RECOMMENDATION, MalformedOutput, extract_items, extract_strings
+from scheduler import ModelScheduler, Priority, SchedulerBusy
+from prefetch import PrefetchPool
+from facts import FactBuffer
+from recommend import RecommendationEngine, RecommendationQueue
+from processing import ChatOrderedUpdateProcessor
+from transport import configure_telegram, openai_http_client
+from persistence import SessionCodec, SQLitePersistence
+from session import Mode, QuizState, STATE_TYPES, UserSession
+from callbacks import CallbackRouter, callback_data
+from intents import INTENT_KEYWORDS, IntentMatcher
+from markdown import Markdown, escape, md
+from metrics import registry as metrics
 from util import (
     load_message, load_prompt, send_text, send_image, show_main_menu,
-    default_callback_handler, send_text_buttons
+    default_callback_handler, send_text_buttons, buttons_markup, edit_text, StreamingMessage,
+    FanOut, resources
+)
+from credentials import (
+    ChatGPT_TOKEN, BOT_TOKEN, QUIZ_POOL_PATH, RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL,
+    MAX_CONCURRENT_UPDATES, METRICS_LOG_INTERVAL, MODEL_MAX_CONCURRENT, USER_REQUESTS_PER_MINUTE,
+    USER_REQUEST_BURST, MODEL_ROUTES, MODEL_MAX_ATTEMPTS, SESSION_DB_PATH, SESSION_IDLE_TTL,
+    SESSION_MAX_RESIDENT, SESSION_SAVE_INTERVAL
 )
-from credentials import ChatGPT_TOKEN, BOT_TOKEN
 from telegram.error import Conflict, NetworkError
 
 # Налаштування базового логування
@@ -20,7 +42,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-chat_gpt = ChatGptService(ChatGPT_TOKEN)
+# Переклади та рекомендації часто повторюються між користувачами — такі відповіді кешуються.
+# Квізи та факти мають бути різними, тому однакові запити в цих режимах не об'єднуються.
+# Переклад чекає користувач, тому повільний запит перекладу дублюється (hedging).
+chat_gpt = ChatGptService(ChatGPT_TOKEN,
+                          cache=ResponseCache({'translator', 'recommend'},
+                                              ttl=RESPONSE_CACHE_TTL,
+                                              path=RESPONSE_CACHE_PATH),
+                          no_coalesce_modes={'quiz_generator', 'random'},
+                          scheduler=ModelScheduler(MODEL_MAX_CONCURRENT,
+                                                   user_rate=USER_REQUESTS_PER_MINUTE / 60,
+                                                   user_burst=USER_REQUEST_BURST),
+                          router=ModelRouter.from_json(MODEL_ROUTES),
+                          max_attempts=MODEL_MAX_ATTEMPTS,
+                          hedge_modes={'translator'},
+                          http_client=openai_http_client())
+
+# context.user_data — типізована сесія користувача (див. session.py)
+BotContext = CallbackContext[ExtBot, UserSession, dict, dict]
+
+# Швидка відповідь, коли планувальник відхилив запит до моделі
+BUSY_TEXT = "⏳ Зараз забагато запитів. Спробуйте ще раз за хвилину."
 
 # ===============================================
 #             ГЛОБАЛЬНІ КОНСТАНТИ
@@ -43,6 +85,15 @@ TRANSLATION_LANGUAGES = {
     'fr': 'Французька 🇫🇷'
 }
 
+# Підписи кнопок відомих особистостей; нові особистості (resources/prompts/talk_*.txt) отримують підпис з назви
+PERSONA_TITLES = {
+    'talk_cobain': 'Курт Кобейн 🎸',
+    'talk_hawking': 'Стівен Гокінг 🔭',
+    'talk_nietzsche': 'Фрідріх Ніцше 📚',
+    'talk_queen': 'Королева Єлизавета II 👑',
+    'talk_tolkien': 'Дж.Р.Р. Толкін 🧙‍♂️',
+}
+
 # Категорії для модуля рекомендацій
 RECOMMENDATION_CATEGORIES = {
     'rec_film': 'Фільми 🎬',
@@ -55,52 +106,109 @@ RECOMMENDATION_CATEGORIES = {
 #             ДОПОМІЖНА ФУНКЦІЯ
 # ===============================================
 
-def escape_markdown_v2(text: str) -> str:
-    """Допоміжна функція для екранування символів, що використовуються в MarkdownV2."""
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    text = text.replace('\\', '\\\\')
-    return ''.join(f'\\{char}' if char in escape_chars and char != '\\' else char for char in text)
+def persona_name(persona: str) -> str:
+    return persona.replace('talk_', '').replace('_', ' ').title()
+
+
+def conversation_key(update: Update) -> tuple:
+    """Ключ розмови з ChatGPT: кожен користувач у кожному чаті має власну історію."""
+    user_id = update.effective_user.id if update.effective_user else None
+    return update.effective_chat.id, user_id
+
+
+def start_conversation(update: Update, context: BotContext, prompt: str) -> None:
+    """Починає нову розмову з промптом prompt і забуває збережені репліки попередньої."""
+    chat_gpt.set_prompt(conversation_key(update), prompt)
+    context.user_data.remember(update.effective_chat.id, [])
 
 
 # ===============================================
 #             ОБРОБНИКИ КОМАНД
 # ===============================================
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.clear()
-
-    await show_main_menu(update, context, {
-        'start': 'Головне меню',
-        'recommend': 'Рекомендації 🍿',  # ДОДАНО
-        'random': 'Дізнатися випадковий цікавий факт 🧠',
-        'gpt': 'Задати питання чату GPT 🤖',
-        'talk': 'Поговорити з відомою особистістю 👤',
-        'quiz': 'Взяти участь у квізі ❓',
-        'translator': 'Перекладач 🌍'
-    })
+async def start(update: Update, context: BotContext):
+    context.user_data.reset()
 
     text = load_message('main')
-    await send_image(update, context, 'main')
-    await send_text(update, context, text)
+    # Меню команд налаштовується одночасно з надсиланням зображення та привітання
+    async with FanOut() as fan:
+        fan.start(show_main_menu(update, context, {
+            'start': 'Головне меню',
+            'recommend': 'Рекомендації 🍿',  # ДОДАНО
+            'random': 'Дізнатися випадковий цікавий факт 🧠',
+            'gpt': 'Задати питання чату GPT 🤖',
+            'talk': 'Поговорити з відомою особистістю 👤',
+            'quiz': 'Взяти участь у квізі ❓',
+            'translator': 'Перекладач 🌍'
+        }))
+        await send_image(update, context, 'main')
+        await send_text(update, context, text)
+
+# Скільки фактів просимо в одному запиті до ChatGPT
+FACTS_PER_REQUEST = 5
+
+
+async def generate_facts() -> list[str]:
+    """Генерує партію випадкових фактів одним запитом до ChatGPT."""
+    answer = await chat_gpt.send_question(
+        load_prompt('random'),
+        f"Розкажи мені {FACTS_PER_REQUEST} різних цікавих фактів з різних галузей. "
+        f"Поверни лише JSON-масив рядків, по одному факту в кожному рядку масиву.",
+        mode='random', priority=Priority.BACKGROUND)
+    try:
+        return extract_strings(answer)
+    except MalformedOutput:
+        # Модель іноді повертає факти звичайним списком — беремо непорожні рядки
+        facts = [line.strip(' -•0123456789.)') for line in answer.splitlines()]
+        return [fact.strip() for fact in facts if fact.strip()]
 
-async def random_fact(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await send_image(update, context, 'random')
 
-    message = await send_text(update, context, "🔍 Шукаю цікавий факт для вас...")
+# Буфер фактів: кнопка "Хочу ще факт" відповідає з пам'яті, а ChatGPT викликається партіями у фоні
+fact_buffer = FactBuffer(generate_facts)
 
-    try:
-        prompt = load_prompt('random')
-        fact = await chat_gpt.send_question(prompt, "Розкажи мені цікавий факт")
 
-        buttons = {
-            'random': 'Хочу ще факт 🔄',
-            'start': 'Закінчити 🏁'
-        }
+async def random_fact(update: Update, context: BotContext):
+    buttons = {
+        'random:more': 'Хочу ще факт 🔄',
+        'menu:start': 'Закінчити 🏁'
+    }
 
-        if message:
-            await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=message.message_id)
-        await send_text_buttons(update, context, f"📚 *Випадковий факт:*\n\n{fact}", buttons)
+    user_id = update.effective_user.id if update.effective_user else update.effective_chat.id
+    fact = await fact_buffer.next_fact(user_id)
+    if fact:
+        await send_image(update, context, 'random')
+        await send_text_buttons(update, context, md("📚 *Випадковий факт:*\n\n{fact}", fact=fact), buttons)
+        return
+
+    async def send_placeholder() -> Message:
+        await send_image(update, context, 'random')
+        return await send_text(update, context, "🔍 Шукаю цікавий факт для вас...")
 
+    # Буфер ще порожній — генеруємо один факт безпосередньо, показуючи його в міру генерації.
+    # Зображення та заглушка надсилаються у фоні, а потік читається лише в цій задачі:
+    # таймаут очікування фрагментів прив'язаний до задачі, яка читає потік
+    stream = chat_gpt.stream_question(load_prompt('random'), "Розкажи мені цікавий факт", user_id=user_id,
+                                      priority=Priority.CHAT, mode='random')
+    message = None
+    try:
+        async with FanOut() as fan:
+            placeholder = fan.start(send_placeholder())
+            try:
+                first_delta = await anext(stream, '')
+            finally:
+                # Заглушка потрібна й обробникам помилок нижче, тож дочікуємося її в будь-якому разі
+                message = await placeholder
+
+        # Факт з'являється в повідомленні-заглушці в міру генерації
+        writer = StreamingMessage(context, message, prefix=md("📚 *Випадковий факт:*\n\n"))
+        await writer.write(first_delta)
+        async for delta in stream:
+            await writer.write(delta)
+        await writer.finish(buttons_markup(buttons))
+        fact_buffer.mark_shown(user_id, writer.text)
+
+    except SchedulerBusy:
+        await edit_text(context, message, BUSY_TEXT, buttons_markup(buttons))
     except Exception as e:
         logger.error(f"Помилка при отриманні випадкового факту: {e}")
         await send_text(update, context, "😔 На жаль, виникла помилка при отриманні факту. Спробуйте ще раз пізніше.")
@@ -109,34 +217,29 @@ async def random_fact(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=message.message_id)
             except Exception:
                 pass
+    finally:
+        await stream.aclose()
 
 
-async def gpt_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.clear()
+async def gpt_handler(update: Update, context: BotContext):
+    context.user_data.enter(Mode.GPT)
     await send_image(update, context, 'gpt')
 
-    prompt = load_prompt('gpt')
-    chat_gpt.set_prompt(prompt)
+    start_conversation(update, context, load_prompt('gpt'))
 
     await send_text(update, context,
                     "🤖 Задайте питання, і я відповім на нього за допомогою ChatGPT.\nПросто надішліть текстове повідомлення.")
 
-    context.user_data['conversation_state'] = 'gpt'
-
 
-async def talk_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.clear()
+async def talk_handler(update: Update, context: BotContext):
+    context.user_data.enter(Mode.TALK)
     await send_image(update, context, 'talk')
 
-    personalities = {
-        'talk_cobain': 'Курт Кобейн 🎸',
-        'talk_hawking': 'Стівен Гокінг 🔭',
-        'talk_nietzsche': 'Фрідріх Ніцше 📚',
-        'talk_queen': 'Королева Єлизавета II 👑',
-        'talk_tolkien': 'Дж.Р.Р. Толкін 🧙‍♂️',
-        'start': 'Закінчити 🏁'
-    }
-    context.user_data['conversation_state'] = 'talk'
+    # Особистості — усі промпти talk_* з реєстру ресурсів
+    personalities = {callback_data('talk', 'pick', persona.removeprefix('talk_')):
+                         PERSONA_TITLES.get(persona, persona_name(persona))
+                     for persona in resources.prompt_names('talk_')}
+    personalities['menu:start'] = 'Закінчити 🏁'
 
     await send_text_buttons(update, context, "👤 Виберіть особистість, з якою ви хочете поспілкуватися:", personalities)
 
@@ -145,113 +248,126 @@ async def talk_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #          МОДУЛЬ РЕКОМЕНДАЦІЙ (НОВИЙ)
 # ===============================================
 
-async def generate_recommendation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Генерує рекомендацію, використовуючи ChatGPT, та надсилає її користувачеві."""
-    user_data = context.user_data
-    category_key = user_data.get('rec_category')
-    genre = user_data.get('rec_genre')
-    disliked_items = user_data.get('rec_disliked_items', [])
-
-    if not category_key or not genre:
-        await send_text(update, context, "⚠️ Помилка стану. Повертаю до вибору категорії.")
-        await recommendations_handler(update, context)
-        return
-
-    category_name_ukr = RECOMMENDATION_CATEGORIES.get(category_key, 'Контент').split(' ')[0]  # Фільми, Книги, Музика
-
-    waiting_message = await send_text(update, context,
-                                      f"🤖 *Запускаю AI:* Шукаю рекомендацію {category_name_ukr} у жанрі *{genre}*...")
-
+async def fetch_recommendations(category_name: str, genre: str, exclude: list[str], count: int,
+                                user_id: int | None = None) -> list[dict]:
+    """Отримує від ChatGPT ранжований список кандидатів-рекомендацій одним запитом."""
     system_prompt = (
         "Ти — експерт із рекомендацій культурного контенту. "
-        "Твоє завдання — рекомендувати один об'єкт (фільм, книгу або музичний альбом) "
-        "на основі наданої категорії та жанру. "
-        "Відповідь має бути у форматі JSON з полями: 'title' (назва), 'description' (короткий опис), 'reason' (чому це підходить). "
-        "НЕ повертай жодного тексту, окрім коректного JSON-об'єкта. "
+        f"Твоє завдання — рекомендувати {count} різних об'єктів (фільмів, книг або музичних альбомів) "
+        "на основі наданої категорії та жанру, впорядкованих від найкращого до найменш вдалого. "
+        "Відповідь має бути у форматі JSON-масиву об'єктів з полями: "
+        "'title' (назва), 'description' (короткий опис), 'reason' (чому це підходить). "
+        "НЕ повертай жодного тексту, окрім коректного JSON-масиву. "
     )
 
-    user_query = f"Порекомендуй мені один {category_name_ukr} у жанрі '{genre}'."
+    # Жанр у нижньому регістрі, щоб однакові запити різних користувачів збігалися в кеші
+    user_query = f"Порекомендуй мені {count} {category_name} у жанрі '{genre.strip().lower()}'."
 
-    if disliked_items:
-        disliked_list = ', '.join(disliked_items)
-        user_query += f" Уникай рекомендацій, пов'язаних із цими творами: {disliked_list}."
+    if exclude:
+        user_query += f" Уникай рекомендацій, пов'язаних із цими творами: {', '.join(exclude)}."
 
-    json_string = ""
+    answer = await chat_gpt.send_question(system_prompt, user_query, mode='recommend', user_id=user_id)
     try:
-        chat_gpt.set_prompt(system_prompt)
-        json_string = await chat_gpt.send_question(system_prompt, user_query)
+        # Некоректні кандидати модель виправляє окремим коротким запитом, решта відповіді не губиться
+        return await extract_items(
+            answer, RECOMMENDATION,
+            reask=lambda request: chat_gpt.send_question(system_prompt, request, mode='recommend',
+                                                         user_id=user_id))
+    except MalformedOutput as e:
+        logger.error(f"Помилка парсингу JSON від GPT: {e}. Рядок: {answer[:200]}...")
+        raise
 
-        # 1. Парсинг JSON
-        json_string = json_string.strip().replace("```json", "").replace("```", "").strip()
-        recommendation_data = json.loads(json_string)
 
-        if not all(k in recommendation_data for k in ['title', 'description', 'reason']):
-            raise ValueError("Некоректна структура JSON від GPT.")
+# Рекомендації видаються з черги сесії; до ChatGPT звертаємось, лише коли черга порожня
+recommendation_engine = RecommendationEngine(fetch_recommendations)
 
-        # 2. Збереження поточної рекомендації
-        user_data['rec_current_suggestion'] = recommendation_data
 
-        # 3. Видалення повідомлення очікування
-        if waiting_message:
-            await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
+async def generate_recommendation(update: Update, context: BotContext):
+    """Надсилає наступну рекомендацію з черги сесії, за потреби дозапитуючи кандидатів у ChatGPT."""
+    session = context.user_data
+    recommend = session.recommend
+    queue = recommend.queue if recommend else None
+
+    if not queue:
+        await send_text(update, context, "⚠️ Помилка стану. Повертаю до вибору категорії.")
+        await recommendations_handler(update, context)
+        return
+
+    category_name_ukr = queue.category
 
-        # 4. Форматування та надсилання (Використовуємо escape_markdown_v2)
-        title = escape_markdown_v2(recommendation_data['title'])
-        description = escape_markdown_v2(recommendation_data['description'])
-        reason = escape_markdown_v2(recommendation_data['reason'])
+    waiting_message = None
+    if not queue.candidates:
+        waiting_message = await send_text(update, context,
+                                          md("🤖 *Запускаю AI:* Шукаю рекомендацію {category} у жанрі *{genre}*...",
+                                             category=category_name_ukr, genre=queue.genre))
 
-        rec_text = (
-            f"🍿 *Рекомендація {category_name_ukr}*:\n\n"
-            f"✨ \\*\\*{title}\\*\\*\\*\n\n"
-            f"📝 {description}\n\n"
-            f"💡 \\*Чому це підходить\\: * {reason}"
-        )
+    try:
+        # 1. Наступний кандидат з черги
+        recommendation_data = await recommendation_engine.next(queue, update.effective_user.id)
+        if recommendation_data is None:
+            raise ValueError("GPT не запропонував нових рекомендацій.")
+
+        # 2. Збереження поточної рекомендації
+        recommend.current = recommendation_data
+
+        # 3. Форматування та надсилання (значення від моделі екрануються шаблоном)
+        rec_text = md("🍿 *Рекомендація {category}*:\n\n"
+                      "✨ *{title}*\n\n"
+                      "📝 {description}\n\n"
+                      "💡 *Чому це підходить:* {reason}",
+                      category=category_name_ukr, title=recommendation_data['title'],
+                      description=recommendation_data['description'], reason=recommendation_data['reason'])
 
         buttons = {
-            'rec_dislike': 'Не подобається 👎',
-            'start': 'Закінчити 🏁'
+            'rec:dislike': 'Не подобається 👎',
+            'menu:start': 'Закінчити 🏁'
         }
 
-        # Надсилання рекомендації з кнопками
-        await send_text_buttons(update, context, rec_text, buttons)
-        user_data['conversation_state'] = 'recommend_active'
+        # 4. Показ рекомендації з кнопками (замість повідомлення очікування, якщо воно було)
+        if waiting_message:
+            await edit_text(context, waiting_message, rec_text, buttons_markup(buttons))
+        else:
+            await send_text_buttons(update, context, rec_text, buttons)
+        session.advance(Mode.RECOMMEND_ACTIVE)
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Помилка парсингу JSON від GPT: {e}. Рядок: {json_string[:200]}...")
+    except MalformedOutput:
         if waiting_message:
             await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
         await send_text(update, context,
                         "😔 На жаль, AI повернув некоректний формат відповіді. Спробуйте ще раз пізніше.")
-        user_data.pop('conversation_state', None)
+        session.reset()
+    except SchedulerBusy:
+        if waiting_message:
+            await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
+        await send_text(update, context, BUSY_TEXT)
+        session.reset()
     except Exception as e:
         logger.error(f"Невідома помилка генерації рекомендації: {e}")
         if waiting_message:
             await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
         await send_text(update, context, "😔 Виникла помилка при зверненні до ChatGPT. Спробуйте пізніше.")
-        user_data.pop('conversation_state', None)
+        session.reset()
 
 
-async def recommendations_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def recommendations_handler(update: Update, context: BotContext):
     """Обробник команди /recommend: запитує категорію."""
-    context.user_data.clear()
-    context.user_data['conversation_state'] = 'recommend_category'
-    context.user_data['rec_disliked_items'] = []
+    context.user_data.enter(Mode.RECOMMEND_CATEGORY)
 
     await send_image(update, context, 'recommend')
 
     keyboard = []
     for key, name in RECOMMENDATION_CATEGORIES.items():
-        keyboard.append([InlineKeyboardButton(name, callback_data=f"rec_category|{key}")])
+        keyboard.append([InlineKeyboardButton(name, callback_data=callback_data('rec', 'category', key))])
 
-    keyboard.append([InlineKeyboardButton("❌ Скасувати", callback_data="start")])
+    keyboard.append([InlineKeyboardButton("❌ Скасувати", callback_data='menu:start')])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await send_text(update, context,
-                    "🍿 *Рекомендації:* Виберіть, що ви шукаєте:",
+                    md("🍿 *Рекомендації:* Виберіть, що ви шукаєте:"),
                     reply_markup)
 
 
-async def recommendations_category_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def recommendations_category_callback(update: Update, context: BotContext, category_key: str | None):
     """Обробник вибору категорії: запитує жанр."""
     query = update.callback_query
     await query.answer()
@@ -261,68 +377,101 @@ async def recommendations_category_callback(update: Update, context: ContextType
     except Exception:
         pass
 
-    _, category_key = query.data.split('|')
     category_name = RECOMMENDATION_CATEGORIES.get(category_key, 'Контент')
 
-    context.user_data['rec_category'] = category_key
-    context.user_data['conversation_state'] = 'recommend_genre'
+    session = context.user_data
+    # Клавіатуру категорій могли натиснути вже після виходу з режиму рекомендацій
+    if session.mode not in (Mode.RECOMMEND_CATEGORY, Mode.RECOMMEND_GENRE):
+        session.enter(Mode.RECOMMEND_CATEGORY)
+    session.recommend.category = category_key
+    session.advance(Mode.RECOMMEND_GENRE)
 
     await send_text(update, context,
-                    f"✅ Вибрано: *{category_name}*.\n\n"
-                    f"➡️ *Введіть жанр*, який вас цікавить (наприклад, 'фантастика', 'класика', 'джаз').")
+                    md("✅ Вибрано: *{category}*.\n\n"
+                       "➡️ *Введіть жанр*, який вас цікавить (наприклад, 'фантастика', 'класика', 'джаз').",
+                       category=category_name))
 
 
-async def recommendations_feedback_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обробник кнопок 'Не подобається' та 'Закінчити'."""
+async def recommendations_dislike_callback(update: Update, context: BotContext, _: str | None):
+    """Обробник кнопки 'Не подобається'."""
     query = update.callback_query
     await query.answer()
 
-    data = query.data
-
     try:
         await query.edit_message_reply_markup(reply_markup=None)
     except Exception:
         pass
 
-    if data == 'start':
-        context.user_data.pop('conversation_state', None)
-        context.user_data.pop('rec_disliked_items', None)
-        context.user_data.pop('rec_current_suggestion', None)
-        await start(update, context)
-        return
-
-    if data == 'rec_dislike':
-        current_suggestion = context.user_data.get('rec_current_suggestion')
-
-        if current_suggestion and 'title' in current_suggestion:
-            title = current_suggestion['title']
-            disliked_items = context.user_data.get('rec_disliked_items', [])
+    recommend = context.user_data.recommend
+    current_suggestion = recommend.current if recommend else None
 
-            if title not in disliked_items:
-                disliked_items.append(title)
+    if current_suggestion and 'title' in current_suggestion:
+        # Показані назви вже пам'ятає черга сесії — вони не повторяться
+        title = current_suggestion['title']
+        recommend.current = None  # Очищаємо поточну рекомендацію
 
-            context.user_data['rec_disliked_items'] = disliked_items
-            context.user_data['rec_current_suggestion'] = None  # Очищаємо поточну рекомендацію
-
-            await send_text(update, context,
-                            f"✍️ Добре, *'{escape_markdown_v2(title)}'* додано до списку небажаних. Шукаю нове...")
-            await generate_recommendation(update, context)
-        else:
-            await send_text(update, context,
-                            "⚠️ Не вдалося знайти попередню рекомендацію для виключення. Генерую нову.")
-            await generate_recommendation(update, context)
+        await send_text(update, context,
+                        md("✍️ Добре, *'{title}'* додано до списку небажаних. Шукаю нове...", title=title))
+        await generate_recommendation(update, context)
+    else:
+        await send_text(update, context,
+                        "⚠️ Не вдалося знайти попередню рекомендацію для виключення. Генерую нову.")
+        await generate_recommendation(update, context)
 
 
 # ===============================================
 #          ДИНАМІЧНА ЛОГІКА КВІЗУ
 # ===============================================
 
+# Кількість питань в одному квізі
+QUIZ_LENGTH = 3
+
+
+async def ask_quiz_generator(request: str, priority: Priority = Priority.BACKGROUND,
+                             user_id: int | None = None) -> str:
+    return await chat_gpt.send_question(load_prompt('quiz_generator'), request,
+                                        mode='quiz_generator', priority=priority, user_id=user_id)
+
+
+async def generate_quiz_questions(priority: Priority = Priority.BACKGROUND, user_id: int | None = None) -> list[dict]:
+    """Генерує партію питань квізу через ChatGPT.
+
+    Кожне питання перевіряється за схемою ще до того, як потрапить у пул: некоректні
+    питання модель виправляє окремим запитом, а ті, що не вдалося виправити, відкидаються.
+    Поповнення пулу у фоні йде з пріоритетом BACKGROUND; коли на питання чекає
+    користувач, передаються його пріоритет та user_id.
+    """
+    answer = await ask_quiz_generator("Згенеруй мені квіз", priority, user_id)
+    try:
+        return await extract_items(answer, QUIZ_QUESTION,
+                                   reask=lambda request: ask_quiz_generator(request, priority, user_id))
+    except MalformedOutput as e:
+        logger.error(f"Помилка парсингу JSON від GPT: {e}. Рядок: {answer[:200]}...")
+        raise
+
+
+def quiz_question_key(question_data: dict) -> str:
+    """Нормалізований текст питання — за ним відкидаються дублікати."""
+    return ' '.join(question_data['question'].lower().split())
+
+
+# Пул заздалегідь згенерованих питань: /quiz стартує одразу, а генерація йде у фоні
+quiz_pool = PrefetchPool('quiz', generate_quiz_questions, quiz_question_key,
+                         capacity=10 * QUIZ_LENGTH, low_watermark=3 * QUIZ_LENGTH,
+                         spill_path=QUIZ_POOL_PATH, validate=lambda item: QUIZ_QUESTION.validate(item)[0])
+
+
+def quiz_question_text(index: int, questions: list[dict]) -> Markdown:
+    return md("❓ *Питання {number} з {total}:*\n\n{question}",
+              number=index + 1, total=len(questions), question=questions[index]['question'])
+
+
 # Допоміжна функція: НАДІСЛАТИ ПИТАННЯ КВІЗУ
-async def send_quiz_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    current_question_index = user_data.get('current_quiz_index', 0)
+async def send_quiz_question(update: Update, context: BotContext):
+    quiz = context.user_data.quiz or QuizState()
+    current_question_index = quiz.index
 
-    questions = user_data.get('dynamic_quiz_questions', [])
+    questions = quiz.questions
 
     if not questions:
         await send_text(update, context, "😔 Помилка: Не вдалося згенерувати питання для квізу. Спробуйте пізніше.")
@@ -345,237 +494,216 @@ async def send_quiz_question(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Створення клавіатури з варіантами відповідей
     keyboard = []
     for i, option in enumerate(question_data["options"]):
-        callback_data = f"quiz_answer_{i}"
-        keyboard.append([InlineKeyboardButton(option, callback_data=callback_data)])
+        keyboard.append([InlineKeyboardButton(option, callback_data=callback_data('quiz', 'answer', str(i)))])
 
-    keyboard.append([InlineKeyboardButton("Закінчити квіз 🏁", callback_data="quiz_finish")])
+    keyboard.append([InlineKeyboardButton("Закінчити квіз 🏁", callback_data='quiz:finish')])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    question_text = f"❓ *Питання {current_question_index + 1} з {len(questions)}:*\n\n{question_data['question']}"
+    question_text = quiz_question_text(current_question_index, questions)
 
     # Завжди надсилаємо нове повідомлення
     message = await send_text(update, context, question_text, reply_markup=reply_markup)
-    user_data['quiz_message_id'] = message.message_id
+    quiz.message_id = message.message_id
 
 
 # ОСНОВНИЙ ОБРОБНИК КОМАНДИ /quiz
-async def quiz_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.clear()
-
-    context.user_data['conversation_state'] = 'quiz'
-    context.user_data['score'] = 0
-    context.user_data['current_quiz_index'] = 0
-
-    await send_image(update, context, 'quiz')
-
-    # 1. Запит до ChatGPT
-    waiting_message = await send_text(update, context,
-                                      "🤖 *Запускаю AI:* Генерую унікальний квіз на 3 питання у сфері загальних знань...")
-
-    # Ініціалізація json_string на випадок помилки
-    json_string = ""
-    quiz_prompt = load_prompt('quiz_generator')
+async def quiz_handler(update: Update, context: BotContext):
+    quiz = context.user_data.enter(Mode.QUIZ)
+
+    # 1. Питання беремо з пулу; до ChatGPT звертаємось одразу лише якщо пул порожній.
+    # Генерація йде одночасно з надсиланням зображення та заглушки
+    generating = len(quiz_pool) < QUIZ_LENGTH
+    waiting_message = None
+    async with FanOut() as fan:
+        # Якщо пул порожній, користувач чекає на генерацію — вона йде з пріоритетом CHAT і в його ліміті
+        questions = fan.start(quiz_pool.take(
+            QUIZ_LENGTH, produce=lambda: generate_quiz_questions(Priority.CHAT, update.effective_user.id)))
+        await send_image(update, context, 'quiz')
+        if generating:
+            waiting_message = await send_text(update, context,
+                                              md("🤖 *Запускаю AI:* Генерую унікальний квіз на {count} питання у сфері загальних знань...",
+                                                 count=QUIZ_LENGTH))
 
-    try:
-        json_string = await chat_gpt.send_question(quiz_prompt, "Згенеруй мені квіз")
-
-        json_string = json_string.strip().replace("```json", "").replace("```", "").strip()
-
-        dynamic_questions = json.loads(json_string)
-        context.user_data['dynamic_quiz_questions'] = dynamic_questions
+        try:
+            quiz.questions = await questions
 
-        if waiting_message:
-            await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
+            if waiting_message:
+                await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
 
-        await send_text(update, context, "🎉 *Квіз готовий!* Починаємо.")
+            await send_text(update, context, md("🎉 *Квіз готовий!* Починаємо."))
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Помилка парсингу JSON від GPT: {e}. Рядок: {json_string[:200]}...")
-        if waiting_message:
-            await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
-        await send_text(update, context,
-                        "😔 На жаль, ChatGPT повернув некоректний формат квізу. Спробуйте ще раз пізніше.")
-        context.user_data.clear()
-        return
-    except Exception as e:
-        logger.error(f"Невідома помилка генерації квізу: {e}")
-        if waiting_message:
-            await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
-        await send_text(update, context, "😔 Виникла помилка при зверненні до ChatGPT. Спробуйте пізніше.")
-        context.user_data.clear()
-        return
+        except ValueError:  # зокрема MalformedOutput
+            if waiting_message:
+                await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
+            await send_text(update, context,
+                            "😔 На жаль, ChatGPT повернув некоректний формат квізу. Спробуйте ще раз пізніше.")
+            context.user_data.reset()
+            return
+        except SchedulerBusy:
+            if waiting_message:
+                await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
+            await send_text(update, context, BUSY_TEXT)
+            context.user_data.reset()
+            return
+        except Exception as e:
+            logger.error(f"Невідома помилка генерації квізу: {e}")
+            if waiting_message:
+                await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=waiting_message.message_id)
+            await send_text(update, context, "😔 Виникла помилка при зверненні до ChatGPT. Спробуйте пізніше.")
+            context.user_data.reset()
+            return
 
     await send_quiz_question(update, context)
 
 
 # ФУНКЦІЯ ЗАВЕРШЕННЯ КВІЗУ
-async def finish_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    score = context.user_data.get('score', 0)
-    total = len(context.user_data.get('dynamic_quiz_questions', []))
+async def finish_quiz(update: Update, context: BotContext):
+    quiz = context.user_data.quiz or QuizState()
+    score = quiz.score
+    total = len(quiz.questions)
+    quiz_message_id = quiz.message_id
+    context.user_data.reset()
 
-    context.user_data.pop('conversation_state', None)
-    context.user_data.pop('score', None)
-    context.user_data.pop('current_quiz_index', None)
-    context.user_data.pop('dynamic_quiz_questions', None)
-
-    quiz_message_id = context.user_data.pop('quiz_message_id', None)
     if quiz_message_id:
         try:
             await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=quiz_message_id)
         except Exception:
             pass
 
-    result_text = f"🎉 \\*Квіз завершено\\!\\* 🎉\n\nВаш результат: \\*\\*{score} з {total}\\*\\*\\."
+    result_text = md("🎉 *Квіз завершено!* 🎉\n\nВаш результат: *{score} з {total}*.", score=score, total=total)
 
     if score == total:
-        result_text += "\n\n🤩 Фантастично\\! Ви справжній ерудит\\!"
+        result_text += "\n\n🤩 Фантастично! Ви справжній ерудит!"
     elif score >= total / 2:
-        result_text += "\n\n👍 Добре\\! Продовжуйте в тому ж дусі\\."
+        result_text += "\n\n👍 Добре! Продовжуйте в тому ж дусі."
     else:
-        result_text += "\n\n🧐 Є над чим попрацювати\\. Спробуйте ще раз\\!"
+        result_text += "\n\n🧐 Є над чим попрацювати. Спробуйте ще раз!"
 
     buttons = {
-        'quiz_restart': 'Спробувати ще раз 🔄',
-        'start': 'Головне меню 🏠'
+        'quiz:restart': 'Спробувати ще раз 🔄',
+        'menu:start': 'Головне меню 🏠'
     }
 
     await send_text_buttons(update, context, result_text, buttons)
 
 # Обробник колбеків для квізу
-async def quiz_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def quiz_finish_callback(update: Update, context: BotContext, _: str | None):
     query = update.callback_query
     await query.answer()
 
-    data = query.data
-    user_data = context.user_data
-    current_index = user_data.get('current_quiz_index', 0)
-    questions = user_data.get('dynamic_quiz_questions', [])
-
-    if data == 'quiz_finish':
-        try:
-            await query.edit_message_reply_markup(reply_markup=None)
-        except Exception:
-            pass
-        await finish_quiz(update, context)
-        return
-
-    if data.startswith('quiz_answer_'):
-        try:
-            answer_index = int(data.replace('quiz_answer_', ''))
-        except ValueError:
-            logger.error(f"Некоректний індекс відповіді: {data}")
-            return
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await finish_quiz(update, context)
 
-        if current_index >= len(questions):
-            try:
-                await query.edit_message_reply_markup(reply_markup=None)
-            except Exception:
-                pass
-            return
 
-        question_data = questions[current_index]
-        correct_answer = question_data.get("correct_answer")
-        options = question_data.get("options")
+async def quiz_answer_callback(update: Update, context: BotContext, answer: str | None):
+    query = update.callback_query
+    await query.answer()
 
-        if not correct_answer or not options or answer_index >= len(options):
-            logger.error(f"Не вдалося знайти коректну відповідь або опцію. Q:{question_data}, Index:{answer_index}")
-            await query.edit_message_text(
-                escape_markdown_v2("Помилка: Не вдалося визначити правильну відповідь або опції. Квіз припинено."),
-                parse_mode='MarkdownV2')
-            await finish_quiz(update, context)
-            return
+    quiz = context.user_data.quiz or QuizState()
+    current_index = quiz.index
+    questions = quiz.questions
 
-        user_answer = options[answer_index]
+    try:
+        answer_index = int(answer)
+    except (TypeError, ValueError):
+        logger.error(f"Некоректний індекс відповіді: {answer}")
+        return
 
-        # Виділення клавіатури після відповіді
+    if current_index >= len(questions):
         try:
             await query.edit_message_reply_markup(reply_markup=None)
         except Exception:
             pass
+        return
 
-        user_answer_esc = escape_markdown_v2(str(user_answer))
-        correct_answer_esc = escape_markdown_v2(str(correct_answer))
+    question_data = questions[current_index]
+    correct_answer = question_data.get("correct_answer")
+    options = question_data.get("options")
 
-        if user_answer == correct_answer:
-            feedback = "✅ \\*Правильно\\!\\*"
-            user_data['score'] += 1
-        else:
-            feedback = f"❌ \\*Неправильно\\.\\* Правильна відповідь: \\*\\*{correct_answer_esc}\\*\\*\\."
+    if not correct_answer or not options or answer_index >= len(options):
+        logger.error(f"Не вдалося знайти коректну відповідь або опцію. Q:{question_data}, Index:{answer_index}")
+        await query.edit_message_text(
+            escape("Помилка: Не вдалося визначити правильну відповідь або опції. Квіз припинено."),
+            parse_mode='MarkdownV2')
+        await finish_quiz(update, context)
+        return
+
+    user_answer = options[answer_index]
 
-        original_text = query.message.text
+    # Виділення клавіатури після відповіді
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except Exception:
+        pass
 
-        question_parts = original_text.split('\n\n')
-        question_header_body = "\n\n".join(question_parts[:2])
+    if user_answer == correct_answer:
+        feedback = md("✅ *Правильно!*")
+        quiz.score += 1
+    else:
+        feedback = md("❌ *Неправильно.* Правильна відповідь: *{answer}*.", answer=correct_answer)
 
-        final_text = (
-            f"{escape_markdown_v2(question_header_body)}\n\n"
-            f"Ваша відповідь: \\*\\*{user_answer_esc}\\*\\*\n"
-            f"{feedback}"
-        )
+    final_text = md("{question}\n\nВаша відповідь: *{answer}*\n{feedback}",
+                    question=quiz_question_text(current_index, questions), answer=user_answer,
+                    feedback=feedback)
 
-        await query.edit_message_text(final_text, parse_mode='MarkdownV2')
+    await query.edit_message_text(final_text, parse_mode='MarkdownV2')
 
-        user_data['current_quiz_index'] = current_index + 1
-        user_data.pop('quiz_message_id', None)
+    quiz.index = current_index + 1
+    quiz.message_id = None
 
-        await send_quiz_question(update, context)
+    await send_quiz_question(update, context)
 
-async def post_quiz_buttons_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def quiz_restart_callback(update: Update, context: BotContext, _: str | None):
     query = update.callback_query
     await query.answer()
-    data = query.data
 
     try:
         await query.edit_message_reply_markup(reply_markup=None)
     except Exception:
         pass
 
-    if data == 'quiz_restart':
-        await quiz_handler(update, context)
-    elif data == 'start':
-        await start(update, context)
+    await quiz_handler(update, context)
 
 
 # ===============================================
 #          ЛОГІКА ПЕРЕКЛАДАЧА
 # ===============================================
 
-async def translator_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.callback_query or update.message and update.message.text == '/translator':
-        context.user_data.clear()
-        context.user_data['conversation_state'] = 'translate'
-        context.user_data['language_from'] = None
-        context.user_data['language_to'] = None
+async def translator_handler(update: Update, context: BotContext, _: str | None = None):
+    context.user_data.enter(Mode.TRANSLATE)
 
-    await send_text(update, context, "🌍 *Режим Перекладача.*")
-    await translator_send_language_selection(update, context, 'language_from')
+    await send_text(update, context, md("🌍 *Режим Перекладача.*"))
+    await translator_send_language_selection(update, context, 'from')
 
 
-async def translator_send_language_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, step: str):
-    """Надсилає кнопки для вибору мови ('language_from' або 'language_to')."""
+async def translator_send_language_selection(update: Update, context: BotContext, step: str):
+    """Надсилає кнопки для вибору мови ('from' — мова оригіналу, 'to' — мова перекладу)."""
 
-    current_from = context.user_data.get('language_from')
+    translate = context.user_data.translate
+    current_from = translate.source if translate else None
 
-    if step == 'language_from':
-        text = "1️⃣ *Виберіть мову оригіналу:*"
+    if step == 'from':
+        text = md("1️⃣ *Виберіть мову оригіналу:*")
     else:
-        text = "2️⃣ *Виберіть мову, на яку потрібно перекласти:*"
+        text = md("2️⃣ *Виберіть мову, на яку потрібно перекласти:*")
 
     keyboard = []
     for code, name in TRANSLATION_LANGUAGES.items():
-        if step == 'language_to' and code == current_from:
+        if step == 'to' and code == current_from:
             continue
 
-        callback_data = f"translate_select|{step}|{code}"
-        keyboard.append([InlineKeyboardButton(name, callback_data=callback_data)])
+        keyboard.append([InlineKeyboardButton(name, callback_data=callback_data('tr', 'lang', f"{step}:{code}"))])
 
-    keyboard.append([InlineKeyboardButton("❌ Скасувати", callback_data="start")])
+    keyboard.append([InlineKeyboardButton("❌ Скасувати", callback_data='menu:start')])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await send_text(update, context, text, reply_markup)
 
 
-async def translator_select_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def translator_select_language(update: Update, context: BotContext, selection: str | None):
     query = update.callback_query
     await query.answer()
 
@@ -584,37 +712,37 @@ async def translator_select_language(update: Update, context: ContextTypes.DEFAU
     except Exception:
         pass
 
-    _, step, code = query.data.split('|')
+    step, _, code = (selection or '').partition(':')
     language_name = TRANSLATION_LANGUAGES.get(code)
 
-    user_data = context.user_data
+    session = context.user_data
+    translate = session.translate or session.enter(Mode.TRANSLATE)
 
-    if step == 'language_from':
-        user_data['language_from'] = code
-        user_data['language_from_name'] = language_name
+    if step == 'from':
+        translate.source = code
+        translate.source_name = language_name
 
-        await send_text(update, context, f"✅ *Мова оригіналу:* {language_name}")
-        await translator_send_language_selection(update, context, 'language_to')
+        await send_text(update, context, md("✅ *Мова оригіналу:* {name}", name=language_name))
+        await translator_send_language_selection(update, context, 'to')
 
-    elif step == 'language_to':
-        user_data['language_to'] = code
-        user_data['language_to_name'] = language_name
+    elif step == 'to':
+        translate.target = code
+        translate.target_name = language_name
 
-        await send_text(update, context, f"✅ *Мова перекладу:* {language_name}")
+        await send_text(update, context, md("✅ *Мова перекладу:* {name}", name=language_name))
 
         await send_text(update, context,
-                        f"🎉 *Налаштування завершено.* "
-                        f"Перекладаємо з *{user_data['language_from_name']}* на *{user_data['language_to_name']}*.\n\n"
-                        f"➡️ *Надішліть текст, який потрібно перекласти.*")
-
-    context.user_data['conversation_state'] = 'translate'
+                        md("🎉 *Налаштування завершено.* "
+                           "Перекладаємо з *{source}* на *{target}*.\n\n"
+                           "➡️ *Надішліть текст, який потрібно перекласти.*",
+                           source=translate.source_name, target=translate.target_name))
 
 
 # ===============================================
 #          ОБРОБНИК ПРОДОВЖЕННЯ РОЗМОВИ
 # ===============================================
 
-async def gpt_continue_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def gpt_continue_handler(update: Update, context: BotContext, _: str | None):
     query = update.callback_query
     await query.answer()
 
@@ -623,14 +751,14 @@ async def gpt_continue_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     except Exception:
         pass
 
-    state = context.user_data.get('conversation_state')
+    session = context.user_data
 
-    if state == 'gpt':
-        await send_text(update, context, "🤖 *Режим ChatGPT активний.* Надішліть ваше наступне питання.")
-    elif state == 'talk':
-        personality_key = context.user_data.get('selected_personality', 'Особистість')
-        personality_name = personality_key.replace('talk_', '').replace('_', ' ').title()
-        await send_text(update, context, f"👤 *Розмова з {personality_name} активна.* Продовжуйте спілкування.")
+    if session.mode is Mode.GPT:
+        await send_text(update, context, md("🤖 *Режим ChatGPT активний.* Надішліть ваше наступне питання."))
+    elif session.mode is Mode.TALK:
+        personality_name = persona_name(session.talk.personality or 'Особистість')
+        await send_text(update, context, md("👤 *Розмова з {name} активна.* Продовжуйте спілкування.",
+                                            name=personality_name))
     else:
         await start(update, context)
 
@@ -639,59 +767,65 @@ async def gpt_continue_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 #            ОБРОБНИКИ КОЛБЕКІВ ТА ПОВІДОМЛЕНЬ
 # ===============================================
 
-async def random_fact_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def menu_start_callback(update: Update, context: BotContext, _: str | None):
     query = update.callback_query
     await query.answer()
 
-    data = query.data
-
     try:
         await query.edit_message_reply_markup(reply_markup=None)
     except Exception:
         pass
 
-    if data == 'random':
-        await random_fact(update, context)
-    elif data == 'start':
-        await start(update, context)
+    await start(update, context)
 
 
-async def talk_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def random_fact_button_handler(update: Update, context: BotContext, _: str | None):
     query = update.callback_query
     await query.answer()
 
-    data = query.data
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+
+    await random_fact(update, context)
 
+
+async def drop_buttons(query) -> None:
     try:
         await query.edit_message_reply_markup(reply_markup=None)
     except Exception:
         pass
 
-    if data == 'start':
-        context.user_data.pop('conversation_state', None)
-        context.user_data.pop('selected_personality', None)
-        await start(update, context)
-        return
 
-    if data.startswith('talk_'):
-        context.user_data.clear()
-        context.user_data['selected_personality'] = data
-        context.user_data['conversation_state'] = 'talk'
+async def talk_button_handler(update: Update, context: BotContext, name: str | None):
+    query = update.callback_query
+    persona = f"talk_{name}"
 
-        prompt = load_prompt(data)
-        chat_gpt.set_prompt(prompt)
+    # Відповідь на натискання та зняття кнопок не впливають на нові повідомлення — виконуються паралельно з ними
+    async with FanOut() as fan:
+        fan.start(query.answer())
+        fan.start(drop_buttons(query))
 
-        personality_name = data.replace('talk_', '').replace('_', ' ').title()
+        if resources.prompt(persona) is None:
+            # Промпт особистості видалили, поки кнопка була на екрані
+            await talk_handler(update, context)
+            return
 
-        await send_image(update, context, data)
+        context.user_data.enter(Mode.TALK).personality = persona
 
-        buttons = {'gpt_continue': 'Почати розмову 💬', 'start': 'Закінчити 🏁'}
+        start_conversation(update, context, load_prompt(persona))
+
+        await send_image(update, context, persona)
+
+        buttons = {'chat:continue': 'Почати розмову 💬', 'menu:start': 'Закінчити 🏁'}
         await send_text_buttons(update, context,
-                                f"👤 Ви почали розмову з *{personality_name}*. Надішліть повідомлення, щоб отримати відповідь.",
+                                md("👤 Ви почали розмову з *{name}*. Надішліть повідомлення, щоб отримати відповідь.",
+                                   name=persona_name(persona)),
                                 buttons)
 
 
-async def show_funny_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_funny_response(update: Update, context: BotContext):
     funny_responses = [
         "🤔 Хмм... Цікаво, але я не зрозумів, що саме ви хочете. Може спробуєте одну з команд з меню?",
         "🧐 Дуже цікаве повідомлення! Але мені потрібні чіткіші інструкції. Ось доступні команди:",
@@ -704,81 +838,90 @@ async def show_funny_response(update: Update, context: ContextTypes.DEFAULT_TYPE
         "Команда /translator відкриє перекладач",
         "Команда /recommend дозволить отримати рекомендації контенту 🍿"  # ДОДАНО
     ]
-    response = f"{random.choice(funny_responses)}\n\n💡 *Підказка:* {random.choice(hints)}"
+    response = md("{response}\n\n💡 *Підказка:* {hint}", response=random.choice(funny_responses),
+                  hint=random.choice(hints))
     await send_text(update, context, response)
 
-async def interpret_random_input(update: Update, context: ContextTypes.DEFAULT_TYPE, message_text: str):
-    message_text_lower = message_text.lower()
+# Наміри тексту поза режимами; ключові слова та їхні ваги — в intents.INTENT_KEYWORDS
+intent_matcher = IntentMatcher(INTENT_KEYWORDS)
+
 
-    if any(keyword in message_text_lower for keyword in ['факт', 'цікав', 'random', 'випадков']):
+async def interpret_random_input(update: Update, context: BotContext, message_text: str):
+    intent = intent_matcher.classify(message_text)
+
+    if intent == 'random':
         await send_text(update, context, "🧠 Схоже, ви цікавитесь випадковими фактами! Зараз покажу вам один...")
         await random_fact(update, context)
-        return True
-
-    elif any(keyword in message_text_lower for keyword in ['рекоменд', 'фільм', 'книга', 'музик', 'recommend']):
+    elif intent == 'recommend':
         await send_text(update, context, "🍿 Схоже, вам потрібна рекомендація! Переходимо до вибору категорії...")
         await recommendations_handler(update, context)
-        return True
-
-    elif any(keyword in message_text_lower for keyword in ['gpt', 'чат', 'питання', 'запита', 'дізнатися']):
+    elif intent == 'gpt':
         await send_text(update, context, "🤖 Схоже, у вас є питання! Переходимо до режиму спілкування з ChatGPT...")
         await gpt_handler(update, context)
-        return True
-
-    elif any(keyword in message_text_lower for keyword in ['розмов', 'говори', 'спілкува', 'особист', 'talk']):
+    elif intent == 'talk':
         await send_text(update, context,
                         "👤 Схоже, ви хочете поговорити з відомою особистістю! Зараз покажу вам доступні варіанти...")
         await talk_handler(update, context)
-        return True
-
-    elif any(keyword in message_text_lower for keyword in ['квіз', 'вікторин', 'quiz', 'питання']):
+    elif intent == 'quiz':
         await send_text(update, context, "❓ Схоже, ви хочете взяти участь у квізі! Починаємо...")
         await quiz_handler(update, context)
-        return True
-
-    elif any(keyword in message_text_lower for keyword in ['переклад', 'translate', 'мова']):
+    elif intent == 'translate':
         await send_text(update, context, "🌍 Схоже, ви хочете щось перекласти! Запускаю перекладач...")
         await translator_handler(update, context)
-        return True
-
-    return False
+    else:
+        return False
+    return True
 
 
-async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def message_handler(update: Update, context: BotContext):
     message_text = update.message.text
-    conversation_state = context.user_data.get('conversation_state')
+    session = context.user_data
+    conversation_state = session.mode
 
-    if conversation_state == 'recommend_genre':
-        context.user_data['rec_genre'] = message_text
-        context.user_data.pop('conversation_state', None)
+    if conversation_state is Mode.RECOMMEND_GENRE:
+        recommend = session.recommend
+        category_name_ukr = RECOMMENDATION_CATEGORIES.get(recommend.category, 'Контент').split(' ')[0]  # Фільми, Книги, Музика
+        recommend.queue = RecommendationQueue(category_name_ukr, message_text)
         await generate_recommendation(update, context)
         return
 
-    if not conversation_state:
+    if conversation_state is Mode.IDLE:
         intent_recognized = await interpret_random_input(update, context, message_text)
         if not intent_recognized:
             await show_funny_response(update, context)
         return
 
-    if conversation_state == 'gpt' or conversation_state == 'talk':
+    if conversation_state is Mode.GPT or conversation_state is Mode.TALK:
         waiting_message = await send_text(update, context, "🔍 Обробляю ваше повідомлення...")
         try:
-            response = await chat_gpt.add_message(message_text)
-
-            if waiting_message:
-                await context.bot.delete_message(chat_id=update.effective_chat.id,
-                                                 message_id=waiting_message.message_id)
-
-            if conversation_state == 'gpt':
-                buttons = {'gpt_continue': 'Задати питання ще 🔄', 'start': 'Закінчити 🏁'}
-                await send_text_buttons(update, context, f"🤖 *Відповідь ChatGPT:*\n\n{response}", buttons)
-
-            elif conversation_state == 'talk':
-                personality = context.user_data.get('selected_personality', 'Особистість')
-                personality_name = personality.replace('talk_', '').replace('_', ' ').title()
-                buttons = {'gpt_continue': 'Продовжити розмову 🔄', 'start': 'Закінчити 🏁'}
-                await send_text_buttons(update, context, f"👤 *{personality_name}:*\n\n{response}", buttons)
-
+            if conversation_state is Mode.GPT:
+                mode = 'gpt'
+                header = md("🤖 *Відповідь ChatGPT:*\n\n")
+                continue_text = 'Задати питання ще 🔄'
+            else:
+                personality = session.talk.personality or 'Особистість'
+                mode = personality
+                header = md("👤 *{name}:*\n\n", name=persona_name(personality))
+                continue_text = 'Продовжити розмову 🔄'
+
+            buttons = {'chat:continue': continue_text, 'menu:start': 'Закінчити 🏁'}
+
+            # Після перезапуску бота розмови в пам'яті немає — відновлюємо промпт режиму й репліки із сесії
+            key = conversation_key(update)
+            if chat_gpt.conversations.get(key).prompt is None:
+                chat_gpt.set_prompt(key, load_prompt(mode))
+                chat_gpt.conversations.restore(key, session.recall(update.effective_chat.id))
+
+            # Відповідь з'являється в повідомленні-заглушці в міру генерації
+            writer = StreamingMessage(context, waiting_message, prefix=header)
+            async for delta in chat_gpt.stream_message(key, message_text,
+                                                       user_id=update.effective_user.id, mode=mode):
+                await writer.write(delta)
+            session.remember(update.effective_chat.id, chat_gpt.conversations.export(key))
+            await writer.finish(buttons_markup(buttons))
+
+        except SchedulerBusy:
+            await edit_text(context, waiting_message, BUSY_TEXT, buttons_markup(buttons))
         except Exception as e:
             logger.error(f"Помилка при отриманні відповіді від ChatGPT: {e}")
             await send_text(update, context,
@@ -792,38 +935,43 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
     # Логіка перекладу
-    elif conversation_state == 'translate':
-        lang_from_name = context.user_data.get('language_from_name')
-        lang_to_name = context.user_data.get('language_to_name')
+    elif conversation_state is Mode.TRANSLATE:
+        translate = session.translate
+        lang_from_name = translate.source_name
+        lang_to_name = translate.target_name
 
-        if not lang_from_name or not lang_to_name:
+        if not translate.ready:
             await send_text(update, context,
                             "⚠️ Спочатку потрібно вибрати мови перекладу.")
-            await translator_send_language_selection(update, context, 'language_from')
+            await translator_send_language_selection(update, context, 'from')
             return
 
         waiting_message = await send_text(update, context,
-                                          f"🌍 Перекладаю з *{lang_from_name}* на *{lang_to_name}*...")
+                                          md("🌍 Перекладаю з *{source}* на *{target}*...",
+                                             source=lang_from_name, target=lang_to_name))
 
         try:
             translation_prompt = load_prompt('translator')
 
-            chat_gpt.set_prompt(translation_prompt)
-
             question = (f"Переклади наступний текст з {lang_from_name} на {lang_to_name}. "
                         f"Не додавай нічого зайвого, лише переклад: {message_text}")
 
-            translation = await chat_gpt.send_question(translation_prompt, question)
+            translation = await chat_gpt.send_question(translation_prompt, question, mode='translator',
+                                                       user_id=update.effective_user.id,
+                                                       priority=Priority.INTERACTIVE)
 
             if waiting_message:
                 await context.bot.delete_message(chat_id=update.effective_chat.id,
                                                  message_id=waiting_message.message_id)
 
-            buttons = {'translator': 'Перекласти ще 🔄', 'start': 'Закінчити 🏁'}
+            buttons = {'tr:again': 'Перекласти ще 🔄', 'menu:start': 'Закінчити 🏁'}
             await send_text_buttons(update, context,
-                                    f"✅ *Переклад на {lang_to_name}:*\n\n{translation}",
+                                    md("✅ *Переклад на {target}:*\n\n{translation}",
+                                       target=lang_to_name, translation=translation),
                                     buttons)
 
+        except SchedulerBusy:
+            await edit_text(context, waiting_message, BUSY_TEXT)
         except Exception as e:
             logger.error(f"Помилка при перекладі: {e}")
             if waiting_message:
@@ -839,7 +987,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def error_handler(update, context):
     if update:
         chat_id = update.effective_chat.id
-        await context.bot.send_message(chat_id=chat_id, text=escape_markdown_v2(
+        await context.bot.send_message(chat_id=chat_id, text=escape(
             "❌ Ой! Виникла критична помилка. Будь ласка, спробуйте ще раз або перезапустіть бота командою /start."),
                                        parse_mode='MarkdownV2')
 
@@ -854,7 +1002,58 @@ async def error_handler(update, context):
 #          РЕЄСТРАЦІЯ ОБРОБНИКІВ
 # =========================================
 
-app = ApplicationBuilder().token(BOT_TOKEN).build()
+async def log_metrics():
+    while True:
+        await asyncio.sleep(METRICS_LOG_INTERVAL)
+        logger.info(f"Метрики: {metrics.summary()}")
+
+
+async def evict_sessions(application):
+    while True:
+        await asyncio.sleep(60)
+        await application.persistence.evict_idle(application)
+
+
+async def on_startup(application):
+    # Промпти та повідомлення підхоплюються після редагування без перезапуску бота
+    resources.start_watching()
+    await quiz_pool.start()
+    await fact_buffer.start()
+    if METRICS_LOG_INTERVAL > 0:
+        application.create_task(log_metrics())
+    if application.persistence:
+        application.create_task(evict_sessions(application))
+
+
+async def on_shutdown(application):
+    resources.stop_watching()
+    await quiz_pool.stop()
+    await fact_buffer.stop()
+    logger.info(f"Статистика кешу відповідей: {chat_gpt.cache.stats()}")
+    logger.info(f"Стан планувальника запитів: {chat_gpt.scheduler.stats()}")
+    logger.info(f"Статистика звернень до моделі: {chat_gpt.stats()}")
+    await chat_gpt.close()
+
+
+# Поки один чат чекає відповіді моделі, оновлення інших чатів обробляються далі;
+# оновлення одного чату виконуються строго по черзі
+# Сесії користувачів зберігаються в SQLite; типи сесії кодуються через теги
+session_codec = SessionCodec()
+session_codec.register(RecommendationQueue, 'rq', RecommendationQueue.to_dict, RecommendationQueue.from_dict)
+for session_type in (UserSession, *STATE_TYPES):
+    session_codec.register(session_type, session_type.TAG, session_type.to_list, session_type.from_list)
+
+builder = (configure_telegram(ApplicationBuilder().token(BOT_TOKEN))
+           .context_types(ContextTypes(user_data=UserSession))
+           .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+           .post_init(on_startup).post_shutdown(on_shutdown))
+if SESSION_DB_PATH:
+    builder = builder.persistence(SQLitePersistence(SESSION_DB_PATH, session_codec,
+                                                    idle_ttl=SESSION_IDLE_TTL,
+                                                    max_resident=SESSION_MAX_RESIDENT,
+                                                    update_interval=SESSION_SAVE_INTERVAL,
+                                                    session_type=UserSession))
+app = builder.build()
 
 app.add_handler(CommandHandler('start', start))
 app.add_handler(CommandHandler('recommend', recommendations_handler))
@@ -864,24 +1063,43 @@ app.add_handler(CommandHandler('talk', talk_handler))
 app.add_handler(CommandHandler('quiz', quiz_handler))
 app.add_handler(CommandHandler('translator', translator_handler))
 
-app.add_handler(CallbackQueryHandler(recommendations_category_callback, pattern=r'^rec_category\|'))
-app.add_handler(CallbackQueryHandler(recommendations_feedback_callback, pattern='^(rec_dislike|start)$'))
-
-app.add_handler(CallbackQueryHandler(gpt_continue_handler, pattern='^gpt_continue$'))
-app.add_handler(CallbackQueryHandler(random_fact_button_handler, pattern='^(random|start)$'))
-app.add_handler(CallbackQueryHandler(post_quiz_buttons_handler, pattern='^(quiz_restart|start)$'))
-app.add_handler(CallbackQueryHandler(translator_select_language, pattern=r'^translate_select\|'))
-app.add_handler(
-    CallbackQueryHandler(translator_handler, pattern='^translator$'))
-
-app.add_handler(CallbackQueryHandler(quiz_callback_handler, pattern='^quiz_'))
-app.add_handler(CallbackQueryHandler(talk_button_handler,
-                                     pattern='^(talk_cobain|talk_hawking|talk_nietzsche|talk_queen|talk_tolkien|start)$'))
+# Усі натискання кнопок проходять через один маршрутизатор: 'простір:дія[:аргумент]' -> обробник
+callback_router = CallbackRouter(fallback=default_callback_handler)
+callback_router.add('menu', 'start', menu_start_callback)
+callback_router.add('random', 'more', random_fact_button_handler)
+callback_router.add('chat', 'continue', gpt_continue_handler)
+callback_router.add('talk', 'pick', talk_button_handler)
+callback_router.add('rec', 'category', recommendations_category_callback)
+callback_router.add('rec', 'dislike', recommendations_dislike_callback)
+callback_router.add('quiz', 'answer', quiz_answer_callback)
+callback_router.add('quiz', 'finish', quiz_finish_callback)
+callback_router.add('quiz', 'restart', quiz_restart_callback)
+callback_router.add('tr', 'lang', translator_select_language)
+callback_router.add('tr', 'again', translator_handler)
+
+# Кнопки старого формату в уже надісланих повідомленнях
+for old_data, new_data in {'start': 'menu:start', 'random': 'random:more', 'gpt_continue': 'chat:continue',
+                           'rec_dislike': 'rec:dislike', 'quiz_finish': 'quiz:finish',
+                           'quiz_restart': 'quiz:restart', 'translator': 'tr:again'}.items():
+    callback_router.alias(old_data, new_data)
+for persona in resources.prompt_names('talk_'):
+    callback_router.alias(persona, callback_data('talk', 'pick', persona.removeprefix('talk_')))
+# Кнопки старого формату з аргументом: 'quiz_answer_N', 'rec_category|ключ', 'translate_select|крок|мова'
+for index in range(4):
+    callback_router.alias(f"quiz_answer_{index}", callback_data('quiz', 'answer', str(index)))
+for category_key in RECOMMENDATION_CATEGORIES:
+    callback_router.alias(f"rec_category|{category_key}", callback_data('rec', 'category', category_key))
+for code in TRANSLATION_LANGUAGES:
+    for old_step, step in (('language_from', 'from'), ('language_to', 'to')):
+        callback_router.alias(f"translate_select|{old_step}|{code}", callback_data('tr', 'lang', f"{step}:{code}"))
+
+app.add_handler(CallbackQueryHandler(callback_router.dispatch))
 app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
-app.add_handler(CallbackQueryHandler(default_callback_handler))
 
 app.add_error_handler(error_handler)
 
 # Запуск бота
 if __name__ == '__main__':
-    app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
+    # Оновлення, що надійшли, поки бот був вимкнений, не відкидаються.
+    # Для webhook-режиму з кількома процесами запускайте webhook.py.
+    app.run_polling(drop_pending_updates=False, allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+def normalize_input(text: str) -> str:
+    """Нормалізує вхідний текст: однакові за змістом запити мають давати однаковий ключ."""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def cache_key(mode: str, prompt_text: str, message_text: str) -> str:
+    """Ключ кешу: режим, хеш промпта та нормалізований запит."""
+    prompt_hash = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()
+    raw = '\0'.join((mode, prompt_hash, normalize_input(message_text)))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Спільний кеш відповідей моделі для детермінованих режимів (перекладач, рекомендації).
+
+    Записи живуть ttl секунд; у пам'яті зберігається не більше max_entries
+    записів (найдавніше використані витісняються першими). Якщо задано path,
+    відповіді додатково зберігаються в SQLite і переживають перезапуск; запити
+    до файлу виконуються у власному потоці кешу, а помилка SQLite означає промах.
+    """
+
+    def __init__(self, modes: set[str], ttl: float = 86400, max_entries: int = 5000,
+                 path: str | None = None):
+        self.modes = set(modes)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        if path:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute('PRAGMA synchronous=NORMAL')
+                self._db.execute('CREATE TABLE IF NOT EXISTS responses '
+                                 '(key TEXT PRIMARY KEY, expires REAL NOT NULL, value TEXT NOT NULL)')
+                self._db.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+                self._db.commit()
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='response-cache')
+            except sqlite3.Error as e:
+                logger.warning(f"Не вдалося відкрити кеш відповідей {path}: {e}. Працюю лише в пам'яті.")
+                self._db = None
+
+    def enabled_for(self, mode: str | None) -> bool:
+        return mode in self.modes
+
+    async def get(self, key: str) -> str | None:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires >= now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self._db is not None:
+            row = await self._submit(self._load, key, now)
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                return row[1]
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        """Запам'ятовує відповідь; запис у SQLite ставиться в чергу потоку кешу без очікування."""
+        expires = time.time() + self.ttl
+        self._remember(key, expires, value)
+        if self._db is not None:
+            self._submit(self._store, key, expires, value)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                'hit_ratio': self.hits / total if total else 0.0}
+
+    async def close(self) -> None:
+        """Дописує відповіді з черги й закриває файл кешу."""
+        if self._db is not None:
+            # Потік один, тож закриття виконається після всіх поставлених записів
+            await self._submit(self._db.close)
+            self._db = None
+            self._executor.shutdown(wait=False)
+
+    def _submit(self, function: Callable[..., Any], *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _load(self, key: str, now: float) -> tuple[float, str] | None:
+        try:
+            return self._db.execute('SELECT expires, value FROM responses WHERE key = ? AND expires >= ?',
+                                    (key, now)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Не вдалося прочитати відповідь з кешу: {e}")
+            return None
+
+    def _store(self, key: str, expires: float, value: str) -> None:
+        try:
+            self._db.execute('INSERT OR REPLACE INTO responses (key, expires, value) VALUES (?, ?, ?)',
+                             (key, expires, value))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Не вдалося записати відповідь у кеш: {e}")
+
+    def _remember(self, key: str, expires: float, value: str) -> None:
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SingleFlight:
+    """Об'єднує однакові запити, що виконуються одночасно, в один.
+
+    Перший викликач із ключем key запускає factory() окремою задачею, решта
+    чекають на ту саму задачу й отримують той самий результат (або виняток).
+    Скасування одного з викликачів не скасовує запит для інших.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Забираємо виняток, навіть якщо всі викликачі вже скасовані, щоб asyncio не скаржився
+        if not task.cancelled():
+            task.exception()
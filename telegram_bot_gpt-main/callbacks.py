@@ -0,0 +1,70 @@
+"""Маршрутизація натискань inline-кнопок одним обробником.
+
+callback_data має формат 'простір:дія' або 'простір:дія:аргумент'
+(напр. 'menu:start', 'quiz:answer:2', 'tr:lang:from:uk'). Обробник
+знаходиться за парою 'простір:дія' одним зверненням до словника, тож вартість
+маршрутизації не залежить від кількості зареєстрованих кнопок, а однакові
+дані кнопок у різних режимах не перекривають одне одного.
+"""
+import logging
+from typing import Awaitable, Callable
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Telegram обмежує callback_data 64 байтами
+MAX_CALLBACK_DATA = 64
+
+# handler(update, context, arg) — arg є частиною callback_data після 'простір:дія' або None
+CallbackHandler = Callable[[Update, ContextTypes.DEFAULT_TYPE, str | None], Awaitable[None]]
+Fallback = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]
+
+
+def callback_data(namespace: str, action: str, arg: str | None = None) -> str:
+    """Збирає callback_data кнопки та перевіряє обмеження Telegram на довжину."""
+    data = f"{namespace}:{action}" if arg is None else f"{namespace}:{action}:{arg}"
+    if len(data.encode('utf-8')) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data довша за {MAX_CALLBACK_DATA} байти: {data}")
+    return data
+
+
+class CallbackRouter:
+    """Реєстр обробників кнопок: 'простір:дія' -> handler.
+
+    aliases перекладають callback_data старого формату (кнопки в уже надісланих
+    повідомленнях) у новий. Невідомі дані передаються fallback.
+    """
+
+    def __init__(self, fallback: Fallback | None = None):
+        self.fallback = fallback
+        self._routes: dict[str, CallbackHandler] = {}
+        self._aliases: dict[str, str] = {}
+        self.unknown = registry.counter('bot_callbacks_unknown_total', 'Button taps without a registered route')
+
+    def add(self, namespace: str, action: str, handler: CallbackHandler) -> None:
+        key = f"{namespace}:{action}"
+        if key in self._routes:
+            raise ValueError(f"Маршрут кнопки {key} уже зареєстровано")
+        self._routes[key] = handler
+
+    def alias(self, old: str, new: str) -> None:
+        self._aliases[old] = new
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        data = update.callback_query.data or ''
+        data = self._aliases.get(data, data)
+        parts = data.split(':', 2)
+        handler = self._routes.get(':'.join(parts[:2])) if len(parts) >= 2 else None
+        if handler is None:
+            self.unknown.inc()
+            logger.warning(f"Немає обробника для кнопки: {data!r}")
+            if self.fallback:
+                await self.fallback(update, context)
+            else:
+                await update.callback_query.answer()
+            return
+        await handler(update, context, parts[2] if len(parts) == 3 else None)
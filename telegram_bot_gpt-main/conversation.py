@@ -0,0 +1,180 @@
+import logging
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Hashable
+
+try:
+    import tiktoken
+except ImportError:  # лічильник працює і без tiktoken, але менш точно
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Службові токени, які OpenAI додає до кожного повідомлення (роль, розділювачі)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """Локальний підрахунок токенів без звернення до API.
+
+    Використовує tiktoken, якщо він встановлений і словник моделі доступний,
+    інакше — консервативну оцінку за кількістю байтів UTF-8.
+    """
+
+    def __init__(self, model: str):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    self._encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # tiktoken завантажує словник з мережі при першому використанні
+                logger.warning(f"Не вдалося завантажити словник tiktoken ({e}), використовую наближений підрахунок.")
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        # ~3 байти UTF-8 на токен: для кирилиці це з запасом, для латиниці — приблизно точно
+        return len(text.encode('utf-8')) // 3 + 1
+
+    def count_message(self, text: str) -> int:
+        return self.count(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+class Conversation:
+    """Історія однієї розмови: системний промпт та останні репліки.
+
+    Репліки зберігаються як кортежі (is_assistant, text, tokens) — це значно компактніше
+    за словники, які очікує OpenAI API; словники будуються лише перед запитом.
+    Кількість токенів рахується один раз при додаванні репліки.
+    """
+    __slots__ = ('prompt', 'prompt_tokens', 'turns', 'turn_tokens', 'last_seen')
+
+    def __init__(self):
+        self.prompt: str | None = None
+        self.prompt_tokens: int = 0
+        self.turns: deque = deque()
+        self.turn_tokens: int = 0
+        self.last_seen: float = time.monotonic()
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.turn_tokens
+
+    def trim(self, max_turns: int, max_tokens: int) -> int:
+        """Видаляє найстаріші репліки, поки розмова не вкладеться в ліміти.
+
+        Системний промпт (персона) і остання репліка зберігаються завжди.
+        Повертає кількість видалених реплік.
+        """
+        removed = 0
+        while len(self.turns) > 1 and (len(self.turns) > max_turns or self.total_tokens > max_tokens):
+            _, _, tokens = self.turns.popleft()
+            self.turn_tokens -= tokens
+            removed += 1
+        # Не починаємо історію з відповіді асистента без питання, на яке він відповідав
+        while len(self.turns) > 1 and self.turns[0][0]:
+            _, _, tokens = self.turns.popleft()
+            self.turn_tokens -= tokens
+            removed += 1
+        return removed
+
+    def to_messages(self) -> list[dict]:
+        messages = []
+        if self.prompt is not None:
+            messages.append({"role": "system", "content": self.prompt})
+        for is_assistant, text, _ in self.turns:
+            messages.append({"role": "assistant" if is_assistant else "user", "content": text})
+        return messages
+
+
+class ConversationStore:
+    """Сховище розмов, розділене за ключем чату/користувача.
+
+    Кожна сесія має обмежену кількість реплік (max_turns) і бюджет токенів
+    (max_context_tokens) разом із системним промптом: коли бюджет вичерпано,
+    найстаріші репліки відкидаються. Неактивні сесії видаляються через
+    idle_ttl секунд, а загальна кількість сесій обмежена max_sessions
+    (найдавніше використані видаляються першими).
+    """
+
+    def __init__(self, counter: TokenCounter, max_turns: int = 20, max_context_tokens: int = 4000,
+                 idle_ttl: float = 1800, max_sessions: int = 10000):
+        self.counter = counter
+        self.max_turns = max_turns
+        self.max_context_tokens = max_context_tokens
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[Hashable, Conversation] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, key: Hashable) -> Conversation:
+        """Повертає розмову за ключем, створюючи її за потреби."""
+        now = time.monotonic()
+        self.evict_idle(now)
+
+        conversation = self._sessions.get(key)
+        if conversation is None:
+            conversation = Conversation()
+            self._sessions[key] = conversation
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(key)
+        conversation.last_seen = now
+        return conversation
+
+    def set_prompt(self, key: Hashable, prompt_text: str) -> None:
+        """Починає нову розмову з вказаним системним промптом."""
+        conversation = self.get(key)
+        # Промпти завантажуються з файлів і однакові для багатьох сесій — зберігаємо один екземпляр рядка
+        conversation.prompt = sys.intern(prompt_text)
+        conversation.prompt_tokens = self.counter.count_message(prompt_text)
+        conversation.turns.clear()
+        conversation.turn_tokens = 0
+
+    def append(self, key: Hashable, is_assistant: bool, text: str) -> Conversation:
+        """Додає репліку до розмови key та стискає історію до бюджету токенів."""
+        conversation = self.get(key)
+        tokens = self.counter.count_message(text)
+        conversation.turns.append((is_assistant, text, tokens))
+        conversation.turn_tokens += tokens
+        removed = conversation.trim(self.max_turns, self.max_context_tokens)
+        if removed:
+            logger.debug(f"Розмову {key} стиснуто: видалено {removed} старих реплік.")
+        return conversation
+
+    def export(self, key: Hashable) -> list[list]:
+        """Репліки розмови key як [[is_assistant, text], ...] — вже обмежені max_turns і бюджетом токенів."""
+        conversation = self._sessions.get(key)
+        if conversation is None:
+            return []
+        return [[is_assistant, text] for is_assistant, text, _ in conversation.turns]
+
+    def restore(self, key: Hashable, turns: list) -> None:
+        """Повертає в розмову key репліки, збережені export(); елементи іншої форми пропускаються."""
+        for turn in turns:
+            if isinstance(turn, list) and len(turn) == 2 and isinstance(turn[1], str):
+                self.append(key, bool(turn[0]), turn[1])
+
+    def drop(self, key: Hashable) -> None:
+        self._sessions.pop(key, None)
+
+    def evict_idle(self, now: float | None = None) -> int:
+        """Видаляє сесії, неактивні довше за idle_ttl. Повертає кількість видалених."""
+        now = time.monotonic() if now is None else now
+        deadline = now - self.idle_ttl
+        evicted = 0
+        # Сесії впорядковані за часом останнього використання, тож перевіряємо лише найстаріші
+        while self._sessions:
+            key, conversation = next(iter(self._sessions.items()))
+            if conversation.last_seen >= deadline:
+                break
+            del self._sessions[key]
+            evicted += 1
+        return evicted
@@ -8,3 +8,70 @@ load_dotenv()
 # Use uppercase variable names to be conventional in .env files
 ChatGPT_TOKEN = os.getenv('CHATGPT_TOKEN', '')
 BOT_TOKEN = os.getenv('BOT_TOKEN', '')
+
+# Where to keep Telegram file_id values of already uploaded images
+FILE_ID_CACHE_PATH = os.getenv('FILE_ID_CACHE_PATH', os.path.join('user_data', 'file_ids.json'))
+
+# Where to keep pre-generated quiz questions between restarts (empty value disables it)
+QUIZ_POOL_PATH = os.getenv('QUIZ_POOL_PATH', os.path.join('user_data', 'quiz_pool.json')) or None
+
+# SQLite file for cached translator/recommendation answers (empty value keeps the cache in memory only)
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', os.path.join('response_cache', 'responses.sqlite3')) or None
+# How long a cached answer stays valid, in seconds
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '86400'))
+
+# Webhook mode (python webhook.py): public base URL Telegram will call, local address to listen on,
+# URL path of the endpoint, optional secret token and the number of worker processes
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', str(os.cpu_count() or 1)))
+# Journal of received updates, so the ones not yet handled survive a restart
+UPDATE_JOURNAL_PATH = os.getenv('UPDATE_JOURNAL_PATH', os.path.join('user_data', 'updates.sqlite3'))
+
+# How many updates from different chats may be handled at the same time
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+# How often to write a metrics summary to the log, in seconds (0 disables it)
+METRICS_LOG_INTERVAL = float(os.getenv('METRICS_LOG_INTERVAL', '300'))
+
+# Model call scheduler: how many calls may run at once, and the per-user rate limit
+# (requests per minute with a short burst allowance)
+MODEL_MAX_CONCURRENT = int(os.getenv('MODEL_MAX_CONCURRENT', '16'))
+USER_REQUESTS_PER_MINUTE = float(os.getenv('USER_REQUESTS_PER_MINUTE', '20'))
+USER_REQUEST_BURST = float(os.getenv('USER_REQUEST_BURST', '5'))
+# How many attempts one model call may make (the deadline of a call is set per mode in MODEL_ROUTES)
+MODEL_MAX_ATTEMPTS = int(os.getenv('MODEL_MAX_ATTEMPTS', '3'))
+# Per-mode model settings on top of the defaults in routing.py, as JSON, e.g.
+# {"translator": {"model": "gpt-4o-mini", "max_tokens": 1000}, "talk_*": {"temperature": 1.0}}
+MODEL_ROUTES = os.getenv('MODEL_ROUTES', '')
+
+# HTTP connection to OpenAI: optional proxy (connects directly by default), pool size,
+# idle keep-alive connections and how long they live, HTTP/2 (needs `pip install httpx[http2]`)
+# and connect/read timeouts in seconds
+OPENAI_PROXY = os.getenv('OPENAI_PROXY') or None
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '100'))
+OPENAI_MAX_KEEPALIVE = int(os.getenv('OPENAI_MAX_KEEPALIVE', '20'))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '30'))
+OPENAI_HTTP2 = os.getenv('OPENAI_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '10'))
+OPENAI_READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', '60'))
+
+# HTTP connection to the Telegram Bot API: the same settings for the bot's requests
+TELEGRAM_PROXY = os.getenv('TELEGRAM_PROXY', '') or None
+TELEGRAM_CONNECTION_POOL_SIZE = int(os.getenv('TELEGRAM_CONNECTION_POOL_SIZE', '128'))
+TELEGRAM_HTTP2 = os.getenv('TELEGRAM_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', '5'))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', '10'))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_WRITE_TIMEOUT', '10'))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', '5'))
+
+# SQLite file where user sessions (context.user_data) are kept between restarts
+# (empty value keeps them only in memory)
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', os.path.join('user_data', 'sessions.sqlite3')) or None
+# Sessions idle for this many seconds are saved and unloaded from memory; at most
+# SESSION_MAX_RESIDENT sessions stay in memory. Changed sessions are saved every SESSION_SAVE_INTERVAL seconds
+SESSION_IDLE_TTL = float(os.getenv('SESSION_IDLE_TTL', '1800'))
+SESSION_MAX_RESIDENT = int(os.getenv('SESSION_MAX_RESIDENT', '50000'))
+SESSION_SAVE_INTERVAL = float(os.getenv('SESSION_SAVE_INTERVAL', '60'))
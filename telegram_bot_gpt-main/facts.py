@@ -0,0 +1,89 @@
+import re
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Hashable
+
+from prefetch import PrefetchPool
+
+_WORD_RE = re.compile(r"[\w'’]+")
+
+
+def fact_signature(text: str) -> frozenset:
+    """Набір основ значущих слів факту для пошуку майже однакових формулювань.
+
+    Замість повноцінного стемінгу беремо перші 5 літер слів від 4 літер —
+    цього достатньо, щоб «Венері»/«Венера» чи «planets»/«planet» збігалися.
+    """
+    return frozenset(word[:5] for word in _WORD_RE.findall(text.lower()) if len(word) >= 4)
+
+
+def is_near_duplicate(signature: frozenset, other: frozenset, threshold: float) -> bool:
+    """Коефіцієнт Жаккара між двома сигнатурами не менший за threshold."""
+    if not signature or not other:
+        return signature == other
+    return len(signature & other) / len(signature | other) >= threshold
+
+
+class FactBuffer:
+    """Буфер заздалегідь отриманих фактів з урахуванням уже показаних кожному користувачу.
+
+    Факти генеруються партіями (produce_batch повертає кілька фактів за один
+    запит до моделі) і зберігаються в PrefetchPool. Нові факти, схожі на
+    нещодавно згенеровані, відкидаються ще при додаванні в буфер, а для кожного
+    користувача пам'ятаються сигнатури останніх показаних фактів, щоб не
+    повторювати їх навіть через довгий час.
+    """
+
+    def __init__(self, produce_batch: Callable[[], Awaitable[list[str]]], capacity: int = 20,
+                 low_watermark: int = 5, similarity: float = 0.5, recent_limit: int = 200,
+                 shown_per_user: int = 100, max_users: int = 10000):
+        self.produce_batch = produce_batch
+        self.similarity = similarity
+        self.shown_per_user = shown_per_user
+        self.max_users = max_users
+        self._recent: deque = deque(maxlen=recent_limit)
+        self._shown: OrderedDict[Hashable, deque] = OrderedDict()
+        self.pool: PrefetchPool[str] = PrefetchPool('facts', self._produce, fact_signature,
+                                                    capacity=capacity, low_watermark=low_watermark)
+
+    async def start(self) -> None:
+        await self.pool.start()
+
+    async def stop(self) -> None:
+        await self.pool.stop()
+
+    async def next_fact(self, user_id: Hashable) -> str | None:
+        """Повертає ще не показаний користувачу факт з буфера або None, якщо такого зараз немає.
+
+        Не чекає на модель: якщо буфер порожній, поповнення запускається у фоні.
+        """
+        shown = self._shown.get(user_id, ())
+        facts = await self.pool.take(accept=lambda fact: not self._seen_in(fact_signature(fact), shown),
+                                     wait=False)
+        if not facts:
+            return None
+        self.mark_shown(user_id, facts[0])
+        return facts[0]
+
+    def mark_shown(self, user_id: Hashable, fact: str) -> None:
+        """Запам'ятовує факт як показаний користувачу."""
+        shown = self._shown.get(user_id)
+        if shown is None:
+            shown = self._shown[user_id] = deque(maxlen=self.shown_per_user)
+            if len(self._shown) > self.max_users:
+                self._shown.popitem(last=False)
+        else:
+            self._shown.move_to_end(user_id)
+        shown.append(fact_signature(fact))
+
+    def _seen_in(self, signature: frozenset, signatures) -> bool:
+        return any(is_near_duplicate(signature, other, self.similarity) for other in signatures)
+
+    async def _produce(self) -> list[str]:
+        facts = []
+        for fact in await self.produce_batch():
+            signature = fact_signature(fact)
+            if self._seen_in(signature, self._recent):
+                continue
+            self._recent.append(signature)
+            facts.append(fact)
+        return facts
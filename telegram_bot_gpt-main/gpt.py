@@ -1,39 +1,246 @@
-from openai import OpenAI
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable, Hashable, TypeVar
+
+import openai
+from openai import AsyncOpenAI
 import httpx as httpx
 
+from cache import ResponseCache, SingleFlight, cache_key
+from conversation import ConversationStore, TokenCounter
+from metrics import registry
+from resilience import CircuitBreaker, CircuitOpen, backoff_delay, hedged
+from routing import DEFAULT_MODEL, ModelRouter, Route
+from scheduler import ModelScheduler, Priority
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Модель за замовчуванням (за нею рахуються токени історії); модель кожного режиму — в routing.py
+MODEL = DEFAULT_MODEL
+
+# Помилки, після яких запит має сенс повторити (429, збій мережі, таймаут, 5xx)
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError,
+                    asyncio.TimeoutError)
+
 
 class ChatGptService:
-    client: OpenAI = None
-    message_list: list = None
+    client: AsyncOpenAI = None
+    conversations: ConversationStore = None
+    cache: ResponseCache | None = None
+    scheduler: ModelScheduler = None
+    router: ModelRouter = None
 
-    def __init__(self, token):
+    def __init__(self, token, max_context_tokens: int = 4000, cache: ResponseCache | None = None,
+                 no_coalesce_modes: set[str] = frozenset(), scheduler: ModelScheduler | None = None,
+                 router: ModelRouter | None = None, max_attempts: int = 3, hedge_modes: set[str] = frozenset(),
+                 hedge_delay: float = 3.0, http_client: httpx.AsyncClient | None = None):
         token = "sk-proj-" + token[:3:-1] if token.startswith('gpt:') else token
-        self.client = OpenAI(
-            http_client=httpx.Client(proxy="http://18.199.183.77:49232"),
-            api_key=token)
-        self.message_list = []
-
-    async def send_message_list(self) -> str:
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",  # gpt-4o,  gpt-4-turbo,    gpt-3.5-turbo,  GPT-4o mini
-            messages=self.message_list,
-            max_tokens=3000,
-            temperature=0.9
+        # Один асинхронний клієнт зі спільним пулом з'єднань на весь бот:
+        # запити до моделі не блокують event loop і можуть виконуватись паралельно.
+        # Пул, keep-alive, HTTP/2 та проксі налаштовуються в transport.openai_http_client()
+        self.client = AsyncOpenAI(
+            http_client=http_client or httpx.AsyncClient(),
+            api_key=token,
+            # Повтори та таймаути виконує сам сервіс (_call), щоб вони враховували дедлайн виклику
+            max_retries=0)
+        self.conversations = ConversationStore(TokenCounter(MODEL), max_context_tokens=max_context_tokens)
+        self.cache = cache
+        # Однакові одночасні запити ділять одне звернення до моделі, крім режимів,
+        # яким потрібна різноманітність відповідей (no_coalesce_modes)
+        self.single_flight = SingleFlight()
+        self.no_coalesce_modes = set(no_coalesce_modes)
+        # Усі звернення до моделі проходять через планувальник (ліміти та пріоритети)
+        self.scheduler = scheduler or ModelScheduler()
+        # Модель, max_tokens, temperature та timeout обираються за режимом запиту.
+        # timeout — дедлайн усього виклику разом із повторами (для потокових відповідей —
+        # час до першого фрагмента та найдовша пауза між фрагментами)
+        self.router = router or ModelRouter()
+        self.max_attempts = max_attempts
+        self.breaker = CircuitBreaker('model')
+        # Для режимів hedge_modes, якщо відповіді немає за hedge_delay секунд, надсилається дублікат запиту
+        self.hedge_modes = set(hedge_modes)
+        self.hedge_delay = hedge_delay
+        self.requests = registry.counter('model_requests_total', 'Model API attempts')
+        self.errors = registry.counter('model_errors_total', 'Failed model API attempts')
+        self.retries = registry.counter('model_retries_total', 'Retried model API attempts')
+        self.timeouts = registry.counter('model_timeouts_total', 'Model calls that hit their deadline')
+        self.hedges = registry.counter('model_hedges_total', 'Hedged duplicate model requests')
+        self.latency = registry.histogram('model_request_seconds', 'Model API call latency, retries included')
+
+    async def send_message_list(self, message_list: list, user_id: Hashable | None = None,
+                                priority: Priority = Priority.CHAT, mode: str | None = None) -> str:
+        route = self.router.route(mode)
+        async with self.scheduler.slot(user_id, priority):
+            if mode in self.hedge_modes:
+                return await self._call(lambda: hedged(lambda: self._complete(message_list, route),
+                                                       self.hedge_delay, self.hedges.inc), route.timeout)
+            return await self._call(lambda: self._complete(message_list, route), route.timeout)
+
+    async def _call(self, attempt: Callable[[], Awaitable[T]], timeout: float) -> T:
+        """Виконує attempt() з дедлайном, повторами з джитером та запобіжником.
+
+        Повторюються лише RETRYABLE_ERRORS і лише поки вистачає часу до дедлайну;
+        для 429 враховується заголовок Retry-After. Коли upstream не працює,
+        запобіжник розімкнений і CircuitOpen кидається одразу, без звернення до API.
+        """
+        started = time.monotonic()
+        deadline = started + timeout
+        try:
+            for number in range(self.max_attempts):
+                if not self.breaker.allow():
+                    raise CircuitOpen("Модель тимчасово недоступна")
+                self.requests.inc()
+                try:
+                    result = await asyncio.wait_for(attempt(), deadline - time.monotonic())
+                except RETRYABLE_ERRORS as e:
+                    self.errors.inc()
+                    self.breaker.record_failure()
+                    delay = max(backoff_delay(number), _retry_after(e))
+                    if number + 1 >= self.max_attempts or time.monotonic() + delay >= deadline:
+                        if isinstance(e, asyncio.TimeoutError):
+                            self.timeouts.inc()
+                        raise
+                    logger.warning(f"Запит до моделі не вдався ({type(e).__name__}), "
+                                   f"повтор через {delay:.1f} с.")
+                    self.retries.inc()
+                    await asyncio.sleep(delay)
+                except openai.APIStatusError:
+                    # 4xx означає помилку запиту, а не збій upstream — запобіжник не чіпаємо
+                    self.errors.inc()
+                    self.breaker.record_success()
+                    raise
+                else:
+                    self.breaker.record_success()
+                    return result
+        finally:
+            self.latency.observe(time.monotonic() - started)
+
+    async def _complete(self, message_list: list, route: Route) -> str:
+        completion = await self.client.chat.completions.create(
+            model=route.model,
+            messages=message_list,
+            max_tokens=route.max_tokens,
+            temperature=route.temperature
         )
-        message = completion.choices[0].message
-        self.message_list.append(message)
-        return message.content
-
-    def set_prompt(self, prompt_text: str) -> None:
-        self.message_list.clear()
-        self.message_list.append({"role": "system", "content": prompt_text})
-
-    async def add_message(self, message_text: str) -> str:
-        self.message_list.append({"role": "user", "content": message_text})
-        return await self.send_message_list()
-
-    async def send_question(self, prompt_text: str, message_text: str) -> str:
-        self.message_list.clear()
-        self.message_list.append({"role": "system", "content": prompt_text})
-        self.message_list.append({"role": "user", "content": message_text})
-        return await self.send_message_list()
+        return completion.choices[0].message.content
+
+    async def stream_message_list(self, message_list: list, user_id: Hashable | None = None,
+                                  priority: Priority = Priority.CHAT, mode: str | None = None) -> AsyncIterator[str]:
+        """Як send_message_list, але повертає відповідь частинами в міру генерації."""
+        route = self.router.route(mode)
+        # Місце в планувальнику тримається, доки триває генерація
+        async with self.scheduler.slot(user_id, priority):
+            # Повторюється лише відкриття потоку: після першого фрагмента повтор дублював би текст
+            stream = await self._call(lambda: self.client.chat.completions.create(
+                model=route.model,
+                messages=message_list,
+                max_tokens=route.max_tokens,
+                temperature=route.temperature,
+                stream=True
+            ), route.timeout)
+            chunks = stream.__aiter__()
+            try:
+                while True:
+                    # Найдовша пауза між фрагментами — route.timeout; дедлайн окремий для кожного фрагмента
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), route.timeout)
+                    except StopAsyncIteration:
+                        break
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            except asyncio.TimeoutError:
+                self.timeouts.inc()
+                raise
+            except RETRYABLE_ERRORS:
+                self.errors.inc()
+                self.breaker.record_failure()
+                raise
+            finally:
+                await stream.close()
+
+    def set_prompt(self, key: Hashable, prompt_text: str) -> None:
+        """Починає нову розмову для чату/користувача з ключем key."""
+        self.conversations.set_prompt(key, prompt_text)
+
+    async def add_message(self, key: Hashable, message_text: str, user_id: Hashable | None = None,
+                          priority: Priority = Priority.CHAT, mode: str | None = None) -> str:
+        """Додає повідомлення до розмови key та повертає відповідь моделі."""
+        conversation = self.conversations.append(key, False, message_text)
+        answer = await self.send_message_list(conversation.to_messages(), user_id, priority, mode)
+        self.conversations.append(key, True, answer)
+        return answer
+
+    async def stream_message(self, key: Hashable, message_text: str, user_id: Hashable | None = None,
+                             priority: Priority = Priority.CHAT, mode: str | None = None) -> AsyncIterator[str]:
+        """Потокова версія add_message: відповідь потрапляє в історію після завершення генерації."""
+        self.conversations.append(key, False, message_text)
+        parts = []
+        async for delta in self.stream_message_list(self.conversations.get(key).to_messages(),
+                                                    user_id, priority, mode):
+            parts.append(delta)
+            yield delta
+        self.conversations.append(key, True, ''.join(parts))
+
+    async def stream_question(self, prompt_text: str, message_text: str, user_id: Hashable | None = None,
+                              priority: Priority = Priority.CHAT, mode: str | None = None) -> AsyncIterator[str]:
+        """Потокова версія send_question."""
+        async for delta in self.stream_message_list([
+            {"role": "system", "content": prompt_text},
+            {"role": "user", "content": message_text},
+        ], user_id, priority, mode):
+            yield delta
+
+    async def send_question(self, prompt_text: str, message_text: str, mode: str | None = None,
+                            user_id: Hashable | None = None, priority: Priority = Priority.CHAT) -> str:
+        """Одноразовий запит без історії розмови.
+
+        mode — назва режиму (translator, recommend, quiz_generator...), за якою обирається
+        маршрут (модель, max_tokens, temperature, timeout); для режимів,
+        увімкнених у кеші, однакові запити обслуговуються без звернення до моделі,
+        а однакові одночасні запити об'єднуються в один. user_id та priority
+        передаються планувальнику; відповідь з кешу ліміт користувача не витрачає.
+        """
+        # Модель режиму входить у ключ: після зміни маршруту старі відповіді не повертаються
+        key = cache_key(f"{mode or ''}@{self.router.route(mode).model}", prompt_text, message_text)
+        use_cache = self.cache is not None and self.cache.enabled_for(mode)
+        if use_cache:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        async def request() -> str:
+            answer = await self.send_message_list([
+                {"role": "system", "content": prompt_text},
+                {"role": "user", "content": message_text},
+            ], user_id, priority, mode)
+            if use_cache and answer:
+                self.cache.put(key, answer)
+            return answer
+
+        if mode in self.no_coalesce_modes:
+            return await request()
+        return await self.single_flight.do(key, request)
+
+    def stats(self) -> dict:
+        return {'circuit': self.breaker.state, 'requests': self.requests.value, 'errors': self.errors.value,
+                'retries': self.retries.value, 'timeouts': self.timeouts.value, 'hedges': self.hedges.value}
+
+    async def close(self) -> None:
+        """Закриває HTTP-клієнт і звільняє з'єднання пулу."""
+        await self.client.close()
+        if self.cache is not None:
+            await self.cache.close()
+
+
+def _retry_after(error: Exception) -> float:
+    """Затримка із заголовка Retry-After відповіді 429 (0, якщо заголовка немає)."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return 0.0
+    try:
+        return float(response.headers.get('retry-after', 0))
+    except (TypeError, ValueError):
+        return 0.0
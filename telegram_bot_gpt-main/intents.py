@@ -0,0 +1,138 @@
+"""Визначення наміру користувача з довільного тексту.
+
+Усі ключові слова всіх намірів компілюються в один автомат Ахо — Корасік,
+тож текст проглядається один раз незалежно від кількості слів. Ключові слова
+скорочуються до основи (stem) і шукаються як початок слова в тексті: основа
+'рекоменд' знаходить і 'рекомендацію', і 'рекомендуй'. Кожне слово має вагу;
+переможцем стає намір з найбільшою сумою ваг, а не той, що перевіряється першим.
+"""
+from collections import deque
+
+# Закінчення та суфікси, що відкидаються від ключових слів (від довших до коротших)
+_SUFFIXES = sorted((
+    # українська
+    'ування', 'ювання', 'ватися', 'ння', 'ація', 'ість', 'тися', 'тись', 'ися',
+    'ська', 'ський', 'ити', 'ати', 'сти', 'ти', 'ся', 'ий', 'ій', 'ої', 'ою', 'ам', 'ами', 'ах',
+    'ів', 'ям', 'ями', 'ях', 'а', 'я', 'и', 'і', 'у', 'ю', 'о', 'е', 'ь', 'й',
+    # англійська
+    'ation', 'ing', 'ies', 'es', 'ed', 's', 'e',
+), key=len, reverse=True)
+_MIN_STEM = 3
+# Апостроф усередині слова (м'ята) не є межею слова
+_WORD_CHARS = "'’ʼ"
+
+
+# Ключові слова намірів для тексту поза режимами: {намір: {слово: вага}}.
+# Слова скорочуються до основи, тож достатньо однієї форми; спільні слова ('питання') мають меншу вагу
+INTENT_KEYWORDS = {
+    'random': {'факт': 2, 'цікавий': 1, 'випадковий': 1.5, 'random': 2, 'fact': 2},
+    'recommend': {'рекомендація': 2, 'порадь': 1.5, 'фільм': 1.5, 'книга': 1.5, 'музика': 1.5,
+                  'серіал': 1.5, 'що подивитися': 2, 'що почитати': 2, 'recommend': 2, 'movie': 1.5,
+                  'book': 1.5, 'music': 1.5},
+    'gpt': {'gpt': 2, 'chatgpt': 2, 'чат': 1.5, 'питання': 1, 'запитати': 1, 'запитання': 1, 'дізнатися': 1,
+            'ask': 1, 'question': 1},
+    'talk': {'розмова': 1.5, 'поговорити': 2, 'говорити': 1.5, 'спілкуватися': 1.5, 'поспілкуватися': 1.5,
+             'особистість': 2, 'talk': 2},
+    'quiz': {'квіз': 2, 'вікторина': 2, 'тест': 1.5, 'quiz': 2, 'питання': 0.5},
+    'translate': {'переклад': 2, 'перекласти': 2, 'translate': 2, 'мова': 0.5, 'англійська': 1,
+                  'німецька': 1, 'французька': 1},
+}
+
+
+def stem(word: str) -> str:
+    """Основа слова: без найдовшого відомого закінчення, але не коротша за _MIN_STEM літер."""
+    word = word.casefold()
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[:-len(suffix)]
+    return word
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char in _WORD_CHARS
+
+
+class IntentMatcher:
+    """Класифікатор намірів за зваженими ключовими словами.
+
+    keywords — {намір: {слово або фраза: вага}}; порядок намірів вирішує лише нічию.
+    Фраза з кількох слів скорочується за останнім словом. Намір повертається,
+    якщо його сума ваг не менша за min_score.
+    """
+
+    def __init__(self, keywords: dict[str, dict[str, float]], min_score: float = 1.0):
+        self.min_score = min_score
+        self.intents = list(keywords)
+        self._rank = {intent: rank for rank, intent in enumerate(self.intents)}
+        # Автомат: переходи, посилання невдачі та виходи кожного стану
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # Вихід стану: (довжина шаблону, намір, вага) для всіх шаблонів, що закінчуються в ньому
+        self._out: list[list[tuple[int, str, float]]] = [[]]
+        for intent, words in keywords.items():
+            for phrase, weight in words.items():
+                self._add(self._pattern(phrase), intent, weight)
+        self._link()
+
+    @staticmethod
+    def _pattern(phrase: str) -> str:
+        words = phrase.casefold().split()
+        return ' '.join(words[:-1] + [stem(words[-1])])
+
+    def _add(self, pattern: str, intent: str, weight: float) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append((len(pattern), intent, weight))
+
+    def _link(self) -> None:
+        # Посилання невдачі будуються обходом у ширину; виходи стану доповнюються виходами його посилання
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def scores(self, text: str) -> dict[str, float]:
+        """Сума ваг кожного наміру; одне слово тексту враховується для наміру лише раз (з найбільшою вагою)."""
+        text = text.casefold()
+        goto, fail, out = self._goto, self._fail, self._out
+        best: dict[tuple[str, int], float] = {}
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, intent, weight in out[state]:
+                start = index - length + 1
+                # Ключове слово має починати слово в тексті
+                if start and _is_word_char(text[start - 1]):
+                    continue
+                key = (intent, start)
+                if weight > best.get(key, 0.0):
+                    best[key] = weight
+        scores: dict[str, float] = {}
+        for (intent, _), weight in best.items():
+            scores[intent] = scores.get(intent, 0.0) + weight
+        return scores
+
+    def classify(self, text: str) -> str | None:
+        """Намір з найбільшою сумою ваг або None, якщо жоден не набрав min_score."""
+        scores = self.scores(text)
+        if not scores:
+            return None
+        intent = min(scores, key=lambda name: (-scores[name], self._rank[name]))
+        return intent if scores[intent] >= self.min_score else None
@@ -0,0 +1,202 @@
+"""Підготовка тексту для MarkdownV2.
+
+Звичайний рядок (відповідь моделі, введення користувача) екранується повністю,
+разом зі зворотною скісною рискою. Розмітку задають лише шаблони md(): у шаблоні
+*жирний* та _курсив_ лишаються розміткою, а решта службових символів і всі
+підставлені значення екрануються. Результат має тип Markdown, тож send_text
+надсилає його як є — повторне екранування неможливе.
+"""
+import functools
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Символи, які MarkdownV2 вимагає екранувати поза розміткою (зокрема сам '\')
+RESERVED = '\\_*[]()~`>#+-=|{}.!'
+# Розмітка, дозволена в шаблонах
+_MARKUP = '*_'
+# Пари для str.replace; '\\' першим, щоб не подвоїти щойно додані риски.
+# Ланцюжок str.replace у CPython швидший за str.translate на кирилиці (див. benchmarks/bench_markdown.py)
+_REPLACEMENTS = tuple((char, '\\' + char) for char in RESERVED)
+_LITERAL_REPLACEMENTS = tuple((char, '\\' + char) for char in RESERVED if char not in _MARKUP)
+_FIELD_RE = re.compile(r'\{(\w+)\}')
+
+
+class Markdown(str):
+    """Готовий текст MarkdownV2. Додавання звичайного рядка екранує його."""
+    __slots__ = ()
+
+    def __add__(self, other: str) -> 'Markdown':
+        return Markdown(str.__add__(self, render(other)))
+
+    def __radd__(self, other: str) -> 'Markdown':
+        return Markdown(str.__add__(render(other), self))
+
+
+def _replace_all(text: str, replacements: tuple[tuple[str, str], ...]) -> str:
+    for char, escaped in replacements:
+        text = text.replace(char, escaped)
+    return text
+
+
+def escape(text: str) -> str:
+    """Екранує всі службові символи MarkdownV2."""
+    return _replace_all(text, _REPLACEMENTS)
+
+
+def render(text: str) -> Markdown:
+    """Markdown повертається як є, звичайний рядок — екранованим."""
+    if isinstance(text, Markdown):
+        return text
+    return Markdown(escape(text))
+
+
+def _check_markup(literal: str, template: str) -> None:
+    for char in _MARKUP:
+        if literal.count(char) % 2:
+            raise ValueError(f"Непарна кількість '{char}' у шаблоні: {template!r}")
+
+
+@functools.lru_cache(maxsize=512)
+def _compile(template: str) -> tuple[Markdown, tuple[tuple[str, Markdown], ...]]:
+    # Шаблон розбирається один раз: (екранований текст до першого поля, ((поле, текст після нього), ...))
+    pieces = _FIELD_RE.split(template)
+    _check_markup(''.join(pieces[::2]), template)
+    literals = [Markdown(_replace_all(piece, _LITERAL_REPLACEMENTS)) for piece in pieces[::2]]
+    return literals[0], tuple(zip(pieces[1::2], literals[1:]))
+
+
+def md(template: str, **values) -> Markdown:
+    """Заповнює шаблон: md("✅ *Мова:* {name}", name=назва).
+
+    Поля {name} заповнюються екранованими значеннями (значення типу Markdown
+    підставляються як є). Шаблон без полів рендериться один раз і береться з кешу.
+    """
+    head, fields = _compile(template)
+    if not fields:
+        return head
+    parts = [head]
+    for name, literal in fields:
+        value = values[name]
+        parts.append(value if isinstance(value, Markdown) else escape(str(value)))
+        parts.append(literal)
+    return Markdown(''.join(parts))
+
+
+@functools.lru_cache(maxsize=256)
+def markup(text: str) -> Markdown:
+    """Статичний текст з розміткою (повідомлення з resources/messages): фігурні дужки — звичайні символи.
+
+    Якщо розмітка незбалансована, текст надсилається повністю екранованим.
+    """
+    try:
+        _check_markup(text, text)
+    except ValueError as e:
+        logger.warning(f"{e} — надсилаю без розмітки.")
+        return render(text)
+    return Markdown(_replace_all(text, _LITERAL_REPLACEMENTS))
+
+
+# ---- розбиття на повідомлення ----
+
+# Найбільша довжина тексту повідомлення Telegram (в одиницях UTF-16)
+MESSAGE_LIMIT = 4096
+# Кінець речення в екранованому тексті: '\.', '\!', '?' або '…' перед пробілом
+_SENTENCE_END_RE = re.compile(r'(?:\\[.!]|[?…])\s')
+_ESCAPE_PAIR_RE = re.compile(r'\\.', re.DOTALL)
+
+
+def utf16_len(text: str) -> int:
+    """Довжина так, як її рахує Telegram: емодзі поза BMP займають дві одиниці."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def plain_length(text: str) -> int:
+    """Кількість символів вихідного тексту в екранованому: '\\x' рахується як один символ."""
+    return len(text) - len(_ESCAPE_PAIR_RE.findall(text))
+
+
+def _limit_index(text: str, limit: int) -> int:
+    # Найбільший індекс, до якого текст вміщується в limit одиниць UTF-16
+    if len(text) * 2 <= limit or utf16_len(text) <= limit:
+        return len(text)
+    units = 0
+    for index, char in enumerate(text):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > limit:
+            return index
+    return len(text)
+
+
+def _is_escaped(text: str, index: int) -> bool:
+    # Чи є text[index] екранованим символом (перед ним непарна кількість '\')
+    slashes = 0
+    while index - slashes - 1 >= 0 and text[index - slashes - 1] == '\\':
+        slashes += 1
+    return slashes % 2 == 1
+
+
+def _cut_index(text: str, limit: int) -> int:
+    end = _limit_index(text, limit)
+    # Межі від найкращої до найгіршої: абзац, рядок, речення, слово; зарано не ріжемо, щоб не дробити текст
+    floor = end // 2
+    for boundary in ('\n\n', '\n'):
+        index = text.rfind(boundary, floor, end)
+        if index > 0:
+            return index + len(boundary)
+    sentence = None
+    for sentence in _SENTENCE_END_RE.finditer(text, floor, end):
+        pass
+    if sentence:
+        return sentence.end()
+    index = text.rfind(' ', floor, end)
+    if index > 0:
+        return index + 1
+    # Жорсткий розріз, але не між '\' та екранованим символом
+    return end - 1 if _is_escaped(text, end) else end
+
+
+def _open_markup(text: str) -> list[str]:
+    # Незакриті маркери розмітки (* та _) у порядку відкриття
+    opened: list[str] = []
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char == '\\':
+            index += 2
+            continue
+        if char in _MARKUP:
+            if opened and opened[-1] == char:
+                opened.pop()
+            else:
+                opened.append(char)
+        index += 1
+    return opened
+
+
+def take_chunk(text: str, limit: int = MESSAGE_LIMIT) -> tuple[Markdown, Markdown]:
+    """Відокремлює від готового тексту перший шматок до limit символів: (шматок, решта).
+
+    Розріз припадає на межу абзацу, рядка, речення чи слова і ніколи не розриває
+    escape-послідовність; незакрита розмітка закривається в шматку й відкривається в решті.
+    """
+    text = render(text)
+    if utf16_len(text) <= limit:
+        return text, Markdown()
+    # Запас на закриття розмітки, яку розріз може залишити відкритою
+    cut = _cut_index(text, limit - 2 * len(_MARKUP))
+    chunk, rest = text[:cut].rstrip(), text[cut:].lstrip()
+    opened = _open_markup(chunk)
+    return Markdown(chunk + ''.join(reversed(opened))), Markdown(''.join(opened) + rest)
+
+
+def split_markdown(text: str, limit: int = MESSAGE_LIMIT) -> list[Markdown]:
+    """Ділить текст (звичайний рядок екранується) на шматки, кожен з яких вміщується в одне повідомлення."""
+    chunks = []
+    rest = render(text)
+    while rest:
+        chunk, rest = take_chunk(rest, limit)
+        if chunk:
+            chunks.append(chunk)
+    return chunks or [Markdown()]
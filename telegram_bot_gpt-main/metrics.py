@@ -0,0 +1,156 @@
+import bisect
+import threading
+
+# Межі кошиків гістограм за замовчуванням, у секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    """Лічильник, що лише зростає."""
+    __slots__ = ('name', 'help', 'value')
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter', f'{self.name} {self.value:g}']
+
+
+class Gauge:
+    """Значення, що може зростати та зменшуватись (наприклад, довжина черги)."""
+    __slots__ = ('name', 'help', 'value')
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {self.value:g}']
+
+
+class Histogram:
+    """Розподіл значень (зазвичай тривалостей) за фіксованими кошиками."""
+    __slots__ = ('name', 'help', 'buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Оцінка квантиля як верхньої межі кошика, в який він потрапляє."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{self.name}_sum {self.sum:g}')
+        lines.append(f'{self.name}_count {self.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Реєстр метрик процесу; однакове ім'я повертає ту саму метрику."""
+
+    def __init__(self):
+        self._metrics: dict[str, Counter | Gauge | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help, buckets)
+            return self._metrics[name]
+
+    def render(self) -> str:
+        """Усі метрики у текстовому форматі Prometheus."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """Короткий однорядковий підсумок для логів."""
+        parts = []
+        for metric in list(self._metrics.values()):
+            if isinstance(metric, Histogram):
+                parts.append(f'{metric.name}: n={metric.count} p50<={metric.quantile(0.5):g}s '
+                             f'p99<={metric.quantile(0.99):g}s')
+            else:
+                parts.append(f'{metric.name}={metric.value:g}')
+        return '; '.join(parts)
+
+    def snapshot(self) -> list[tuple]:
+        """Поточні значення метрик у вигляді, придатному для передачі між процесами."""
+        snapshot = []
+        for metric in list(self._metrics.values()):
+            if isinstance(metric, Histogram):
+                snapshot.append((Histogram, metric.name, metric.help,
+                                 (metric.buckets, list(metric.counts), metric.count, metric.sum)))
+            else:
+                snapshot.append((type(metric), metric.name, metric.help, metric.value))
+        return snapshot
+
+    def merge(self, snapshot: list[tuple]) -> None:
+        """Додає до метрик реєстру знімок іншого процесу (лічильники, значення й кошики сумуються)."""
+        for cls, name, help, data in snapshot:
+            if cls is Histogram:
+                buckets, counts, count, total = data
+                metric = self.histogram(name, help, buckets)
+                if metric.buckets != buckets:
+                    continue
+                metric.counts = [mine + theirs for mine, theirs in zip(metric.counts, counts)]
+                metric.count += count
+                metric.sum += total
+            else:
+                self._get(cls, name, help).inc(data)
+
+    def _get(self, cls, name: str, help: str):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help)
+            return self._metrics[name]
+
+
+registry = MetricsRegistry()
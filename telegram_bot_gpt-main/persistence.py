@@ -0,0 +1,289 @@
+"""Збереження context.user_data у SQLite з обмеженою кількістю сесій у пам'яті.
+
+Кожен користувач — окремий рядок таблиці sessions: PTB повідомляє лише про
+користувачів, які отримали оновлення, тож запис інкрементний, а незмінені
+сесії не перезаписуються зовсім. Дані кодуються компактним JSON з тегами
+для власних типів (SessionCodec) і стискаються, якщо вони великі.
+
+У пам'яті тримаються лише активні сесії: evict_idle() зберігає й вивантажує
+неактивні, а refresh_user_data() повертає сесію з диска, щойно користувач
+надішле нове оновлення.
+
+Запити до SQLite виконує окремий потік, тож запис на диск не блокує event loop.
+Потік один, і запити виконуються в порядку постановки: читання сесії завжди
+бачить усі записи, поставлені раніше. Кодування й декодування лишаються в
+потоці event loop — там, де обробники змінюють сесії.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
+
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Дані, довші за цей поріг (у байтах), стискаються zlib
+_COMPRESS_MIN = 512
+_PLAIN, _ZLIB = b'j', b'z'
+
+
+class SessionCodec:
+    """Компактне кодування user_data: JSON без пробілів, власні типи — через зареєстровані теги."""
+
+    def __init__(self):
+        self._encoders: dict[type, tuple[str, Callable[[Any], Any]]] = {}
+        self._decoders: dict[str, Callable[[Any], Any]] = {}
+
+    def register(self, cls: type, tag: str, encode: Callable[[Any], Any], decode: Callable[[Any], Any]) -> None:
+        """encode(obj) повертає JSON-сумісне значення, decode(value) відновлює об'єкт."""
+        self._encoders[cls] = (tag, encode)
+        self._decoders[tag] = decode
+
+    def dumps(self, data: dict) -> bytes:
+        raw = json.dumps(data, default=self._default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(raw) >= _COMPRESS_MIN:
+            return _ZLIB + zlib.compress(raw)
+        return _PLAIN + raw
+
+    def loads(self, blob: bytes) -> dict:
+        raw = zlib.decompress(blob[1:]) if blob[:1] == _ZLIB else blob[1:]
+        return json.loads(raw, object_hook=self._object_hook)
+
+    def _default(self, obj: Any) -> Any:
+        entry = self._encoders.get(type(obj))
+        if entry is None:
+            raise TypeError(f"Тип {type(obj).__name__} не зареєстровано в SessionCodec")
+        tag, encode = entry
+        return {'__t': tag, 'v': encode(obj)}
+
+    def _object_hook(self, value: dict) -> Any:
+        tag = value.get('__t')
+        if tag is not None and len(value) == 2 and tag in self._decoders:
+            return self._decoders[tag](value['v'])
+        return value
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для python-telegram-bot, що зберігає лише user_data.
+
+    idle_ttl — через скільки секунд неактивна сесія вивантажується з пам'яті;
+    max_resident — найбільша кількість сесій у пам'яті (найдавніші вивантажуються першими);
+    session_type — тип user_data (ContextTypes.user_data): збережені сесії іншого типу пропускаються.
+    """
+
+    def __init__(self, path: str, codec: SessionCodec | None = None, idle_ttl: float = 1800,
+                 max_resident: int = 50000, update_interval: float = 60, session_type: type = dict):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False),
+                         update_interval=update_interval)
+        self.codec = codec or SessionCodec()
+        self.idle_ttl = idle_ttl
+        self.max_resident = max_resident
+        self.session_type = session_type
+        # Сесії в пам'яті: user_id -> живий словник user_data (той самий, що в Application), за часом доступу
+        self._resident: OrderedDict[int, dict] = OrderedDict()
+        self._last_seen: dict[int, float] = {}
+        # Контрольні суми останнього запису: незмінену сесію не перезаписуємо
+        self._written: dict[int, int] = {}
+        # Вивантажені (а не видалені) сесії: їх drop_user_data не повинен стирати з диска.
+        # Якщо користувач повернувся раніше, ніж PTB викликав drop_user_data, сесія переходить у _returned
+        self._evicted: set[int] = set()
+        self._returned: set[int] = set()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sessions-db')
+        # Кілька процесів webhook-режиму пишуть в один файл — чекаємо на блокування, а не падаємо
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, '
+                         'data BLOB NOT NULL, updated REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)')
+        self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._resident)
+
+    # ---- user_data ----
+
+    async def get_user_data(self) -> dict[int, dict]:
+        # Під час запуску в пам'ять потрапляють лише нещодавно активні сесії, решта — на вимогу
+        rows = await self._submit(self._recent_rows, time.time() - self.idle_ttl, self.max_resident)
+        result = {}
+        for user_id, blob in reversed(rows):
+            data = self._decode(user_id, blob)
+            if data is not None:
+                result[user_id] = data
+                self._touch(user_id, data)
+                self._written[user_id] = zlib.crc32(blob)
+        logger.info(f"Відновлено {len(result)} активних сесій користувачів.")
+        return result
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id not in self._resident:
+            if user_id in self._evicted:
+                self._evicted.discard(user_id)
+                self._returned.add(user_id)
+            row = await self._submit(self._row, user_id)
+            if row is not None and not user_data:
+                data = self._decode(user_id, row[0])
+                if data:
+                    user_data.update(data)
+                self._written[user_id] = zlib.crc32(row[0])
+        self._touch(user_id, user_data)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self._write(user_id, data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if user_id in self._evicted:
+            # Сесію лише вивантажено з пам'яті — на диску вона лишається
+            self._evicted.discard(user_id)
+            return
+        if user_id in self._returned:
+            # Користувач повернувся між вивантаженням і цим викликом — зберігаємо поточний стан
+            self._returned.discard(user_id)
+            await self._write(user_id, self._resident[user_id])
+            return
+        self._resident.pop(user_id, None)
+        self._last_seen.pop(user_id, None)
+        self._written.pop(user_id, None)
+        await self._submit(self._delete, user_id)
+
+    async def evict_idle(self, application: Application) -> int:
+        """Зберігає та вивантажує з пам'яті неактивні сесії. Повертає кількість вивантажених."""
+        deadline = time.monotonic() - self.idle_ttl
+        evicted = 0
+        writes = []
+        # Записи ставляться в чергу до першого await: якщо користувач повернеться,
+        # refresh_user_data прочитає сесію вже після них
+        while self._resident:
+            user_id, data = next(iter(self._resident.items()))
+            if self._last_seen[user_id] >= deadline and len(self._resident) <= self.max_resident:
+                break
+            writes.append(self._write(user_id, data))
+            del self._resident[user_id]
+            del self._last_seen[user_id]
+            self._written.pop(user_id, None)
+            self._returned.discard(user_id)
+            self._evicted.add(user_id)
+            application.drop_user_data(user_id)
+            evicted += 1
+        for error in await asyncio.gather(*writes, return_exceptions=True):
+            if error is not None:
+                logger.error(f"Не вдалося зберегти вивантажену сесію: {error}")
+        if evicted:
+            logger.info(f"Вивантажено {evicted} неактивних сесій, у пам'яті {len(self._resident)}.")
+        return evicted
+
+    def _touch(self, user_id: int, data: dict) -> None:
+        self._resident[user_id] = data
+        self._resident.move_to_end(user_id)
+        self._last_seen[user_id] = time.monotonic()
+
+    def _write(self, user_id: int, data: dict) -> Awaitable[None]:
+        """Кодує сесію й одразу ставить її запис у чергу потоку бази; повертає очікуваний результат запису."""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+        try:
+            blob = self.codec.dumps(data)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Не вдалося закодувати сесію {user_id}: {e}")
+            return future
+        checksum = zlib.crc32(blob)
+        if self._written.get(user_id) == checksum:
+            return future
+        self._written[user_id] = checksum
+        write = self._submit(self._store, user_id, blob)
+
+        def forget(done: asyncio.Future) -> None:
+            # Запис не вдався — наступного разу сесію треба записати, навіть якщо вона не змінилась
+            if (done.cancelled() or done.exception()) and self._written.get(user_id) == checksum:
+                del self._written[user_id]
+
+        write.add_done_callback(forget)
+        return write
+
+    def _submit(self, function: Callable, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    # ---- запити, що виконуються в потоці бази ----
+
+    def _recent_rows(self, since: float, limit: int) -> list[tuple[int, bytes]]:
+        return self._db.execute('SELECT user_id, data FROM sessions WHERE updated >= ? '
+                                'ORDER BY updated DESC LIMIT ?', (since, limit)).fetchall()
+
+    def _row(self, user_id: int) -> tuple[bytes] | None:
+        return self._db.execute('SELECT data FROM sessions WHERE user_id = ?', (user_id,)).fetchone()
+
+    def _store(self, user_id: int, blob: bytes) -> None:
+        self._db.execute('INSERT OR REPLACE INTO sessions (user_id, data, updated) VALUES (?, ?, ?)',
+                         (user_id, blob, time.time()))
+        self._db.commit()
+
+    def _delete(self, user_id: int) -> None:
+        self._db.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+        self._db.commit()
+
+    def _decode(self, user_id: int, blob: bytes) -> Any:
+        try:
+            data = self.codec.loads(blob)
+        except (ValueError, TypeError, KeyError, IndexError, zlib.error) as e:
+            # Рядок може бути коректним JSON, але іншої форми (напр. після зміни класів сесії)
+            logger.warning(f"Пошкоджена сесія {user_id} пропущена: {e!r}")
+            return None
+        if not isinstance(data, self.session_type):
+            logger.info(f"Сесія {user_id} збережена в застарілому форматі й пропущена.")
+            return None
+        return data
+
+    # ---- решта даних бота не зберігається ----
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def flush(self) -> None:
+        # Під час зупинки зберігаємо всі сесії в пам'яті, а не лише змінені з останнього запуску
+        await asyncio.gather(*(self._write(user_id, data) for user_id, data in list(self._resident.items())),
+                             return_exceptions=True)
+        await self._submit(self._db.close)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class PrefetchPool(Generic[T]):
+    """Обмежений пул заздалегідь згенерованих елементів з фоновим поповненням.
+
+    produce() повертає партію нових елементів (наприклад, один запит до моделі —
+    кілька питань квізу). Коли в пулі лишається low_watermark елементів або менше,
+    у фоні запускається до concurrency поповнень, доки пул не заповниться до capacity.
+    Елементи з уже баченим ключем key(item) відкидаються. Якщо задано spill_path,
+    вміст пулу зберігається на диск при зупинці та відновлюється при старті;
+    validate(item) перевіряє відновлені елементи й повертає нормалізований
+    елемент або None — такі елементи відкидаються.
+    """
+
+    def __init__(self, name: str, produce: Callable[[], Awaitable[list[T]]],
+                 key: Callable[[T], Hashable], capacity: int = 30, low_watermark: int = 9,
+                 concurrency: int = 2, seen_limit: int = 5000, spill_path: str | None = None,
+                 validate: Callable[[Any], T | None] | None = None):
+        self.name = name
+        self.produce = produce
+        self.key = key
+        self.capacity = capacity
+        self.low_watermark = low_watermark
+        self.concurrency = concurrency
+        self.seen_limit = seen_limit
+        self.spill_path = spill_path
+        self.validate = validate
+        self._items: deque = deque()
+        self._seen: OrderedDict = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    async def start(self) -> None:
+        """Відновлює пул з диска та запускає перше поповнення."""
+        if self.spill_path:
+            try:
+                with open(self.spill_path, 'r', encoding='utf8') as file:
+                    self._restore(json.load(file))
+                logger.info(f"Пул {self.name}: відновлено {len(self._items)} елементів з диска.")
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.warning(f"Пул {self.name}: не вдалося прочитати {self.spill_path}: {e}")
+        self._schedule_refill()
+
+    async def stop(self) -> None:
+        """Зупиняє фонові поповнення та зберігає пул на диск."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.spill_path:
+            try:
+                directory = os.path.dirname(self.spill_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                tmp_path = f'{self.spill_path}.tmp'
+                with open(tmp_path, 'w', encoding='utf8') as file:
+                    json.dump(list(self._items), file, ensure_ascii=False)
+                os.replace(tmp_path, self.spill_path)
+            except OSError as e:
+                logger.warning(f"Пул {self.name}: не вдалося зберегти {self.spill_path}: {e}")
+
+    async def take(self, count: int = 1, accept: Callable[[T], bool] | None = None,
+                   wait: bool = True, produce: Callable[[], Awaitable[list[T]]] | None = None) -> list[T]:
+        """Повертає до count елементів, для яких accept(item) істинний (за замовчуванням — будь-які).
+
+        Зазвичай елементи вже є в пулі і повертаються миттєво. Якщо їх не вистачає
+        і wait=True, поповнення виконується одразу (через produce, якщо його задано, —
+        напр. з пріоритетом користувача, що чекає), а помилка генерації передається
+        викликачу. З wait=False повертається лише те, що вже є в пулі.
+        """
+        result = self._pop(count, accept)
+        try:
+            while wait and len(result) < count:
+                if not await self._refill(produce):
+                    break
+                result += self._pop(count - len(result), accept)
+        except BaseException:
+            # Не губимо вже взяті елементи, якщо генерація не вдалася або take скасовано (FanOut)
+            self._items.extendleft(reversed(result))
+            raise
+        finally:
+            self._schedule_refill()
+        return result
+
+    def _pop(self, count: int, accept: Callable[[T], bool] | None = None) -> list[T]:
+        if accept is None:
+            return [self._items.popleft() for _ in range(min(count, len(self._items)))]
+        # Невідповідні елементи лишаються в пулі для інших викликачів
+        result, rest = [], deque()
+        while self._items and len(result) < count:
+            item = self._items.popleft()
+            (result if accept(item) else rest).append(item)
+        self._items.extendleft(reversed(rest))
+        return result
+
+    def _restore(self, items: Any) -> None:
+        # Файл міг записати старіший формат або його пошкоджено: беремо лише коректні елементи
+        if not isinstance(items, list):
+            raise ValueError(f"очікувався JSON-масив, отримано {type(items).__name__}")
+        valid = []
+        for item in items:
+            try:
+                item = self.validate(item) if self.validate else item
+                if item is not None:
+                    self.key(item)
+                    valid.append(item)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                pass
+        if len(valid) < len(items):
+            logger.warning(f"Пул {self.name}: відкинуто {len(items) - len(valid)} некоректних елементів з диска.")
+        self._add(valid)
+
+    def _add(self, items: list[T]) -> int:
+        added = 0
+        for item in items:
+            if len(self._items) >= self.capacity:
+                break
+            key = self.key(item)
+            if key in self._seen:
+                continue
+            self._seen[key] = None
+            if len(self._seen) > self.seen_limit:
+                self._seen.popitem(last=False)
+            self._items.append(item)
+            added += 1
+        return added
+
+    async def _refill(self, produce: Callable[[], Awaitable[list[T]]] | None = None) -> int:
+        added = self._add(await (produce or self.produce)())
+        logger.debug(f"Пул {self.name}: додано {added} елементів, усього {len(self._items)}.")
+        return added
+
+    def _schedule_refill(self) -> None:
+        if len(self._items) > self.low_watermark:
+            return
+        while len(self._tasks) < self.concurrency:
+            task = asyncio.create_task(self._background_refill())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _background_refill(self) -> None:
+        try:
+            while len(self._items) < self.capacity:
+                # Якщо партія не додала нічого нового (лише дублікати), не крутимося в циклі
+                if not await self._refill():
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Пул {self.name}: фонове поповнення не вдалося: {e}")
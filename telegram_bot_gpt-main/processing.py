@@ -0,0 +1,90 @@
+import asyncio
+import contextlib
+import time
+from typing import Any, Awaitable, Hashable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import registry
+
+# BaseUpdateProcessor тримає слот свого семафора, поки оновлення чекає на чергу чату.
+# Тому його ліміт робимо фактично необмеженим, а справжній ліміт застосовуємо вже
+# після того, як настала черга чату — інакше один "гарячий" чат займав би всі слоти.
+_UNBOUNDED = 2 ** 31 - 1
+
+
+def _chat_key(update: object) -> Hashable | None:
+    if isinstance(update, Update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return 'user', update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обробляє оновлення різних чатів паралельно, а одного чату — строго по черзі.
+
+    Одночасно виконується не більше max_concurrent оновлень. Оновлення одного
+    чату чекають на власний asyncio.Lock (черга FIFO), тож conversation_state та
+    індекс питання квізу змінюються в тому порядку, в якому прийшли оновлення.
+    Глибина черги та час очікування доступні як метрики.
+    """
+
+    def __init__(self, max_concurrent: int = 64):
+        super().__init__(_UNBOUNDED)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._chat_locks: dict[Hashable, asyncio.Lock] = {}
+        self._chat_users: dict[Hashable, int] = {}
+        self.queue_depth = registry.gauge('bot_updates_waiting', 'Updates waiting for their chat or a free slot')
+        self.in_progress = registry.gauge('bot_updates_in_progress', 'Updates being handled right now')
+        self.processed = registry.counter('bot_updates_processed_total', 'Handled updates')
+        self.wait_time = registry.histogram('bot_update_wait_seconds', 'Time an update waited before handling')
+        self.handle_time = registry.histogram('bot_update_handle_seconds', 'Time spent handling an update')
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _chat_key(update)
+        arrived = time.monotonic()
+        lock = contextlib.nullcontext()
+        if key is not None:
+            lock = self._chat_locks.get(key)
+            if lock is None:
+                lock = self._chat_locks[key] = asyncio.Lock()
+            self._chat_users[key] = self._chat_users.get(key, 0) + 1
+
+        self.queue_depth.inc()
+        waiting = True
+        try:
+            async with lock:
+                async with self._slots:
+                    waiting = False
+                    self.queue_depth.dec()
+                    await self._handle(coroutine, arrived)
+        finally:
+            if waiting:
+                self.queue_depth.dec()
+            if key is not None:
+                # Прибираємо замок, коли в чату не лишилось оновлень, щоб словник не ріс
+                self._chat_users[key] -= 1
+                if not self._chat_users[key]:
+                    del self._chat_users[key]
+                    del self._chat_locks[key]
+
+    async def _handle(self, coroutine: Awaitable[Any], arrived: float) -> None:
+        started = time.monotonic()
+        self.wait_time.observe(started - arrived)
+        self.in_progress.inc()
+        try:
+            await coroutine
+        finally:
+            self.in_progress.dec()
+            self.handle_time.observe(time.monotonic() - started)
+            self.processed.inc()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
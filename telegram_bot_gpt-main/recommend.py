@@ -0,0 +1,70 @@
+from collections import deque
+from typing import Awaitable, Callable, Hashable
+
+# fetch_batch(category, genre, exclude, count, user_id) -> ранжований список кандидатів {'title', 'description', 'reason'}
+FetchBatch = Callable[[str, str, list[str], int, Hashable | None], Awaitable[list[dict]]]
+
+
+def _normalize_title(title: str) -> str:
+    return ' '.join(str(title).lower().split())
+
+
+class RecommendationQueue:
+    """Черга кандидатів-рекомендацій однієї сесії (категорія + жанр)."""
+    __slots__ = ('category', 'genre', 'candidates', 'seen')
+
+    def __init__(self, category: str, genre: str):
+        self.category = category
+        self.genre = genre
+        self.candidates: deque = deque()
+        # Назви вже показаних рекомендацій у порядку показу
+        self.seen: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def to_dict(self) -> dict:
+        return {'category': self.category, 'genre': self.genre,
+                'candidates': list(self.candidates), 'seen': self.seen}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RecommendationQueue':
+        queue = cls(data['category'], data['genre'])
+        queue.candidates.extend(data['candidates'])
+        queue.seen = list(data['seen'])
+        return queue
+
+
+class RecommendationEngine:
+    """Видає рекомендації з черги сесії та звертається до моделі лише коли черга порожня.
+
+    Один запит повертає ранжований список із batch_size кандидатів, тому більшість
+    натискань "Не подобається" обслуговуються без звернення до моделі. У промпт
+    передаються лише останні exclude_limit показаних назв, тож він не росте.
+    """
+
+    def __init__(self, fetch_batch: FetchBatch, batch_size: int = 5, exclude_limit: int = 10):
+        self.fetch_batch = fetch_batch
+        self.batch_size = batch_size
+        self.exclude_limit = exclude_limit
+
+    async def next(self, queue: RecommendationQueue, user_id: Hashable | None = None) -> dict | None:
+        """Повертає наступну рекомендацію або None, якщо модель не запропонувала нічого нового.
+
+        user_id передається у fetch_batch, щоб запит враховувався в лімітах цього користувача.
+        """
+        if not queue.candidates:
+            seen = {_normalize_title(title) for title in queue.seen}
+            batch = await self.fetch_batch(queue.category, queue.genre,
+                                           queue.seen[-self.exclude_limit:], self.batch_size, user_id)
+            for candidate in batch:
+                title = _normalize_title(candidate['title'])
+                if title not in seen:
+                    seen.add(title)
+                    queue.candidates.append(candidate)
+            if not queue.candidates:
+                return None
+
+        candidate = queue.candidates.popleft()
+        queue.seen.append(candidate['title'])
+        return candidate
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    """Метадані зображення з resources/images/."""
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+@dataclass(frozen=True)
+class ResourceSnapshot:
+    """Незмінний індекс усіх ресурсів на певний момент часу."""
+    prompts: Mapping[str, str] = field(default_factory=dict)
+    messages: Mapping[str, str] = field(default_factory=dict)
+    images: Mapping[str, ImageInfo] = field(default_factory=dict)
+    # (шлях, mtime_ns, розмір) кожного файлу — за ним визначаємо, чи змінилось щось на диску
+    signature: frozenset = frozenset()
+
+
+class ResourceRegistry:
+    """Реєстр промптів, повідомлень та зображень, завантажених у пам'ять.
+
+    Усі ресурси читаються один раз при створенні реєстру; звернення до них
+    не торкаються файлової системи. Фоновий потік (start_watching) періодично
+    перевіряє mtime файлів і при змінах будує новий знімок, який підміняє
+    старий однією операцією присвоєння — читачі бачать або старий, або новий
+    знімок повністю.
+    """
+
+    def __init__(self, root: str = 'resources'):
+        self.root = root
+        self._snapshot = ResourceSnapshot()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.reload()
+
+    @property
+    def snapshot(self) -> ResourceSnapshot:
+        return self._snapshot
+
+    def prompt(self, name: str) -> str | None:
+        return self._snapshot.prompts.get(name)
+
+    def message(self, name: str) -> str | None:
+        return self._snapshot.messages.get(name)
+
+    def image(self, name: str) -> ImageInfo | None:
+        return self._snapshot.images.get(name)
+
+    def prompt_names(self, prefix: str = '') -> list[str]:
+        """Назви промптів з префіксом prefix (напр. 'talk_'), за алфавітом."""
+        return sorted(name for name in self._snapshot.prompts if name.startswith(prefix))
+
+    def reload(self) -> bool:
+        """Перечитує ресурси, якщо файли на диску змінилися. Повертає True, якщо знімок оновлено."""
+        files = {kind: self._scan(kind, ext) for kind, ext in
+                 (('prompts', '.txt'), ('messages', '.txt'), ('images', '.jpg'))}
+        signature = frozenset((entry.path, stat.st_mtime_ns, stat.st_size)
+                              for entries in files.values() for entry, stat in entries.values())
+        if signature == self._snapshot.signature:
+            return False
+
+        previous = self._snapshot
+        snapshot = ResourceSnapshot(
+            prompts=MappingProxyType({name: self._read_text(entry.path)
+                                      for name, (entry, _) in files['prompts'].items()}),
+            messages=MappingProxyType({name: self._read_text(entry.path)
+                                       for name, (entry, _) in files['messages'].items()}),
+            images=MappingProxyType({name: self._image_info(entry.path, stat, previous.images.get(name))
+                                     for name, (entry, stat) in files['images'].items()}),
+            signature=signature
+        )
+        self._snapshot = snapshot
+        if previous.signature:
+            logger.info(f"Ресурси з {self.root} перезавантажено.")
+        return True
+
+    def start_watching(self, interval: float = 2.0) -> None:
+        """Запускає фонову перевірку змін у файлах ресурсів."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, args=(interval,),
+                                        name='resource-watcher', daemon=True)
+        self._thread.start()
+
+    def stop_watching(self) -> None:
+        self._stop.set()
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.reload()
+            except Exception as e:
+                # Файл могли саме редагувати — спробуємо на наступній ітерації
+                logger.warning(f"Не вдалося перезавантажити ресурси: {e}")
+
+    def _scan(self, kind: str, ext: str) -> dict:
+        directory = os.path.join(self.root, kind)
+        entries = {}
+        try:
+            with os.scandir(directory) as iterator:
+                for entry in iterator:
+                    if entry.is_file() and entry.name.endswith(ext):
+                        entries[entry.name[:-len(ext)]] = (entry, entry.stat())
+        except FileNotFoundError:
+            logger.error(f"Папку ресурсів не знайдено: {directory}")
+        return entries
+
+    @staticmethod
+    def _read_text(path: str) -> str:
+        with open(path, 'r', encoding='utf8') as file:
+            return file.read()
+
+    @staticmethod
+    def _image_info(path: str, stat: os.stat_result, previous: ImageInfo | None) -> ImageInfo:
+        # Незмінені зображення не перехешовуємо
+        if previous and previous.mtime_ns == stat.st_mtime_ns and previous.size == stat.st_size:
+            return previous
+        with open(path, 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        return ImageInfo(path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=digest)
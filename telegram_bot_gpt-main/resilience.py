@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class CircuitOpen(Exception):
+    """Запит не виконувався: запобіжник розімкнено, бо upstream зараз не працює."""
+
+
+class CircuitBreaker:
+    """Запобіжник: після failure_threshold помилок поспіль запити одразу відхиляються.
+
+    Через reset_timeout секунд пропускається один пробний запит (half-open):
+    успіх замикає запобіжник, помилка знову розмикає його.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state_gauge = registry.gauge(f'{name}_circuit_open', 'Circuit breaker state (1 = open)')
+        self.rejected = registry.counter(f'{name}_circuit_rejected_total', 'Calls rejected by the open circuit')
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        # Пробний запит пропускається раз на reset_timeout: якщо попередній завис
+        # чи був скасований, запобіжник не лишиться в half-open назавжди
+        if now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True
+        self.rejected.inc()
+        return False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info(f"Запобіжник {self.name}: upstream відновився.")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.state_gauge.set(0)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Запобіжник {self.name}: {self.failures} помилок поспіль, розмикаю.")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.state_gauge.set(1)
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Експоненційна затримка з повним джитером: випадкове значення з [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def hedged(factory: Callable[[], Awaitable[T]], delay: float, on_hedge: Callable[[], None] = None) -> T:
+    """Запускає factory(), а якщо відповіді немає за delay секунд — ще одну копію.
+
+    Повертає перший успішний результат, решту запитів скасовує. Помилку
+    повертає лише тоді, коли не вдалися обидві спроби.
+    """
+    pending = {asyncio.ensure_future(factory())}
+    error = None
+    # Усе після першого запуску — під finally: якщо викликача скасовано або минув
+    # його дедлайн, незавершені запити скасовуються, а не виконуються далі
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return done.pop().result()
+
+        if on_hedge:
+            on_hedge()
+        pending.add(asyncio.ensure_future(factory()))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
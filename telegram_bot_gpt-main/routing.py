@@ -0,0 +1,77 @@
+import json
+import logging
+from dataclasses import dataclass, replace
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MODEL = "gpt-3.5-turbo"  # gpt-4o,  gpt-4-turbo,    gpt-3.5-turbo,  GPT-4o mini
+
+
+@dataclass(frozen=True)
+class Route:
+    """Параметри звернення до моделі для одного режиму."""
+    model: str
+    max_tokens: int
+    temperature: float
+    timeout: float
+
+
+# Ліміти токенів розраховані на українську мову (кирилиця займає більше токенів за латиницю)
+DEFAULT_ROUTES = {
+    'default': Route(DEFAULT_MODEL, 3000, 0.9, 60.0),
+    'translator': Route(DEFAULT_MODEL, 2000, 0.2, 30.0),
+    'quiz_generator': Route(DEFAULT_MODEL, 1500, 0.8, 60.0),
+    'random': Route(DEFAULT_MODEL, 1200, 1.0, 45.0),
+    'recommend': Route(DEFAULT_MODEL, 1500, 0.7, 45.0),
+    'gpt': Route(DEFAULT_MODEL, 2000, 0.7, 60.0),
+    'talk_*': Route(DEFAULT_MODEL, 1000, 0.9, 60.0),
+}
+
+
+class ModelRouter:
+    """Таблиця маршрутів: режим -> модель, max_tokens, temperature, timeout.
+
+    Ключ може бути точною назвою режиму або шаблоном з '*' у кінці (talk_*);
+    режими без маршруту використовують 'default'. overrides — часткові
+    налаштування поверх DEFAULT_ROUTES, напр. {"translator": {"model": "gpt-4o-mini"}}.
+    """
+
+    def __init__(self, routes: dict[str, Route] = DEFAULT_ROUTES, overrides: dict[str, dict] | None = None):
+        self.routes = dict(routes)
+        self._index()
+        # Перевизначення режиму доповнює маршрут, який режим отримав би без нього (talk_queen — від talk_*)
+        for mode, fields in sorted((overrides or {}).items(), key=lambda item: not item[0].endswith('*')):
+            self.routes[mode] = replace(self.route(mode), **fields)
+            self._index()
+
+    def _index(self) -> None:
+        # Шаблони від найдовшого префікса, щоб конкретніший мав перевагу
+        self._patterns = sorted(((key[:-1], route) for key, route in self.routes.items() if key.endswith('*')),
+                                key=lambda item: -len(item[0]))
+        self._resolved: dict[str | None, Route] = {}
+
+    @classmethod
+    def from_json(cls, text: str) -> 'ModelRouter':
+        """Створює таблицю з перевизначеннями у форматі JSON (некоректний JSON ігнорується з попередженням)."""
+        overrides = {}
+        if text:
+            try:
+                overrides = json.loads(text)
+                if not isinstance(overrides, dict):
+                    raise TypeError(f"очікувався JSON-об'єкт, отримано {type(overrides).__name__}")
+                cls(overrides=overrides)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Некоректні перевизначення маршрутів моделі: {e}. Використовую типові.")
+                overrides = {}
+        return cls(overrides=overrides)
+
+    def route(self, mode: str | None) -> Route:
+        route = self._resolved.get(mode)
+        if route is None:
+            route = self.routes.get(mode) if mode else None
+            if route is None:
+                route = next((route for prefix, route in self._patterns if mode and mode.startswith(prefix)),
+                             self.routes['default'])
+            self._resolved[mode] = route
+        return route
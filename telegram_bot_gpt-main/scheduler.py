@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import AsyncIterator, Hashable
+
+from metrics import registry
+
+
+class Priority(IntEnum):
+    """Смуги пріоритету: менше значення обслуговується раніше."""
+    INTERACTIVE = 0  # короткі запити, на які користувач чекає (переклад)
+    CHAT = 1         # розмови, рекомендації, факти на вимогу
+    BACKGROUND = 2   # фонове поповнення пулів квізів та фактів
+
+
+class SchedulerBusy(Exception):
+    """Запит до моделі відхилено: користувач перевищив ліміт або черга переповнена."""
+
+
+class TokenBucket:
+    """Відро токенів: rate токенів на секунду, не більше burst одночасно."""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now: float) -> bool:
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ModelScheduler:
+    """Допуск запитів до моделі: ліміт на користувача, спільний ліміт паралельності та пріоритети.
+
+    Кожен користувач має власне відро токенів (user_rate запитів на секунду,
+    до user_burst поспіль), тож один користувач не забирає модель в інших.
+    Одночасно виконується не більше max_concurrent запитів; решта чекають
+    у черзі, звідки першими виходять запити вищого пріоритету. Якщо черга смуги
+    заповнена або запит чекав довше за max_wait його смуги, кидається
+    SchedulerBusy — обробник одразу відповідає "зайнято", а не висить до таймауту.
+    """
+
+    def __init__(self, max_concurrent: int = 16, user_rate: float = 1 / 3, user_burst: float = 5,
+                 max_queue: dict[Priority, int] | None = None,
+                 max_wait: dict[Priority, float] | None = None, max_users: int = 10000):
+        self.max_concurrent = max_concurrent
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_queue = max_queue or {Priority.INTERACTIVE: 100, Priority.CHAT: 50, Priority.BACKGROUND: 4}
+        self.max_wait = max_wait or {Priority.INTERACTIVE: 10.0, Priority.CHAT: 15.0, Priority.BACKGROUND: 60.0}
+        self.max_users = max_users
+        self._active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._waiting = {priority: 0 for priority in Priority}
+        self._order = itertools.count()
+        self._buckets: dict[Hashable, TokenBucket] = {}
+        self.active_gauge = registry.gauge('model_calls_active', 'Model calls being executed')
+        self.waiting_gauge = registry.gauge('model_calls_waiting', 'Model calls waiting for a free slot')
+        self.shed = registry.counter('model_calls_shed_total', 'Model calls rejected by the scheduler')
+        self.wait_time = registry.histogram('model_call_wait_seconds', 'Time a model call waited for a slot')
+
+    @asynccontextmanager
+    async def slot(self, user_id: Hashable | None = None,
+                   priority: Priority = Priority.CHAT) -> AsyncIterator[None]:
+        """Займає місце для одного запиту до моделі на час блоку async with."""
+        await self.acquire(user_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_id: Hashable | None = None, priority: Priority = Priority.CHAT) -> None:
+        priority = Priority(priority)
+        now = time.monotonic()
+        if user_id is not None and not self._bucket(user_id, now).try_take(now):
+            self.shed.inc()
+            raise SchedulerBusy(f"Користувач {user_id} перевищив ліміт запитів")
+
+        if self._active < self.max_concurrent and not self._waiters:
+            self._grant()
+            self.wait_time.observe(0)
+            return
+
+        if self._waiting[priority] >= self.max_queue[priority]:
+            self.shed.inc()
+            raise SchedulerBusy(f"Черга запитів ({priority.name}) переповнена")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._waiting[priority] += 1
+        self.waiting_gauge.inc()
+        self._wake()
+        try:
+            await asyncio.wait_for(future, self.max_wait[priority])
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Місце вже передали цьому запиту — повертаємо його наступному
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed.inc()
+                raise SchedulerBusy(f"Запит ({priority.name}) не дочекався вільного місця") from None
+            raise
+        finally:
+            self._waiting[priority] -= 1
+            self.waiting_gauge.dec()
+            self.wait_time.observe(time.monotonic() - now)
+
+    def release(self) -> None:
+        self._active -= 1
+        self.active_gauge.dec()
+        self._wake()
+
+    def _wake(self) -> None:
+        # Вільні місця переходять першим живим запитам з найвищим пріоритетом
+        while self._waiters and self._active < self.max_concurrent:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._grant()
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        return {'active': self._active, 'waiting': {p.name: n for p, n in self._waiting.items()},
+                'users': len(self._buckets)}
+
+    def _grant(self) -> None:
+        self._active += 1
+        self.active_gauge.inc()
+
+    def _bucket(self, user_id: Hashable, now: float) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_users:
+                self._prune(now)
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        # Повне відро нічим не відрізняється від нового, тож його можна забути
+        for user_id, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self._buckets[user_id]
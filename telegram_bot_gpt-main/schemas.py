@@ -0,0 +1,190 @@
+"""Структуровані відповіді моделі: витягування JSON, перевірка за схемою та точкові перезапити.
+
+Модель часто повертає майже коректний JSON: у ```json-обгортці, з текстом
+навколо, з комами перед дужкою, "розумними" лапками або обрізаний на max_tokens.
+extract_json() відновлює з такої відповіді все, що можна, а extract_items()
+перевіряє кожен елемент за схемою і перепитує модель лише про некоректні елементи,
+замість того щоб відкидати всю відповідь.
+"""
+import json
+import logging
+import re
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+_FENCE_RE = re.compile(r'```(?:json)?', re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r',\s*([\]}])')
+_SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '„': '"', '«': '"', '»': '"'})
+_decoder = json.JSONDecoder()
+
+
+class MalformedOutput(ValueError):
+    """З відповіді моделі не вдалося відновити JSON потрібної структури."""
+
+
+def extract_json(text: str) -> Any:
+    """Повертає JSON-значення з відповіді моделі або кидає MalformedOutput, якщо відновити нічого не вдалося.
+
+    Якщо масив обрізаний чи містить сміття між елементами, повертається список
+    об'єктів, які вдалося розібрати повністю.
+    """
+    text = _FENCE_RE.sub('', text).strip()
+    start = min((index for index in (text.find('['), text.find('{')) if index >= 0), default=-1)
+    if start < 0:
+        raise MalformedOutput("У відповіді моделі немає JSON.")
+    text = text[start:]
+
+    for candidate in (text, _TRAILING_COMMA_RE.sub(r'\1', text.translate(_SMART_QUOTES))):
+        try:
+            value, _ = _decoder.raw_decode(candidate)
+            return value
+        except ValueError:
+            pass
+
+    objects = _salvage_objects(_TRAILING_COMMA_RE.sub(r'\1', text.translate(_SMART_QUOTES)))
+    if not objects:
+        raise MalformedOutput("Не вдалося відновити JSON з відповіді моделі.")
+    return objects
+
+
+def _salvage_objects(text: str) -> list:
+    # Розбираємо кожен повний об'єкт окремо: обрізаний хвіст і сміття між елементами пропускаються
+    objects, index = [], text.find('{', 1 if text.startswith('[') else 0)
+    while index >= 0:
+        try:
+            value, end = _decoder.raw_decode(text, index)
+        except ValueError:
+            index = text.find('{', index + 1)
+            continue
+        if isinstance(value, dict):
+            objects.append(value)
+        index = text.find('{', end)
+    return objects
+
+
+class Schema:
+    """Схема елемента відповіді: обов'язкові поля з типами та додаткова перевірка check.
+
+    check(item) отримує вже нормалізований елемент і повертає текст помилки
+    або None; він може виправляти елемент на місці (наприклад, регістр відповіді).
+    """
+
+    def __init__(self, name: str, fields: dict[str, type], check: Callable[[dict], str | None] | None = None):
+        self.name = name
+        self.fields = fields
+        self.check = check
+
+    def validate(self, item: Any) -> tuple[dict | None, str | None]:
+        """Повертає (нормалізований елемент, None) або (None, опис помилки)."""
+        if not isinstance(item, dict):
+            return None, "елемент не є об'єктом"
+        result = {}
+        for name, kind in self.fields.items():
+            value = item.get(name)
+            if isinstance(value, str):
+                value = value.strip()
+            if kind is list and isinstance(value, list):
+                value = [option.strip() if isinstance(option, str) else option for option in value]
+            if not isinstance(value, kind) or (kind in (str, list) and not value):
+                return None, f"поле '{name}' відсутнє або має неправильний тип"
+            result[name] = value
+        if self.check:
+            error = self.check(result)
+            if error:
+                return None, error
+        return result, None
+
+    def describe(self) -> str:
+        return ', '.join(f"'{name}' ({'рядок' if kind is str else 'масив'})" for name, kind in self.fields.items())
+
+
+def _check_quiz_question(item: dict) -> str | None:
+    options = item['options']
+    if len(options) != 4 or not all(isinstance(option, str) and option for option in options):
+        return "'options' має містити рівно 4 непорожні рядки"
+    if len({option.casefold() for option in options}) != 4:
+        return "варіанти відповіді в 'options' повторюються"
+    answer = item['correct_answer']
+    if answer not in options:
+        # Модель часто змінює регістр або пунктуацію правильної відповіді — зіставляємо з варіантом
+        matches = [option for option in options if option.casefold().strip(' .') == answer.casefold().strip(' .')]
+        if len(matches) != 1:
+            return "'correct_answer' не збігається з жодним варіантом з 'options'"
+        item['correct_answer'] = matches[0]
+    return None
+
+
+QUIZ_QUESTION = Schema('питання квізу', {'question': str, 'options': list, 'correct_answer': str},
+                       _check_quiz_question)
+RECOMMENDATION = Schema('рекомендація', {'title': str, 'description': str, 'reason': str})
+
+
+def _unwrap_list(value: Any, fields=()) -> list:
+    if isinstance(value, dict):
+        # {"questions": [...]} — масив, загорнутий в об'єкт
+        lists = [field for field in value.values() if isinstance(field, list)]
+        value = lists[0] if len(lists) == 1 and not value.keys() & fields else [value]
+    if not isinstance(value, list):
+        raise MalformedOutput(f"Очікувався JSON-масив, отримано {type(value).__name__}.")
+    return value
+
+
+def extract_strings(answer: str) -> list[str]:
+    """Витягує з відповіді моделі масив рядків (зокрема загорнутий в об'єкт чи блок коду).
+
+    Елементи, що не є непорожніми рядками, відкидаються. MalformedOutput кидається,
+    якщо JSON-масиву у відповіді немає.
+    """
+    items = _unwrap_list(extract_json(answer))
+    return [item.strip() for item in items if isinstance(item, str) and item.strip()]
+
+
+def validate_items(value: Any, schema: Schema) -> tuple[list[dict], list[tuple[Any, str]]]:
+    """Ділить елементи на коректні (нормалізовані) та некоректні з описом помилки."""
+    value = _unwrap_list(value, schema.fields.keys())
+    valid, invalid = [], []
+    for item in value:
+        normalized, error = schema.validate(item)
+        if normalized is not None:
+            valid.append(normalized)
+        else:
+            invalid.append((item, error))
+    return valid, invalid
+
+
+def repair_request(schema: Schema, invalid: list[tuple[Any, str]]) -> str:
+    """Запит до моделі на виправлення лише некоректних елементів."""
+    lines = [f"Ці елементи ({schema.name}) у твоїй відповіді некоректні:"]
+    for number, (item, error) in enumerate(invalid, 1):
+        lines.append(f"{number}. {json.dumps(item, ensure_ascii=False)} — {error}")
+    lines.append(f"Поверни виправлені версії лише цих елементів ({len(invalid)} шт.) як JSON-масив об'єктів "
+                 f"з полями {schema.describe()}. Жодного тексту, окрім JSON.")
+    return '\n'.join(lines)
+
+
+async def extract_items(answer: str, schema: Schema, reask: Callable[[str], Awaitable[str]] | None = None,
+                        max_reasks: int = 1) -> list[dict]:
+    """Витягує з відповіді моделі коректні за схемою елементи.
+
+    Некоректні елементи (до max_reasks разів) надсилаються моделі через reask(текст)
+    на виправлення, решта відповіді зберігається; якщо перезапит не вдався, повертаються
+    вже коректні елементи. MalformedOutput кидається, лише якщо з відповіді не вдалося
+    відновити JSON взагалі.
+    """
+    valid, invalid = validate_items(extract_json(answer), schema)
+    for _ in range(max_reasks if reask else 0):
+        if not invalid:
+            break
+        logger.info(f"Перепитую модель про {len(invalid)} некоректних елементів ({schema.name}).")
+        try:
+            fixed, invalid = validate_items(extract_json(await reask(repair_request(schema, invalid))), schema)
+        except Exception as e:
+            # Збій перезапиту (SchedulerBusy, таймаут, помилка API) не скасовує вже коректні елементи;
+            # CancelledError не є Exception і передається далі
+            logger.warning(f"Виправлення елементів ({schema.name}) не вдалося: {e!r}")
+            break
+        valid.extend(fixed)
+    if invalid:
+        logger.warning(f"Відкинуто {len(invalid)} некоректних елементів ({schema.name}).")
+    return valid
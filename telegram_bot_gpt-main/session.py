@@ -0,0 +1,210 @@
+"""Типізована сесія користувача замість довільних ключів у context.user_data.
+
+Кожен режим бота має власний об'єкт стану з __slots__, а UserSession зберігає
+поточний режим і його стан. Режим змінюється лише через enter() та advance():
+enter() починає режим зі свіжим станом (замість user_data.clear()), а advance()
+робить крок усередині режиму, зберігаючи стан, і перевіряє його за таблицею переходів.
+
+Стани серіалізуються в короткі списки значень у порядку __slots__ — їх кодує
+SessionCodec за тегом класу (TAG).
+
+Сесія також зберігає репліки розмов користувача з ChatGPT (за чатами), щоб
+відновити їх після перезапуску: сесії шардовані за користувачем, тож ці дані
+змінює лише один процес.
+"""
+from enum import Enum
+
+from recommend import RecommendationQueue
+
+
+class Mode(str, Enum):
+    IDLE = 'idle'
+    GPT = 'gpt'
+    TALK = 'talk'
+    QUIZ = 'quiz'
+    TRANSLATE = 'translate'
+    RECOMMEND_CATEGORY = 'recommend_category'
+    RECOMMEND_GENRE = 'recommend_genre'
+    RECOMMEND_ACTIVE = 'recommend_active'
+
+
+class InvalidTransition(ValueError):
+    """Крок між режимами, якого немає в таблиці переходів."""
+
+
+class _State:
+    """Стан режиму: поля лише з __slots__, усі мають типові значення в __init__."""
+    __slots__ = ()
+    TAG = ''
+
+    def to_list(self) -> list:
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values: list) -> '_State':
+        # Менше значень, ніж полів (сесія старішої версії) — решта полів лишаються типовими
+        state = cls()
+        for name, value in zip(cls.__slots__, values):
+            setattr(state, name, value)
+        return state
+
+
+class TalkState(_State):
+    __slots__ = ('personality',)
+    TAG = 'tk'
+
+    def __init__(self, personality: str | None = None):
+        # Ключ промпта особистості, напр. 'talk_cobain'; None — особистість ще не вибрана
+        self.personality = personality
+
+
+class QuizState(_State):
+    __slots__ = ('questions', 'index', 'score', 'message_id')
+    TAG = 'qz'
+
+    def __init__(self):
+        self.questions: list[dict] = []
+        self.index = 0
+        self.score = 0
+        # Повідомлення з поточним питанням (видаляється, якщо квіз завершено достроково)
+        self.message_id: int | None = None
+
+
+class TranslateState(_State):
+    __slots__ = ('source', 'source_name', 'target', 'target_name')
+    TAG = 'tr'
+
+    def __init__(self):
+        self.source: str | None = None
+        self.source_name: str | None = None
+        self.target: str | None = None
+        self.target_name: str | None = None
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.source_name and self.target_name)
+
+
+class RecommendState(_State):
+    __slots__ = ('category', 'queue', 'current')
+    TAG = 'rc'
+
+    def __init__(self):
+        self.category: str | None = None
+        self.queue: RecommendationQueue | None = None
+        # Остання показана рекомендація — її виключає кнопка "Не подобається"
+        self.current: dict | None = None
+
+
+STATE_TYPES = (TalkState, QuizState, TranslateState, RecommendState)
+
+# Стан, з яким починається режим (None — режим без стану)
+_MODE_STATE = {
+    Mode.IDLE: None,
+    Mode.GPT: None,
+    Mode.TALK: TalkState,
+    Mode.QUIZ: QuizState,
+    Mode.TRANSLATE: TranslateState,
+    Mode.RECOMMEND_CATEGORY: RecommendState,
+    Mode.RECOMMEND_GENRE: RecommendState,
+    Mode.RECOMMEND_ACTIVE: RecommendState,
+}
+
+# Кроки всередині режиму (стан зберігається); крок у той самий режим дозволений завжди
+_STEPS = {
+    Mode.RECOMMEND_CATEGORY: {Mode.RECOMMEND_GENRE},
+    Mode.RECOMMEND_GENRE: {Mode.RECOMMEND_ACTIVE},
+}
+
+# Зі скількох чатів зберігаються розмови користувача (найдавніше оновлені відкидаються)
+MAX_HISTORY_CHATS = 5
+
+
+class UserSession:
+    """Сесія користувача: context.user_data для ContextTypes(user_data=UserSession)."""
+    __slots__ = ('mode', 'state', 'history')
+    TAG = 'us'
+
+    def __init__(self):
+        self.mode = Mode.IDLE
+        self.state: _State | None = None
+        # chat_id -> репліки розмови з ChatGPT у цьому чаті: [[is_assistant, text], ...]
+        self.history: dict[int, list] = {}
+
+    def __bool__(self) -> bool:
+        # Як і порожній dict: нова сесія без режиму вважається порожньою (див. SQLitePersistence)
+        return self.mode is not Mode.IDLE or self.state is not None or bool(self.history)
+
+    def __repr__(self) -> str:
+        return f"UserSession({self.mode.value}, {self.state and self.state.to_list()})"
+
+    def enter(self, mode: Mode) -> _State | None:
+        """Починає режим mode зі свіжим станом і повертає цей стан."""
+        state_type = _MODE_STATE[mode]
+        self.mode = mode
+        self.state = state_type() if state_type else None
+        return self.state
+
+    def advance(self, mode: Mode) -> None:
+        """Крок усередині поточного режиму зі збереженням стану."""
+        if mode is not self.mode and mode not in _STEPS.get(self.mode, ()):
+            raise InvalidTransition(f"Перехід {self.mode.value} -> {mode.value} не дозволено")
+        self.mode = mode
+
+    def reset(self) -> None:
+        self.enter(Mode.IDLE)
+
+    def update(self, other: 'UserSession') -> None:
+        """Переносить стан іншої сесії (SQLitePersistence.refresh_user_data)."""
+        self.mode = other.mode
+        self.state = other.state
+        self.history = other.history
+
+    def remember(self, chat_id: int, turns: list) -> None:
+        """Зберігає репліки розмови в чаті chat_id (порожній список забуває розмову)."""
+        self.history.pop(chat_id, None)
+        if turns:
+            self.history[chat_id] = turns
+            while len(self.history) > MAX_HISTORY_CHATS:
+                del self.history[next(iter(self.history))]
+
+    def recall(self, chat_id: int) -> list:
+        return self.history.get(chat_id, [])
+
+    def _state(self, state_type: type) -> _State | None:
+        return self.state if isinstance(self.state, state_type) else None
+
+    @property
+    def talk(self) -> TalkState | None:
+        return self._state(TalkState)
+
+    @property
+    def quiz(self) -> QuizState | None:
+        return self._state(QuizState)
+
+    @property
+    def translate(self) -> TranslateState | None:
+        return self._state(TranslateState)
+
+    @property
+    def recommend(self) -> RecommendState | None:
+        return self._state(RecommendState)
+
+    def to_list(self) -> list:
+        if not self.history:
+            return [self.mode.value, self.state]
+        # Ключі об'єктів JSON — рядки, тож історію зберігаємо парами [chat_id, репліки]
+        return [self.mode.value, self.state, [[chat_id, turns] for chat_id, turns in self.history.items()]]
+
+    @classmethod
+    def from_list(cls, values: list) -> 'UserSession':
+        # Сесії, збережені до появи історії, мають лише два значення
+        mode, state, *rest = values
+        session = cls()
+        session.enter(Mode(mode))
+        # Стан уже відновив SessionCodec; стан іншого типу (напр. після зміни режимів) замінюємо свіжим
+        if session.state is not None and type(state) is type(session.state):
+            session.state = state
+        if rest:
+            session.history = {int(chat_id): turns for chat_id, turns in rest[0]}
+        return session
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+from cache import ResponseCache
+
+
+def test_responses_survive_restart_and_use_a_cache_thread(tmp_path):
+    path = str(tmp_path / 'responses.sqlite3')
+    threads = []
+
+    async def scenario():
+        cache = ResponseCache({'translator'}, path=path)
+        cache.put('key', 'відповідь')
+        await cache.close()
+
+        cache = ResponseCache({'translator'}, path=path)
+        load = cache._load
+
+        def recording_load(key, now):
+            threads.append(threading.current_thread())
+            return load(key, now)
+
+        cache._load = recording_load
+        value = await cache.get('key')
+        await cache.close()
+        return value
+
+    assert asyncio.run(scenario()) == 'відповідь'
+    assert threads and all(thread is not threading.main_thread() for thread in threads)
+
+
+def test_database_errors_are_misses(tmp_path):
+    async def scenario():
+        cache = ResponseCache({'translator'}, path=str(tmp_path / 'responses.sqlite3'))
+        await cache._submit(cache._db.execute, 'DROP TABLE responses')
+        cache.put('key', 'відповідь')
+        cache._entries.clear()
+        value = await cache.get('key')
+        await cache.close()
+        return value, cache.misses
+
+    assert asyncio.run(scenario()) == (None, 1)
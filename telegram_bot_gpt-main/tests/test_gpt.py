@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+import json
+
+import httpx
+from telegram import Chat, Message, Update, User
+
+from gpt import ChatGptService
+from processing import ChatOrderedUpdateProcessor
+
+
+def _completion(content: str) -> dict:
+    return {
+        'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-3.5-turbo',
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': content}}],
+    }
+
+
+def _service(delay: float, requests: list) -> ChatGptService:
+    # Справжній AsyncOpenAI поверх httpx.MockTransport: відповідь приходить через delay секунд
+    async def handle(request: httpx.Request) -> httpx.Response:
+        messages = json.loads(request.content)['messages']
+        requests.append(messages)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json=_completion(f"відповідь на {messages[-1]['content']}"))
+
+    return ChatGptService('test', http_client=httpx.AsyncClient(transport=httpx.MockTransport(handle)))
+
+
+def _update(update_id: int, chat_id: int, text: str) -> Update:
+    user = User(id=chat_id, first_name='Test', is_bot=False)
+    chat = Chat(id=chat_id, type=Chat.PRIVATE)
+    message = Message(message_id=update_id, date=datetime.datetime.now(datetime.timezone.utc),
+                      chat=chat, from_user=user, text=text)
+    return Update(update_id=update_id, message=message)
+
+
+def test_unrelated_update_is_handled_while_completion_is_pending():
+    finished = []
+
+    async def scenario():
+        service = _service(0.5, [])
+        processor = ChatOrderedUpdateProcessor()
+
+        async def ask_model():
+            await service.add_message((1, 1), 'питання')
+            finished.append('completion')
+
+        async def unrelated():
+            finished.append('unrelated')
+
+        slow = asyncio.create_task(processor.process_update(_update(1, 1, 'питання'), ask_model()))
+        await asyncio.sleep(0.05)
+        await asyncio.wait_for(processor.process_update(_update(2, 2, '/start'), unrelated()), 0.2)
+        await slow
+        await service.client.close()
+
+    asyncio.run(scenario())
+    assert finished == ['unrelated', 'completion']
+
+
+def test_concurrent_conversations_keep_separate_histories():
+    requests = []
+
+    async def scenario():
+        service = _service(0.05, requests)
+        service.set_prompt((1, 1), 'промпт першого')
+        service.set_prompt((2, 2), 'промпт другого')
+        await asyncio.gather(service.add_message((1, 1), 'від першого'),
+                             service.add_message((2, 2), 'від другого'))
+        await service.client.close()
+        return service
+
+    service = asyncio.run(scenario())
+    contents = sorted([message['content'] for message in messages] for messages in requests)
+    assert contents == [['промпт другого', 'від другого'], ['промпт першого', 'від першого']]
+    assert [message['content'] for message in service.conversations.get((1, 1)).to_messages()] == \
+        ['промпт першого', 'від першого', 'відповідь на від першого']
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+
+from conversation import ConversationStore, TokenCounter
+from persistence import SessionCodec, SQLitePersistence
+from session import STATE_TYPES, Mode, UserSession
+
+
+def _codec() -> SessionCodec:
+    codec = SessionCodec()
+    for session_type in (UserSession, *STATE_TYPES):
+        codec.register(session_type, session_type.TAG, session_type.to_list, session_type.from_list)
+    return codec
+
+
+def _persistence(path) -> SQLitePersistence:
+    return SQLitePersistence(str(path), _codec(), session_type=UserSession)
+
+
+def test_sessions_round_trip(tmp_path):
+    async def scenario():
+        persistence = _persistence(tmp_path / 'sessions.sqlite3')
+        session = UserSession()
+        session.enter(Mode.QUIZ).score = 2
+        await persistence.update_user_data(1, session)
+        await persistence.flush()
+
+        persistence = _persistence(tmp_path / 'sessions.sqlite3')
+        loaded = await persistence.get_user_data()
+        await persistence.flush()
+        return loaded
+
+    loaded = asyncio.run(scenario())
+    assert loaded[1].mode is Mode.QUIZ
+    assert loaded[1].quiz.score == 2
+
+
+def test_rows_of_unexpected_shape_are_skipped(tmp_path):
+    path = tmp_path / 'sessions.sqlite3'
+
+    async def scenario():
+        persistence = _persistence(path)
+        good = UserSession()
+        good.enter(Mode.GPT)
+        await persistence.update_user_data(1, good)
+        # Коректний JSON, але не та форма: з'являються TypeError / KeyError / ValueError при декодуванні
+        for user_id, raw in ((2, b'j{"__t":"us","v":5}'), (3, b'j{"__t":"us","v":["nope",null]}'),
+                             (4, b'j{"__t":"us","x":1}'), (5, b'jnull')):
+            await persistence._submit(persistence._store, user_id, raw)
+        await persistence.flush()
+
+        persistence = _persistence(path)
+        loaded = await persistence.get_user_data()
+        await persistence.flush()
+        return loaded
+
+    loaded = asyncio.run(scenario())
+    assert list(loaded) == [1]
+    assert loaded[1].mode is Mode.GPT
+
+
+def test_queries_run_off_the_event_loop_thread(tmp_path):
+    threads = []
+
+    async def scenario():
+        persistence = _persistence(tmp_path / 'sessions.sqlite3')
+        store = persistence._store
+
+        def recording_store(user_id, blob):
+            threads.append(threading.current_thread())
+            store(user_id, blob)
+
+        persistence._store = recording_store
+        session = UserSession()
+        session.enter(Mode.GPT)
+        await persistence.update_user_data(1, session)
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert threads and all(thread is not threading.main_thread() for thread in threads)
+
+
+def test_conversation_turns_survive_restart(tmp_path):
+    path = tmp_path / 'sessions.sqlite3'
+    store = ConversationStore(TokenCounter('gpt-3.5-turbo'), max_turns=4)
+    store.set_prompt((10, 1), 'промпт')
+    for number in range(3):
+        store.append((10, 1), False, f'питання {number}')
+        store.append((10, 1), True, f'відповідь {number}')
+
+    async def scenario():
+        persistence = _persistence(path)
+        session = UserSession()
+        session.enter(Mode.GPT)
+        session.remember(10, store.export((10, 1)))
+        await persistence.update_user_data(1, session)
+        await persistence.flush()
+
+        persistence = _persistence(path)
+        loaded = await persistence.get_user_data()
+        await persistence.flush()
+        return loaded
+
+    restored = ConversationStore(TokenCounter('gpt-3.5-turbo'), max_turns=4)
+    restored.set_prompt((10, 1), 'промпт')
+    restored.restore((10, 1), asyncio.run(scenario())[1].recall(10))
+    assert [message['content'] for message in restored.get((10, 1)).to_messages()] == \
+        ['промпт', 'питання 1', 'відповідь 1', 'питання 2', 'відповідь 2']
+
+
+def test_sessions_saved_before_history_still_load():
+    codec = _codec()
+    session = codec.loads(b'j{"__t":"us","v":["gpt",null]}')
+    assert session.mode is Mode.GPT and session.history == {}
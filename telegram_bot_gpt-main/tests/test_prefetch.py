@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from prefetch import PrefetchPool
+from schemas import QUIZ_QUESTION
+
+GOOD = {'question': 'Столиця Франції?', 'options': ['Париж', 'Ліон', 'Марсель', 'Ніцца'], 'correct_answer': 'Париж'}
+
+
+def _pool(path) -> PrefetchPool:
+    async def produce() -> list:
+        return []
+
+    return PrefetchPool('quiz', produce, lambda item: item['question'], spill_path=str(path),
+                        validate=lambda item: QUIZ_QUESTION.validate(item)[0])
+
+
+def test_invalid_spilled_items_are_dropped(tmp_path):
+    path = tmp_path / 'pool.json'
+    path.write_text(json.dumps([GOOD, 'рядок', {'question': 5}, None, [1, 2]], ensure_ascii=False),
+                    encoding='utf8')
+
+    async def scenario():
+        pool = _pool(path)
+        await pool.start()
+        items = await pool.take(5, wait=False)
+        await pool.stop()
+        return items
+
+    assert asyncio.run(scenario()) == [GOOD]
+
+
+def test_spill_of_wrong_shape_starts_empty(tmp_path):
+    path = tmp_path / 'pool.json'
+    path.write_text('{"questions": 3}', encoding='utf8')
+
+    async def scenario():
+        pool = _pool(path)
+        await pool.start()
+        size = len(pool)
+        await pool.stop()
+        return size
+
+    assert asyncio.run(scenario()) == 0
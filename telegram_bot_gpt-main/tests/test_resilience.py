@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from resilience import hedged
+
+
+def test_hedged_returns_first_answer_without_hedge():
+    calls = []
+
+    async def fast():
+        calls.append('call')
+        return 'answer'
+
+    assert asyncio.run(hedged(fast, 1.0)) == 'answer'
+    assert calls == ['call']
+
+
+def test_hedged_cancels_request_when_caller_times_out_during_delay():
+    finished = []
+
+    async def slow():
+        await asyncio.sleep(0.5)
+        finished.append('slow')
+        return 'late'
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(hedged(slow, 1.0), 0.1)
+        # Даємо скасованому запиту час, за який він завершився б
+        await asyncio.sleep(0.6)
+
+    asyncio.run(scenario())
+    assert finished == []
+
+
+def test_hedged_cancels_both_requests_when_caller_times_out_after_hedge():
+    finished = []
+    hedges = []
+
+    async def slow():
+        await asyncio.sleep(0.5)
+        finished.append('slow')
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(hedged(slow, 0.05, lambda: hedges.append(1)), 0.2)
+        await asyncio.sleep(0.6)
+
+    asyncio.run(scenario())
+    assert hedges == [1]
+    assert finished == []
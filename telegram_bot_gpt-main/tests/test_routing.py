@@ -0,0 +1,14 @@
+import pytest
+
+from routing import DEFAULT_ROUTES, ModelRouter
+
+
+@pytest.mark.parametrize('text', ['[]', '"gpt-4o"', '5', 'null', '{"gpt": 5}', '{"gpt": {"colour": 1}}', '{'])
+def test_invalid_overrides_fall_back_to_defaults(text):
+    assert ModelRouter.from_json(text).routes == DEFAULT_ROUTES
+
+
+def test_overrides_apply_on_top_of_the_pattern():
+    router = ModelRouter.from_json('{"talk_queen": {"model": "gpt-4o-mini"}}')
+    assert router.route('talk_queen').model == 'gpt-4o-mini'
+    assert router.route('talk_queen').max_tokens == DEFAULT_ROUTES['talk_*'].max_tokens
@@ -0,0 +1,47 @@
+import asyncio
+import json
+
+import pytest
+
+from scheduler import SchedulerBusy
+from schemas import RECOMMENDATION, MalformedOutput, extract_items, extract_strings
+
+ANSWER = json.dumps([
+    {'title': 'Дюна', 'description': 'Пустельна планета', 'reason': 'Класика'},
+    {'title': 'Сяйво', 'description': 'Готель узимку', 'reason': 'Атмосфера'},
+    {'title': 'Без опису'},
+], ensure_ascii=False)
+
+
+def test_failed_reask_keeps_valid_items():
+    async def reask(request: str) -> str:
+        raise SchedulerBusy("черга заповнена")
+
+    items = asyncio.run(extract_items(ANSWER, RECOMMENDATION, reask=reask))
+    assert [item['title'] for item in items] == ['Дюна', 'Сяйво']
+
+
+def test_cancelled_reask_is_not_swallowed():
+    async def reask(request: str) -> str:
+        raise asyncio.CancelledError
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(extract_items(ANSWER, RECOMMENDATION, reask=reask))
+
+
+def test_reask_fixes_invalid_items():
+    async def reask(request: str) -> str:
+        return json.dumps([{'title': 'Без опису', 'description': 'Тепер є', 'reason': 'Виправлено'}])
+
+    items = asyncio.run(extract_items(ANSWER, RECOMMENDATION, reask=reask))
+    assert [item['title'] for item in items] == ['Дюна', 'Сяйво', 'Без опису']
+
+
+def test_strings_are_unwrapped_from_object_and_fence():
+    answer = '```json\n{"facts": ["Перший факт", 42, "", " Другий факт "]}\n```'
+    assert extract_strings(answer) == ['Перший факт', 'Другий факт']
+
+
+def test_strings_without_json_are_malformed():
+    with pytest.raises(MalformedOutput):
+        extract_strings('1. Перший факт\n2. Другий факт')
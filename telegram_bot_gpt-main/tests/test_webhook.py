@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+
+from metrics import MetricsRegistry
+from webhook import UpdateJournal, WebhookServer, update_shard_key
+
+
+def test_shard_key_is_the_user_in_private_and_group_chats():
+    private = {'update_id': 1, 'message': {'from': {'id': 7}, 'chat': {'id': 7}}}
+    group = {'update_id': 2, 'message': {'from': {'id': 7}, 'chat': {'id': -100500}}}
+    button = {'update_id': 3, 'callback_query': {'from': {'id': 7}, 'message': {'chat': {'id': -100500}}}}
+    assert update_shard_key(private) == update_shard_key(group) == update_shard_key(button) == 7
+
+
+def test_shard_key_falls_back_to_chat_without_user():
+    assert update_shard_key({'update_id': 1, 'channel_post': {'chat': {'id': -42}}}) == -42
+
+
+def test_purge_keeps_recent_done_and_all_pending_updates(tmp_path):
+    journal = UpdateJournal(str(tmp_path / 'updates.sqlite3'))
+    for update_id in range(1, 21):
+        journal.append(update_id, '{}')
+        if update_id != 3:
+            journal.mark_done(update_id)
+
+    assert journal.purge_done(keep=5) == 14
+    assert journal.pending() == [(3, '{}')]
+    # Повторна доставка нещодавнього оновлення все ще розпізнається
+    assert journal.append(20, '{}') is False
+    journal.close()
+
+
+def test_finished_updates_are_committed_in_batches_off_the_loop(tmp_path):
+    path = str(tmp_path / 'updates.sqlite3')
+    batches = []
+
+    async def scenario():
+        journal = UpdateJournal(path)
+        for update_id in range(1, 6):
+            await journal.submit(journal.append, update_id, '{}')
+        mark_done = journal.mark_done
+
+        def recording_mark_done(*update_ids):
+            batches.append((threading.current_thread(), update_ids))
+            mark_done(*update_ids)
+
+        journal.mark_done = recording_mark_done
+        for update_id in range(1, 5):
+            journal.finish(update_id)
+        await journal.aclose()
+
+    asyncio.run(scenario())
+    assert all(thread is not threading.main_thread() for thread, _ in batches)
+    # Перша позначка пише одразу, решта накопичується, поки вона записується
+    assert [update_ids for _, update_ids in batches] == [(1,), (2, 3, 4)]
+    journal = UpdateJournal(path)
+    assert journal.pending() == [(5, '{}')]
+    journal.close()
+
+
+def test_metrics_include_worker_snapshots():
+    server = WebhookServer(2)
+    worker = MetricsRegistry()
+    worker.counter('test_worker_updates_total', 'Updates').inc(3)
+    worker.histogram('test_worker_seconds', 'Handle time', (0.1, 1)).observe(0.5)
+    server._metrics_queue.put((0, worker.snapshot()))
+    server._metrics_queue.put((1, worker.snapshot()))
+    # Новіший знімок того самого обробника замінює попередній
+    worker.counter('test_worker_updates_total', 'Updates').inc(1)
+    server._metrics_queue.put((1, worker.snapshot()))
+    time.sleep(0.2)
+
+    rendered = server.render_metrics()
+    assert 'test_worker_updates_total 7' in rendered
+    assert 'test_worker_seconds_bucket{le="1"} 2' in rendered
+    assert 'webhook_updates_received_total' in rendered
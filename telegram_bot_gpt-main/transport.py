@@ -0,0 +1,59 @@
+"""HTTP-транспорт бота: спільний клієнт для OpenAI та налаштування з'єднань Telegram.
+
+Усі параметри (розмір пулу, keep-alive, HTTP/2, таймаути, проксі) задаються
+в .env — див. credentials.py.
+"""
+import logging
+
+import httpx
+from telegram.ext import ApplicationBuilder
+
+from credentials import (
+    OPENAI_PROXY, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE, OPENAI_KEEPALIVE_EXPIRY, OPENAI_HTTP2,
+    OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT, TELEGRAM_PROXY, TELEGRAM_CONNECTION_POOL_SIZE,
+    TELEGRAM_HTTP2, TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT, TELEGRAM_WRITE_TIMEOUT,
+    TELEGRAM_POOL_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available(component: str) -> bool:
+    """HTTP/2 у httpx потребує пакета h2 (pip install httpx[http2]); без нього працюємо через HTTP/1.1."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning(f"{component}: HTTP/2 увімкнено, але пакет h2 не встановлено — використовую HTTP/1.1.")
+        return False
+
+
+def openai_http_client() -> httpx.AsyncClient:
+    """Один асинхронний клієнт на весь процес: з'єднання та TLS-сесії перевикористовуються всіма режимами."""
+    return httpx.AsyncClient(
+        proxy=OPENAI_PROXY,
+        http2=OPENAI_HTTP2 and http2_available('OpenAI'),
+        limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT))
+
+
+def configure_telegram(builder: ApplicationBuilder) -> ApplicationBuilder:
+    """Застосовує налаштування з'єднань до запитів Bot API.
+
+    Довге опитування getUpdates має власний запит PTB; йому потрібне одне
+    з'єднання, а таймаут читання PTB додає сам, тож задаємо лише проксі й версію HTTP.
+    """
+    http_version = '2' if TELEGRAM_HTTP2 and http2_available('Telegram') else '1.1'
+    builder = (builder
+               .connection_pool_size(TELEGRAM_CONNECTION_POOL_SIZE)
+               .connect_timeout(TELEGRAM_CONNECT_TIMEOUT)
+               .read_timeout(TELEGRAM_READ_TIMEOUT)
+               .write_timeout(TELEGRAM_WRITE_TIMEOUT)
+               .pool_timeout(TELEGRAM_POOL_TIMEOUT)
+               .http_version(http_version)
+               .get_updates_http_version(http_version))
+    if TELEGRAM_PROXY:
+        builder = builder.proxy(TELEGRAM_PROXY).get_updates_proxy(TELEGRAM_PROXY)
+    return builder
@@ -2,12 +2,26 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, \
     BotCommand, MenuButtonCommands, BotCommandScopeChat, MenuButtonDefault
 from telegram import Update
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
+import asyncio
+import json
 import os
 import logging
+import time
+from typing import Awaitable, Generator, Generic, TypeVar
+
+from credentials import FILE_ID_CACHE_PATH
+from markdown import MESSAGE_LIMIT, markup, md, plain_length, render, split_markdown, take_chunk, utf16_len
+from registry import ResourceRegistry
 
 logger = logging.getLogger(__name__)
 
+# Усі промпти, повідомлення та метадані зображень тримаються в пам'яті
+resources = ResourceRegistry('resources')
+
+T = TypeVar('T')
+
 
 # ===============================================
 #             ДОПОМІЖНІ ФУНКЦІЇ
@@ -45,22 +59,27 @@ def _get_thread_id(update: Update) -> int | None:
     return None
 
 
-def _markdown_v2_escape(text: str) -> str:
-    """Екранує спеціальні символи MarkdownV2, щоб уникнути помилок синтаксису.
-       ЦЕ КРИТИЧНО для безпечного використання ParseMode.MARKDOWN_V2.
-    """
-    # Символи: _, *, [, ], (, ), ~, `, >, #, +, -, =, |, {, }, ., !
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    # Попередження: Неправильне екранування може пошкодити ваші наміри форматування.
-    # Найкраще екранувати ВСЕ, а потім вручну застосовувати форматування там, де це потрібно.
-    # Для запобігання помилки з непарною кількістю "_" при MARKDOWN,
-    # переходимо на MARKDOWN_V2 та використовуємо більш агресивне екранування.
+def _retry_after_seconds(error: RetryAfter) -> float:
+    """Повертає затримку з RetryAfter у секундах (PTB може віддавати int або timedelta)."""
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+def _prepare_text(text: str, parse_mode: ParseMode) -> str:
+    """Готує текст до надсилання у вибраному режимі розмітки."""
+    if parse_mode == ParseMode.MARKDOWN_V2:
+        # Звичайний рядок екранується повністю; розмітку містять лише тексти з md()/markup()
+        text = render(text)
+
+    # Використовуємо .encode/.decode для підтримки широкого діапазону символів (як у вашому оригіналі)
+    return text.encode('utf16', errors='surrogatepass').decode('utf16')
 
-    # Використовуємо replace для найпоширеніших символів, які викликають проблеми
-    for char in escape_chars:
-        text = text.replace(char, f'\\{char}')
 
-    return text.replace('\\\\', '\\')  # Запобігаємо подвійному екрануванню
+def _prepare_chunks(text: str, parse_mode: ParseMode) -> list[str]:
+    """Як _prepare_text, але довгий текст MarkdownV2 ділиться на кілька повідомлень (ліміт Telegram — 4096)."""
+    if parse_mode != ParseMode.MARKDOWN_V2:
+        return [_prepare_text(text, parse_mode)]
+    return [_prepare_text(chunk, parse_mode) for chunk in split_markdown(text)]
 
 
 # ===============================================
@@ -71,29 +90,206 @@ def _markdown_v2_escape(text: str) -> str:
 async def send_text(update: Update, context: ContextTypes.DEFAULT_TYPE,
                     text: str, reply_markup: InlineKeyboardMarkup = None,
                     parse_mode: ParseMode = ParseMode.MARKDOWN_V2) -> Message:
-    """Надсилає текстове повідомлення з підтримкою MarkdownV2."""
+    """Надсилає текстове повідомлення з підтримкою MarkdownV2.
+
+    Довгий текст надсилається кількома повідомленнями по черзі; кнопки — лише під останнім.
+    """
 
     chat_id = _get_chat_id(update)
     thread_id = _get_thread_id(update)
 
-    # Виправлення: Для безпечного MARKDOWN_V2 (рекомендований Telegram),
-    # ми повинні екранувати текст, якщо він не HTML
-    if parse_mode == ParseMode.MARKDOWN_V2:
-        # Ваш оригінальний код намагався обійти проблему Markdown
-        # з непарною кількістю _, але це ненадійний підхід.
-        # Агресивне екранування тексту гарантує відсутність помилок.
-        text = _markdown_v2_escape(text)
+    chunks = _prepare_chunks(text, parse_mode)
+    for number, chunk in enumerate(chunks, 1):
+        message = await context.bot.send_message(
+            chat_id=chat_id,
+            text=chunk,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup if number == len(chunks) else None,
+            message_thread_id=thread_id
+        )
+    return message
 
-    # Використовуємо .encode/.decode для підтримки широкого діапазону символів (як у вашому оригіналі)
-    text = text.encode('utf16', errors='surrogatepass').decode('utf16')
 
-    return await context.bot.send_message(
-        chat_id=chat_id,
-        text=text,
+# замінює текст уже надісланого повідомлення
+async def edit_text(context: ContextTypes.DEFAULT_TYPE, message: Message,
+                    text: str, reply_markup: InlineKeyboardMarkup = None,
+                    parse_mode: ParseMode = ParseMode.MARKDOWN_V2) -> Message:
+    """Редагує текст повідомлення (наприклад, заглушки "Обробляю...") замість видалення та нового надсилання.
+
+    Якщо текст не вміщується в одне повідомлення, решта надсилається новими
+    повідомленнями після нього; повертається останнє (з кнопками).
+    """
+    chunks = _prepare_chunks(text, parse_mode)
+    message = await context.bot.edit_message_text(
+        chat_id=message.chat_id,
+        message_id=message.message_id,
+        text=chunks[0],
         parse_mode=parse_mode,
-        reply_markup=reply_markup,
-        message_thread_id=thread_id
+        reply_markup=reply_markup if len(chunks) == 1 else None
     )
+    for number, chunk in enumerate(chunks[1:], 2):
+        message = await context.bot.send_message(
+            chat_id=message.chat_id,
+            text=chunk,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup if number == len(chunks) else None,
+            message_thread_id=message.message_thread_id
+        )
+    return message
+
+
+class StreamingMessage:
+    """Поступово дописує відповідь моделі в уже надіслане повідомлення.
+
+    Telegram обмежує частоту редагувань (приблизно одне на секунду в чаті),
+    тому проміжні редагування виконуються не частіше за min_interval і лише
+    на межі слова. Текст щоразу екранується повністю, тож escape-послідовності
+    MarkdownV2 ніколи не розриваються посередині; розмітку може містити лише prefix (md()).
+
+    Коли відповідь перестає вміщуватися в повідомлення, його заповнена частина
+    фіксується, а текст продовжується в новому повідомленні; кнопки отримує останнє.
+    """
+
+    def __init__(self, context: ContextTypes.DEFAULT_TYPE, message: Message,
+                 prefix: str = '', min_interval: float = 1.0,
+                 parse_mode: ParseMode = ParseMode.MARKDOWN_V2):
+        self.context = context
+        self.message = message
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.parse_mode = parse_mode
+        self.text = ''
+        # Частина self.text, що вже зафіксована в попередніх повідомленнях
+        self._offset = 0
+        self._shown = None
+        self._next_edit_at = 0.0
+
+    async def write(self, delta: str) -> None:
+        """Додає частину відповіді та, якщо дозволяє ліміт, оновлює повідомлення."""
+        self.text += delta
+        if time.monotonic() < self._next_edit_at:
+            return
+        # Показуємо текст лише до останнього пробілу, щоб не відображати обірвані слова
+        boundary = max(self.text.rfind(' '), self.text.rfind('\n'))
+        if boundary > self._offset:
+            await self._edit(self.text[:boundary])
+
+    async def finish(self, reply_markup: InlineKeyboardMarkup = None) -> Message:
+        """Показує повну відповідь разом із кнопками."""
+        await self._edit(self.text, reply_markup, final=True)
+        return self.message
+
+    def _render(self, text: str) -> str:
+        # Префікс — лише в першому повідомленні
+        body = text[self._offset:]
+        if self.parse_mode != ParseMode.MARKDOWN_V2:
+            return (self.prefix if not self._offset else '') + body
+        return render(self.prefix if not self._offset else '') + body
+
+    async def _edit(self, text: str, reply_markup: InlineKeyboardMarkup = None, final: bool = False) -> None:
+        rendered = self._render(text)
+        while self.parse_mode == ParseMode.MARKDOWN_V2 and utf16_len(rendered) > MESSAGE_LIMIT:
+            # Повідомлення заповнене: фіксуємо його та продовжуємо в новому
+            chunk, rendered = take_chunk(rendered)
+            await self._until_sent(edit_text, self.context, self.message, chunk, None, self.parse_mode)
+            first, _ = take_chunk(rendered)
+            self.message = await self._until_sent(
+                self.context.bot.send_message, chat_id=self.message.chat_id,
+                text=_prepare_text(first, self.parse_mode), parse_mode=self.parse_mode,
+                message_thread_id=self.message.message_thread_id)
+            # Решта екранованого тексту відповідає хвосту self.text такої ж вихідної довжини
+            self._offset = len(text) - plain_length(rendered)
+            self._shown = first
+
+        if rendered == self._shown and reply_markup is None:
+            return
+        try:
+            await edit_text(self.context, self.message, rendered, reply_markup, self.parse_mode)
+            self._shown = rendered
+        except RetryAfter as e:
+            delay = _retry_after_seconds(e)
+            if final:
+                await asyncio.sleep(delay)
+                return await self._edit(text, reply_markup, final)
+            self._next_edit_at = time.monotonic() + delay
+            return
+        except BadRequest as e:
+            # Telegram відхиляє редагування без змін — це не помилка для нас
+            if 'not modified' not in str(e).lower():
+                raise
+        self._next_edit_at = time.monotonic() + self.min_interval
+
+    @staticmethod
+    async def _until_sent(method, *args, **kwargs):
+        # Заповнене повідомлення не можна пропустити, тож на RetryAfter чекаємо, а не відкладаємо
+        while True:
+            try:
+                return await method(*args, **kwargs)
+            except RetryAfter as e:
+                await asyncio.sleep(_retry_after_seconds(e))
+            except BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    raise
+                return None
+
+
+class _Job(Generic[T]):
+    # Завдання FanOut; await з тіла блоку означає, що результат і помилку обробляє саме тіло
+    __slots__ = ('task', 'claimed')
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.claimed = False
+
+    def __await__(self) -> Generator[None, None, T]:
+        self.claimed = True
+        return self.task.__await__()
+
+
+class FanOut:
+    """Незалежні виклики одного обробника виконуються одночасно, а не по черзі.
+
+    Повідомлення в тілі блоку надсилаються звичайним await одне за одним — порядок
+    у чаті зберігається. start() запускає незалежну роботу (запит до моделі,
+    set_my_commands, відповідь на натискання кнопки) одразу, тож обробник триває
+    стільки, скільки найповільніший виклик, а не сума всіх:
+
+        async with FanOut() as fan:
+            questions = fan.start(quiz_pool.take(5))
+            await send_image(update, context, 'quiz')
+            quiz.questions = await questions
+
+    На виході блок дочікується всієї запущеної роботи; помилка роботи, яку тіло
+    не дочікувалося саме, піднімається з блоку. Якщо впало тіло, незавершена
+    робота скасовується.
+
+    Потік відповіді моделі не можна читати частково в start(): таймаути потоку
+    прив'язані до задачі, що його читає, тож у фон виносяться надсилання, а потік
+    читає сам обробник.
+    """
+
+    def __init__(self):
+        self._jobs: list[_Job] = []
+
+    def start(self, awaitable: Awaitable[T]) -> _Job[T]:
+        job = _Job(asyncio.ensure_future(awaitable))
+        self._jobs.append(job)
+        return job
+
+    async def __aenter__(self) -> 'FanOut':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        tasks = [job.task for job in self._jobs]
+        if exc_type is not None:
+            for task in tasks:
+                task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        if exc_type is not None:
+            return
+        for job, result in zip(self._jobs, results):
+            if not job.claimed and isinstance(result, BaseException):
+                raise result
 
 
 # надсилає в чат html повідомлення
@@ -108,35 +304,104 @@ async def send_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE,
                             text: str, buttons: dict,
                             parse_mode: ParseMode = ParseMode.MARKDOWN_V2) -> Message:
     """Надсилає повідомлення з кнопками InlineKeyboardMarkup."""
+    # Використовуємо загальну функцію send_text
+    return await send_text(update, context, text, buttons_markup(buttons), parse_mode)
 
+
+# будує клавіатуру з кнопок виду {callback_data: підпис}
+def buttons_markup(buttons: dict) -> InlineKeyboardMarkup:
+    """Створює InlineKeyboardMarkup, по одній кнопці в рядку."""
     keyboard = []
     for key, value in buttons.items():
         # Важливо: значення кнопок (value) не потрібно екранувати, оскільки воно не проходить парсер
         button = InlineKeyboardButton(str(value), callback_data=str(key))
         keyboard.append([button])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup(keyboard)
 
-    # Використовуємо загальну функцію send_text
-    return await send_text(update, context, text, reply_markup, parse_mode)
+
+class FileIdCache:
+    """Постійний кеш file_id зображень, уже завантажених у Telegram.
+
+    Запис прив'язаний до хешу вмісту файлу: якщо зображення змінилося,
+    збережений file_id ігнорується і файл завантажується заново.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: dict[str, dict] = {}
+        try:
+            with open(path, 'r', encoding='utf8') as file:
+                self._entries = json.load(file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не вдалося прочитати кеш file_id {path}: {e}")
+
+    def get(self, name: str, content_hash: str) -> str | None:
+        entry = self._entries.get(name)
+        if entry and entry.get('hash') == content_hash:
+            return entry.get('file_id')
+        return None
+
+    def put(self, name: str, content_hash: str, file_id: str) -> None:
+        self._entries[name] = {'hash': content_hash, 'file_id': file_id}
+        self._save()
+
+    def invalidate(self, name: str) -> None:
+        if self._entries.pop(name, None) is not None:
+            self._save()
+
+    def _save(self) -> None:
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Пишемо у тимчасовий файл і атомарно замінюємо, щоб не пошкодити кеш при збої
+            # Тимчасовий файл унікальний для процесу: у webhook-режимі кеш спільний для кількох процесів
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf8') as file:
+                json.dump(self._entries, file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не вдалося зберегти кеш file_id {self.path}: {e}")
+
+
+image_cache = FileIdCache(FILE_ID_CACHE_PATH)
 
 
 # надсилає в чат фото
 async def send_image(update: Update, context: ContextTypes.DEFAULT_TYPE,
                      name: str) -> Message:
-    """Надсилає фото з локального файлу."""
-    file_path = os.path.join('resources', 'images', f'{name}.jpg')
+    """Надсилає фото: повторно використовує file_id, а з диска завантажує лише вперше."""
+    image_info = resources.image(name)
 
-    if not os.path.exists(file_path):
-        logger.error(f"Файл зображення не знайдено: {file_path}")
-        return await send_text(update, context,
-                               f"😔 Зображення _{name}_ не знайдено.",
-                               parse_mode=ParseMode.MARKDOWN)
+    if image_info is None:
+        logger.error(f"Файл зображення не знайдено: {os.path.join('resources', 'images', f'{name}.jpg')}")
+        return await send_text(update, context, md("😔 Зображення _{name}_ не знайдено.", name=name))
 
-    with open(file_path, 'rb') as image:
-        return await context.bot.send_photo(chat_id=_get_chat_id(update),
-                                            photo=image,
-                                            message_thread_id=_get_thread_id(update))
+    chat_id = _get_chat_id(update)
+    thread_id = _get_thread_id(update)
+    content_hash = image_info.sha256
+
+    file_id = image_cache.get(name, content_hash)
+    if file_id:
+        try:
+            return await context.bot.send_photo(chat_id=chat_id, photo=file_id,
+                                                message_thread_id=thread_id)
+        except BadRequest as e:
+            # file_id міг стати недійсним (наприклад, після зміни токена бота)
+            logger.warning(f"file_id для зображення {name} відхилено ({e}), завантажую файл заново.")
+            image_cache.invalidate(name)
+
+    with open(image_info.path, 'rb') as image:
+        message = await context.bot.send_photo(chat_id=chat_id,
+                                               photo=image,
+                                               message_thread_id=thread_id)
+    if message.photo:
+        # Найбільший розмір фото — останній у списку
+        image_cache.put(name, content_hash, message.photo[-1].file_id)
+    return message
 
 
 # ===============================================
@@ -150,13 +415,11 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE,
     chat_id = _get_chat_id(update)
     command_list = [BotCommand(key, value) for key, value in commands.items()]
 
-    # Встановлення команд
-    await context.bot.set_my_commands(command_list, scope=BotCommandScopeChat(
-        chat_id=chat_id))
-
-    # Встановлення кнопки меню (це може бути зайвим, якщо ви встановлюєте команди)
-    await context.bot.set_chat_menu_button(menu_button=MenuButtonCommands(),
-                                           chat_id=chat_id)
+    # Команди та кнопка меню не залежать одне від одного — встановлюємо одночасно
+    await asyncio.gather(
+        context.bot.set_my_commands(command_list, scope=BotCommandScopeChat(chat_id=chat_id)),
+        context.bot.set_chat_menu_button(menu_button=MenuButtonCommands(), chat_id=chat_id)
+    )
 
 
 # видаляємо команди для конкретного чату
@@ -169,28 +432,24 @@ async def hide_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                            chat_id=chat_id)
 
 
-# завантажує повідомлення з папки /resources/messages/
+# повертає повідомлення з папки /resources/messages/
 def load_message(name):
-    """Завантажує вміст текстового повідомлення з файлу."""
-    file_path = os.path.join("resources", "messages", f"{name}.txt")
-    try:
-        with open(file_path, "r", encoding="utf8") as file:
-            return file.read()
-    except FileNotFoundError:
-        logger.error(f"Файл повідомлення не знайдено: {file_path}")
+    """Повертає текст повідомлення з реєстру ресурсів, готовий до MarkdownV2 (*жирний*, _курсив_)."""
+    text = resources.message(name)
+    if text is None:
+        logger.error(f"Файл повідомлення не знайдено: {os.path.join('resources', 'messages', f'{name}.txt')}")
         return f"Помилка: Повідомлення '{name}' не знайдено."
+    return markup(text)
 
 
-# завантажує промпт з папки /resources/prompts/
+# повертає промпт з папки /resources/prompts/
 def load_prompt(name):
-    """Завантажує вміст промпта (інструкції для AI) з файлу."""
-    file_path = os.path.join("resources", "prompts", f"{name}.txt")
-    try:
-        with open(file_path, "r", encoding="utf8") as file:
-            return file.read()
-    except FileNotFoundError:
-        logger.error(f"Файл промпта не знайдено: {file_path}")
+    """Повертає вміст промпта (інструкції для AI) з реєстру ресурсів."""
+    text = resources.prompt(name)
+    if text is None:
+        logger.error(f"Файл промпта не знайдено: {os.path.join('resources', 'prompts', f'{name}.txt')}")
         return f"Помилка: Промпт '{name}' не знайдено."
+    return text
 
 
 async def default_callback_handler(update: Update,
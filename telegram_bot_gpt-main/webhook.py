@@ -0,0 +1,412 @@
+"""Режим webhook: вбудований ASGI-сервер та кілька процесів-обробників.
+
+Запуск: python webhook.py (налаштування — змінні WEBHOOK_* у .env).
+
+Головний процес приймає оновлення від Telegram, записує їх у журнал (SQLite)
+і передає процесу-обробнику за user_id % WEBHOOK_WORKERS — тим самим ключем,
+за яким SQLitePersistence зберігає сесії, — тож усі оновлення одного користувача
+(в особистому чаті й у групах) обробляє один процес у порядку надходження, а
+різні користувачі — паралельно на різних ядрах. Обробник позначає оновлення
+виконаним лише після обробки, тому після перезапуску необроблені оновлення з
+журналу надсилаються повторно. Процес-обробник, що впав, запускається знову й
+отримує свої необроблені оновлення з журналу.
+
+Обробники періодично надсилають головному процесу знімки своїх метрик; GET /metrics
+віддає суму метрик головного процесу й останніх знімків усіх обробників.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.queues import Queue
+from typing import Any, Callable
+
+import uvicorn
+from telegram import Bot, Update
+
+import credentials
+from metrics import MetricsRegistry, registry as metrics
+from credentials import (
+    BOT_TOKEN, QUIZ_POOL_PATH, UPDATE_JOURNAL_PATH, WEBHOOK_LISTEN, WEBHOOK_PATH, WEBHOOK_PORT,
+    WEBHOOK_SECRET, WEBHOOK_URL, WEBHOOK_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+# Як часто головний процес перевіряє обробники та чистить журнал (секунди)
+_SUPERVISE_INTERVAL = 5.0
+_PURGE_INTERVAL = 600.0
+# Скільки останніх виконаних оновлень лишається в журналі, щоб розпізнати повторну доставку
+_KEEP_DONE = 10000
+# Як часто обробник надсилає головному процесу знімок своїх метрик (секунди)
+_METRICS_INTERVAL = 5.0
+
+
+def update_shard_key(data: dict) -> int:
+    """Ключ шардування сирого оновлення: id користувача (як у SQLitePersistence),
+    а для оновлень без користувача (пости каналів) — chat_id."""
+    for value in data.values():
+        if isinstance(value, dict):
+            for key in ('from', 'user'):
+                if isinstance(value.get(key), dict):
+                    return value[key]['id']
+    for value in data.values():
+        if isinstance(value, dict) and isinstance(value.get('chat'), dict):
+            return value['chat']['id']
+    return 0
+
+
+class UpdateJournal:
+    """Журнал оновлень у SQLite: переживає перезапуск і відстежує, що вже оброблено.
+
+    Файл спільний для всіх процесів, і запит може чекати на блокування до 30 секунд,
+    тому з асинхронного коду синхронні методи викликаються лише через submit — у власному
+    потоці журналу, по одному й у порядку подання.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='update-journal')
+        self._done: list[int] = []
+        self._flushing: asyncio.Future | None = None
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS updates (update_id INTEGER PRIMARY KEY, '
+                         'payload TEXT NOT NULL, done INTEGER NOT NULL DEFAULT 0)')
+        self._db.commit()
+
+    def submit(self, function: Callable[..., Any], *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def append(self, update_id: int, payload: str) -> bool:
+        """Записує оновлення. Повертає False, якщо воно вже є (Telegram повторив доставку)."""
+        cursor = self._db.execute('INSERT OR IGNORE INTO updates (update_id, payload) VALUES (?, ?)',
+                                  (update_id, payload))
+        self._db.commit()
+        return cursor.rowcount == 1
+
+    def mark_done(self, *update_ids: int) -> None:
+        self._db.executemany('UPDATE updates SET done = 1 WHERE update_id = ?',
+                             [(update_id,) for update_id in update_ids])
+        self._db.commit()
+
+    def finish(self, update_id: int) -> None:
+        """Позначає оновлення виконаним у фоні. Позначки, що накопичилися, поки записувалася
+        попередня, фіксуються одним комітом."""
+        self._done.append(update_id)
+        if self._flushing is None:
+            self._flush()
+
+    def _flush(self) -> None:
+        update_ids, self._done = self._done, []
+        self._flushing = self.submit(self.mark_done, *update_ids)
+        self._flushing.add_done_callback(self._flushed)
+
+    def _flushed(self, future: asyncio.Future) -> None:
+        self._flushing = None
+        if not future.cancelled() and future.exception() is not None:
+            # Непозначені оновлення буде повторено після перезапуску — це безпечніше, ніж загубити їх
+            logger.warning(f"Не вдалося позначити оновлення виконаними: {future.exception()}")
+        if self._done:
+            self._flush()
+
+    def pending(self) -> list[tuple[int, str]]:
+        """Необроблені оновлення в порядку надходження."""
+        return self._db.execute('SELECT update_id, payload FROM updates WHERE done = 0 '
+                                'ORDER BY update_id').fetchall()
+
+    def purge_done(self, keep: int = 0) -> int:
+        """Видаляє виконані оновлення, крім keep останніх за update_id. Повертає кількість видалених."""
+        cursor = self._db.execute('DELETE FROM updates WHERE done = 1 AND update_id <= '
+                                  '(SELECT MAX(update_id) FROM updates) - ?', (keep,))
+        self._db.commit()
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self._db.close()
+
+    async def aclose(self) -> None:
+        """Дописує відкладені позначки й закриває журнал."""
+        while self._flushing is not None:
+            await asyncio.wait([self._flushing])
+        await self.submit(self.close)
+        self._executor.shutdown(wait=False)
+
+
+# ===============================================
+#             ПРОЦЕС-ОБРОБНИК
+# ===============================================
+
+def _worker_main(shard: int, queue: Queue, metrics_queue: Queue) -> None:
+    if QUIZ_POOL_PATH:
+        # Кожен процес має власний пул квізів, тож і файл для нього окремий
+        credentials.QUIZ_POOL_PATH = f'{QUIZ_POOL_PATH}.{shard}'
+    asyncio.run(_run_worker(shard, queue, metrics_queue))
+
+
+async def _report_metrics(shard: int, metrics_queue: Queue) -> None:
+    while True:
+        metrics_queue.put((shard, metrics.snapshot()))
+        await asyncio.sleep(_METRICS_INTERVAL)
+
+
+async def _run_worker(shard: int, queue: Queue, metrics_queue: Queue) -> None:
+    # Імпортуємо бота лише в процесі-обробнику: головному процесу обробники не потрібні
+    from bot import app
+
+    journal = UpdateJournal(UPDATE_JOURNAL_PATH)
+    loop = asyncio.get_running_loop()
+    tasks: set[asyncio.Task] = set()
+
+    async def handle(update_id: int, payload: str) -> None:
+        try:
+            update = Update.de_json(json.loads(payload), app.bot)
+            await app.update_processor.process_update(update, app.process_update(update))
+        except Exception as e:
+            logger.error(f"Обробник {shard}: помилка обробки оновлення {update_id}: {e}")
+        journal.finish(update_id)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    logger.info(f"Обробник {shard} запущено (pid {os.getpid()}).")
+    reporter = asyncio.create_task(_report_metrics(shard, metrics_queue))
+
+    try:
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is None:
+                break
+            # Задачі створюються в порядку надходження; порядок у межах чату забезпечує update_processor
+            task = asyncio.create_task(handle(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        await asyncio.gather(*tasks, return_exceptions=True)
+        reporter.cancel()
+        metrics_queue.put((shard, metrics.snapshot()))
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        await journal.aclose()
+
+
+# ===============================================
+#             ГОЛОВНИЙ ПРОЦЕС (ASGI)
+# ===============================================
+
+class WebhookServer:
+    """ASGI-застосунок, що приймає оновлення від Telegram і розподіляє їх між обробниками."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.journal: UpdateJournal | None = None
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: dict[int, Queue] = {}
+        self._processes: list[multiprocessing.Process] = []
+        self._metrics_queue = self._context.Queue()
+        self._worker_metrics: dict[int, list[tuple]] = {}
+        self._supervisor: asyncio.Task | None = None
+        self.received = metrics.counter('webhook_updates_received_total', 'Updates accepted from Telegram')
+        self.duplicates = metrics.counter('webhook_updates_duplicate_total', 'Repeated deliveries of the same update')
+        self.restarts = metrics.counter('webhook_worker_restarts_total', 'Worker processes restarted after a crash')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    def shard(self, payload: str) -> int:
+        return update_shard_key(json.loads(payload)) % self.workers
+
+    def dispatch(self, update_id: int, payload: str, shard: int) -> None:
+        """Передає оновлення обробнику, який відповідає за цього користувача."""
+        self._queues[shard].put((update_id, payload))
+
+    # Методи нижче виконуються в потоці журналу (journal.submit): запис оновлення з відправкою
+    # та повтор із заміною черги впорядковані між собою, тож оновлення, прийняте під час
+    # перезапуску обробника, не загубиться й не потрапить до нього двічі.
+
+    def _accept(self, update_id: int, payload: str, shard: int) -> bool:
+        if not self.journal.append(update_id, payload):
+            return False
+        self.dispatch(update_id, payload, shard)
+        return True
+
+    def _replay(self, queues: dict[int, Queue]) -> int:
+        """Встановлює нові черги обробників і передає в них їхні необроблені оновлення з журналу."""
+        self._queues.update(queues)
+        replayed = 0
+        for update_id, payload in self.journal.pending():
+            shard = self.shard(payload)
+            if shard in queues:
+                self.dispatch(update_id, payload, shard)
+                replayed += 1
+        return replayed
+
+    def _start_worker(self, shard: int) -> Queue:
+        # Кожен запуск має нову чергу: у черзі впалого процесу могли лишитися взяті ним оновлення.
+        # Черга стає робочою лише в _replay, після передачі необроблених оновлень
+        queue = self._context.Queue()
+        process = self._context.Process(target=_worker_main, args=(shard, queue, self._metrics_queue),
+                                        name=f'bot-worker-{shard}', daemon=True)
+        process.start()
+        if shard < len(self._processes):
+            self._processes[shard] = process
+        else:
+            self._processes.append(process)
+        return queue
+
+    def _collect_metrics(self) -> None:
+        # Лишаємо останній знімок кожного обробника; знімок перезапущеного замінює знімок попереднього процесу
+        while True:
+            try:
+                shard, snapshot = self._metrics_queue.get_nowait()
+            except queue_module.Empty:
+                return
+            self._worker_metrics[shard] = snapshot
+
+    def render_metrics(self) -> str:
+        """Метрики головного процесу разом з останніми знімками метрик обробників."""
+        self._collect_metrics()
+        combined = MetricsRegistry()
+        combined.merge(metrics.snapshot())
+        for snapshot in self._worker_metrics.values():
+            combined.merge(snapshot)
+        return combined.render()
+
+    async def _supervise(self) -> None:
+        # Перезапускає впалі обробники та періодично чистить журнал від виконаних оновлень
+        loop = asyncio.get_running_loop()
+        next_purge = loop.time() + _PURGE_INTERVAL
+        while True:
+            await asyncio.sleep(_SUPERVISE_INTERVAL)
+            self._collect_metrics()
+            for shard, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                logger.error(f"Обробник {shard} завершився (код {process.exitcode}), перезапускаю.")
+                self.restarts.inc()
+                replayed = await self.journal.submit(self._replay, {shard: self._start_worker(shard)})
+                if replayed:
+                    logger.info(f"Обробнику {shard} повторно передано {replayed} необроблених оновлень.")
+            if loop.time() >= next_purge:
+                next_purge = loop.time() + _PURGE_INTERVAL
+                try:
+                    await self.journal.submit(self.journal.purge_done, _KEEP_DONE)
+                except sqlite3.Error as e:
+                    logger.warning(f"Не вдалося очистити журнал оновлень: {e}")
+
+    async def startup(self) -> None:
+        self.journal = UpdateJournal(UPDATE_JOURNAL_PATH)
+        await self.journal.submit(self.journal.purge_done, _KEEP_DONE)
+
+        queues = {shard: self._start_worker(shard) for shard in range(self.workers)}
+        # Оновлення, не оброблені до перезапуску, передаємо обробникам першими
+        replayed = await self.journal.submit(self._replay, queues)
+        if replayed:
+            logger.info(f"Повторно передано {replayed} необроблених оновлень.")
+        self._supervisor = asyncio.create_task(self._supervise())
+
+        async with Bot(BOT_TOKEN) as bot:
+            await bot.set_webhook(url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                                  secret_token=WEBHOOK_SECRET or None,
+                                  allowed_updates=Update.ALL_TYPES,
+                                  drop_pending_updates=False)
+        logger.info(f"Webhook встановлено, обробників: {self.workers}.")
+
+    async def shutdown(self) -> None:
+        # Під час зупинки обробники завершуються штатно — не перезапускаємо їх
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+        for queue in self._queues.values():
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, 30)
+        if self.journal is not None:
+            await self.journal.aclose()
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.error(f"Не вдалося запустити webhook-сервер: {e}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send) -> None:
+        if scope['method'] == 'GET' and scope['path'] == '/metrics':
+            return await self._respond(send, 200, self.render_metrics())
+        if scope['method'] == 'GET' and scope['path'] == '/healthz':
+            alive = sum(process.is_alive() for process in self._processes)
+            return await self._respond(send, 200 if alive == self.workers else 503,
+                                       f'{alive}/{self.workers} workers alive')
+        if scope['method'] != 'POST' or scope['path'] != WEBHOOK_PATH:
+            return await self._respond(send, 404, 'Not Found')
+
+        headers = dict(scope['headers'])
+        if WEBHOOK_SECRET and headers.get(b'x-telegram-bot-api-secret-token', b'').decode() != WEBHOOK_SECRET:
+            return await self._respond(send, 403, 'Forbidden')
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        try:
+            data = json.loads(body)
+            update_id = int(data['update_id'])
+        except (ValueError, KeyError, TypeError):
+            return await self._respond(send, 400, 'Bad Request')
+
+        payload = body.decode('utf-8')
+        # Спочатку журнал, потім відповідь Telegram: прийняте оновлення не загубиться
+        if await self.journal.submit(self._accept, update_id, payload, update_shard_key(data) % self.workers):
+            self.received.inc()
+        else:
+            self.duplicates.inc()
+        await self._respond(send, 200, 'OK')
+
+    @staticmethod
+    async def _respond(send, status: int, text: str) -> None:
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+
+def main() -> None:
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    if not WEBHOOK_URL:
+        raise SystemExit("Для режиму webhook потрібно вказати WEBHOOK_URL у .env")
+    uvicorn.run(WebhookServer(WEBHOOK_WORKERS), host=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+                lifespan='on', log_level='info')
+
+
+if __name__ == '__main__':
+    main()